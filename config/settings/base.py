@@ -130,6 +130,8 @@ AUTH_PASSWORD_VALIDATORS = [
 # ------------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#middleware
 MIDDLEWARE = [
+    # first, so it times everything below; removes itself unless enabled
+    "delivery.delivery.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -169,7 +171,7 @@ MEDIA_URL = "/media/"
 TEMPLATES = [
     {
         # https://docs.djangoproject.com/en/dev/ref/settings/#std:setting-TEMPLATES-BACKEND
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "BACKEND": "delivery.delivery.profiling.TimedDjangoTemplates",
         # https://docs.djangoproject.com/en/dev/ref/settings/#template-dirs
         "DIRS": [str(APPS_DIR / "templates")],
         "OPTIONS": {
@@ -284,9 +286,22 @@ APPLICATION_VERSION = env("APPLICATION_VERSION", default="unspecified")
 CLOVER_API_KEY = env("CLOVER_API_KEY")
 CLOVER_MERCHANT_ID = env("CLOVER_MERCHANT_ID")
 CLOVER_INTEGRATION_API = env("CLOVER_INTEGRATION_API")
+CLOVER_WEBHOOK_AUTH_CODE = env("CLOVER_WEBHOOK_AUTH_CODE", default=None)
 ONFLEET_API_KEY = env("ONFLEET_API_KEY")
 ONFLEET_INTEGRATION_API = env("ONFLEET_INTEGRATION_API")
+ONFLEET_WEBHOOK_SECRET = env("ONFLEET_WEBHOOK_SECRET", default=None)
 SHOPIFY_APP_URL = env("SHOPIFY_APP_URL")
 SHOPIFY_API_VERSION = env("SHOPIFY_API_VERSION")
 SHOPIFY_APP_SECRET = env("SHOPIFY_APP_SECRET")
+SHOPIFY_WEBHOOK_SECRET = env("SHOPIFY_WEBHOOK_SECRET", default=None)
+# seconds between New Order searches while a live page is open
+LIVE_POLL_INTERVAL = env.int("LIVE_POLL_INTERVAL", default=30)
+# seconds between full Onfleet refreshes of the live truck board; webhooks
+# keep it current in between
+TRUCK_BOARD_POLL_INTERVAL = env.int("TRUCK_BOARD_POLL_INTERVAL", default=300)
+# per-request timings in Server-Timing headers, logs and the admin
+# profiling page; off by default
+PROFILING_ENABLED = env.bool("PROFILING_ENABLED", default=False)
+# requests kept per view for the profiling page's percentiles
+PROFILING_SAMPLE_SIZE = env.int("PROFILING_SAMPLE_SIZE", default=500)
 # ------------------------------------------------------------------------------
@@ -1,4 +1,11 @@
+from delivery.delivery.live import LIVE_FEED_PREFIX, live_feed
+
+
 async def websocket_application(scope, receive, send):
+    if scope["path"].startswith(LIVE_FEED_PREFIX):
+        await live_feed(scope, receive, send)
+        return
+
     while True:
         event = await receive()
 
@@ -1,34 +1,57 @@
+import asyncio
 import datetime
 import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from os import path
-from typing import Dict, List, Optional, Sequence, Set
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence
 
+import dateutil.parser
+import pytz
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.db.models.functions import Upper
+from django.utils import timezone
 
 from delivery.utils.typing import none_throws
 
+from .clients import CloverClient, OnfleetClient, ShopifyClient
 from .clover import (
     get_delivery_type,
+    get_order_customer,
+    parse_customer_phone_number,
     parse_shopify_order_number,
-    request_clover_customer_list,
+    prefetch_clover_customers,
+    request_clover_orders,
     search_clover_by_dates,
 )
-from .models import Delivery
-from .shopify import ShopifyOrderInfo
+from .models import Delivery, OrderEvent, Shift
+from .onfleet import task_order_number
+from .profiling import timed
+from .shopify import ShopifyOrderInfo, cache_order_info, cached_order_info
+from .shopify import get_data_by_ids as get_shopify_data_by_ids
 from .shopify import get_data_by_time_range as get_shopify_data_by_time_range
-from .shopify import get_data_from_shopify_by_name
+from .shopify import get_data_from_shopify_by_name, name_search
+from .shopify import parse_orders as parse_shopify_orders
+from .shopify import time_range_search, uncached_names
+from .signals import defer_shift_count_updates
+
+SYNC_MAX_WORKERS = 8
 
 
 def create_onfleet_task_from_order(obj):
     if obj.address_line_1 is None:
         raise ValueError("No address associated with order")
-    response = requests.post(
-        path.join(settings.ONFLEET_INTEGRATION_API, "tasks"),
-        auth=requests.auth.HTTPBasicAuth(settings.ONFLEET_API_KEY, None),
-        data=json.dumps(obj.serialize_for_onfleet()),
-    )
+    with timed("onfleet"):
+        response = requests.post(
+            path.join(settings.ONFLEET_INTEGRATION_API, "tasks"),
+            auth=requests.auth.HTTPBasicAuth(settings.ONFLEET_API_KEY, None),
+            data=json.dumps(obj.serialize_for_onfleet()),
+        )
     if response.status_code != 200:
         try:
             data = response.json()
@@ -39,14 +62,16 @@ def create_onfleet_task_from_order(obj):
 
 
 def create_onfleet_tasks_from_shift(obj):
-    tasks = obj.delivery_set.exclude(address_line_1=None)
-    if tasks.count() < 1:
+    deliveries = obj.delivery_set.exclude(address_line_1=None).filter(cancelled_at=None)
+    tasks = Delivery.serialize_many_for_onfleet(deliveries)
+    if len(tasks) < 1:
         raise ValueError("No valid orders in this shift")
-    response = requests.post(
-        path.join(settings.ONFLEET_INTEGRATION_API, "tasks", "batch"),
-        auth=requests.auth.HTTPBasicAuth(settings.ONFLEET_API_KEY, None),
-        data=json.dumps({"tasks": [t.serialize_for_onfleet() for t in tasks]}),
-    )
+    with timed("onfleet"):
+        response = requests.post(
+            path.join(settings.ONFLEET_INTEGRATION_API, "tasks", "batch"),
+            auth=requests.auth.HTTPBasicAuth(settings.ONFLEET_API_KEY, None),
+            data=json.dumps({"tasks": tasks}),
+        )
     response.raise_for_status()
     data = response.json()
     created = data.get("tasks")
@@ -62,55 +87,148 @@ def create_onfleet_tasks_from_shift(obj):
         "{nc} of {ns} orders created. Missing: {missing}".format(
             nc=num_created,
             ns=len(tasks),
-            missing=[t.order_number for t in tasks if t.order_number not in orders],
+            missing=[
+                order_number
+                for order_number in deliveries.values_list("order_number", flat=True)
+                if order_number not in orders
+            ],
         )
     )
 
 
+ONFLEET_OPEN_TASKS_PARAMS = {"from": "1514793600000", "state": "1"}
+
+
+def get_onfleet(resource: str, params: Optional[Dict] = None):
+    with timed("onfleet"):
+        return requests.get(
+            path.join(settings.ONFLEET_INTEGRATION_API, resource),
+            auth=requests.auth.HTTPBasicAuth(settings.ONFLEET_API_KEY, None),
+            params=params,
+        ).json()
+
+
 def get_onfleet_trucks():
-    response = requests.get(
-        path.join(settings.ONFLEET_INTEGRATION_API, "workers"),
-        auth=requests.auth.HTTPBasicAuth(settings.ONFLEET_API_KEY, None),
-    )
-    content = response.json()
-    if "message" in content and "error" in content["message"]:
-        raise Exception(content["message"]["message"])
+    workers = get_onfleet("workers")
+    teams = get_onfleet("teams")
+    tasks = get_onfleet("tasks", ONFLEET_OPEN_TASKS_PARAMS)
+    return assemble_onfleet_trucks(workers, teams, tasks)
 
-    workers = {x["id"]: x for x in content if len(x["tasks"])}
-    response = requests.get(
-        path.join(settings.ONFLEET_INTEGRATION_API, "teams"),
-        auth=requests.auth.HTTPBasicAuth(settings.ONFLEET_API_KEY, None),
-    )
+
+def assemble_onfleet_trucks(workers_data, teams_data, tasks_data):
+    if "message" in workers_data and "error" in workers_data["message"]:
+        raise Exception(workers_data["message"]["message"])
+
+    workers = {x["id"]: x for x in workers_data if len(x["tasks"])}
     teams = {
-        x["id"]: x for x in response.json() if any((w in workers) for w in x["workers"])
+        x["id"]: x for x in teams_data if any((w in workers) for w in x["workers"])
     }
-    response = requests.get(
-        path.join(settings.ONFLEET_INTEGRATION_API, "tasks"),
-        auth=requests.auth.HTTPBasicAuth(settings.ONFLEET_API_KEY, None),
-        params={"from": "1514793600000", "state": "1"},
-    )
     tasks = {}
-    for task in response.json():
+    order_numbers = {}
+    for task in tasks_data:
         tasks[task["id"]] = task
-        order_metadata = next(
-            (m for m in task["metadata"] if m["name"] == "order_number"), None
-        )
-        if order_metadata is None:
-            continue
-        order_number = order_metadata["value"]
-        try:
-            order = Delivery.objects.get(order_number=order_number)
-        except Delivery.DoesNotExist:
-            continue
-        task["order"] = order
+        order_number = task_order_number(task)
+        if order_number is not None:
+            order_numbers[task["id"]] = order_number
+    orders = Delivery.objects.in_bulk(
+        set(order_numbers.values()), field_name="order_number"
+    )
+    for task_id, order_number in order_numbers.items():
+        if order_number in orders:
+            tasks[task_id]["order"] = orders[order_number]
     return (teams, workers, tasks)
 
 
+async def get_onfleet_trucks_async():
+    workers, teams, tasks = await OnfleetClient().get_trucks_data(
+        ONFLEET_OPEN_TASKS_PARAMS
+    )
+    return await sync_to_async(assemble_onfleet_trucks)(workers, teams, tasks)
+
+
+class CandidateOrder(NamedTuple):
+    # what the New Order page needs, without building a Delivery per order;
+    # a NamedTuple rather than a slotted dataclass, which needs Python 3.10
+    order_number: Optional[str]
+    created_at: datetime.datetime
+    online_id: Optional[str] = None
+    delivery_shift_id: Optional[int] = None
+    delivery_type: Optional[int] = None
+    recipient_first_name: Optional[str] = None
+    recipient_last_name: Optional[str] = None
+    recipient_phone_number: Optional[str] = None
+    # set when the order has already been scheduled
+    delivery: Optional[Delivery] = None
+
+    @classmethod
+    def from_delivery(cls, delivery: Delivery) -> "CandidateOrder":
+        return cls(delivery.order_number, delivery.created_at, delivery=delivery)
+
+    @classmethod
+    def from_clover(
+        cls, order_data: Dict, customer_data: Dict[str, Dict]
+    ) -> "CandidateOrder":
+        customer = get_order_customer(order_data) or {}
+        details = customer_data.get(customer.get("id", ""), {})
+        return cls(
+            order_data["id"],
+            _clover_created_at(order_data),
+            delivery_type=get_delivery_type(order_data),
+            recipient_first_name=customer.get("firstName") or details.get("firstName"),
+            recipient_last_name=customer.get("lastName") or details.get("lastName"),
+            recipient_phone_number=parse_customer_phone_number(details),
+        )
+
+    @classmethod
+    def from_shopify(
+        cls, info: ShopifyOrderInfo, order_number: str
+    ) -> "CandidateOrder":
+        return cls(
+            order_number,
+            _shopify_created_at(info),
+            online_id=info.online_id,
+            delivery_shift_id=info.shift.id if info.shift else None,
+            recipient_first_name=info.first_name,
+            recipient_last_name=info.last_name,
+            recipient_phone_number=info.phone,
+        )
+
+    def to_delivery(self) -> Delivery:
+        # unsaved and for display only; the full sync happens on save
+        if self.delivery is not None:
+            return self.delivery
+        delivery = Delivery(
+            order_number=self.order_number,
+            online_id=self.online_id,
+            delivery_shift_id=self.delivery_shift_id,
+            recipient_first_name=self.recipient_first_name,
+            recipient_last_name=self.recipient_last_name,
+            recipient_phone_number=self.recipient_phone_number,
+            created_at=self.created_at,
+        )
+        if self.delivery_type is not None:
+            delivery.delivery_type = self.delivery_type
+        return delivery
+
+
+def _clover_created_at(order_data: Dict) -> datetime.datetime:
+    clover_created_time = order_data.get("createdTime", None)
+    if not clover_created_time:
+        return timezone.now()
+    return datetime.datetime.fromtimestamp(clover_created_time / 1000, tz=pytz.UTC)
+
+
+def _shopify_created_at(info: ShopifyOrderInfo) -> datetime.datetime:
+    if not info.created_at:
+        return timezone.now()
+    return dateutil.parser.parse(info.created_at)
+
+
 def search_clover_orders(
     start_date: datetime.date,
     end_date: Optional[datetime.date] = None,
     include_processed: bool = False,
-) -> Sequence[Delivery]:
+) -> Sequence[CandidateOrder]:
     # get data
     clover_orders = search_clover_by_dates(start_date, end_date)
     shopify_delivery_orders: List[ShopifyOrderInfo] = list(
@@ -118,88 +236,303 @@ def search_clover_orders(
             start_date, end_date=end_date, delivery_only=True
         )
     )
-    shopify_names = [o.name for o in shopify_delivery_orders]
+    split = split_clover_orders(clover_orders, shopify_delivery_orders)
+    if split.missing_shopify_names:
+        shopify_delivery_orders.extend(
+            found_shopify_orders(
+                get_data_from_shopify_by_name(
+                    split.missing_shopify_names, delivery_only=True
+                )
+            )
+        )
+
+    # if we're empty, return
+    if not split.clover_delivery_orders and not shopify_delivery_orders:
+        return []
+
+    scheduled = find_scheduled_orders(
+        split.clover_delivery_orders, shopify_delivery_orders
+    )
+    customer_data = prefetch_clover_customers(
+        scheduled.unscheduled_clover_orders(split.clover_delivery_orders)
+    )
+    return build_candidate_orders(
+        split,
+        shopify_delivery_orders,
+        scheduled,
+        customer_data,
+        include_processed=include_processed,
+    )
 
+
+async def search_clover_orders_async(
+    start_date: datetime.date,
+    end_date: Optional[datetime.date] = None,
+    include_processed: bool = False,
+) -> Sequence[CandidateOrder]:
+    # same as search_clover_orders, with the remote calls made concurrently
+    clover_client = CloverClient()
+    shopify_client = ShopifyClient()
+    clover_orders, shopify_data = await asyncio.gather(
+        clover_client.search_by_dates(start_date, end_date),
+        shopify_client.search_orders(time_range_search(start_date, end_date)),
+    )
+    shopify_delivery_orders = await sync_to_async(parse_shopify_orders)(
+        shopify_data, delivery_only=True
+    )
+    split = split_clover_orders(clover_orders, shopify_delivery_orders)
+    if split.missing_shopify_names:
+        shopify_delivery_orders.extend(
+            found_shopify_orders(
+                await get_shopify_data_by_name_async(
+                    shopify_client, split.missing_shopify_names, delivery_only=True
+                )
+            )
+        )
+
+    if not split.clover_delivery_orders and not shopify_delivery_orders:
+        return []
+
+    scheduled = await sync_to_async(find_scheduled_orders)(
+        split.clover_delivery_orders, shopify_delivery_orders
+    )
+    customer_data = await clover_client.prefetch_customers(
+        scheduled.unscheduled_clover_orders(split.clover_delivery_orders)
+    )
+    return build_candidate_orders(
+        split,
+        shopify_delivery_orders,
+        scheduled,
+        customer_data,
+        include_processed=include_processed,
+    )
+
+
+async def get_shopify_data_by_name_async(
+    client: ShopifyClient, order_names: Sequence[str], delivery_only: bool = False
+) -> Mapping[str, Optional[ShopifyOrderInfo]]:
+    unknown = uncached_names(order_names)
+    if unknown:
+        orders = await client.search_orders(name_search(unknown))
+        await sync_to_async(cache_order_info)(orders, delivery_only=delivery_only)
+    return cached_order_info(order_names)
+
+
+@dataclass
+class CloverOrderSplit:
+    clover_delivery_orders: List[Dict]
+    clover_from_shopify: Dict[str, Dict]
+    missing_shopify_names: List[str]
+
+
+def split_clover_orders(
+    clover_orders: Sequence[Dict], shopify_delivery_orders: Sequence[ShopifyOrderInfo]
+) -> CloverOrderSplit:
     # sort orders by clover or shopify
-    clover_delivery_orders: List[Dict] = []
-    clover_from_shopify: Dict[str, Dict] = {}
-    missing_shopify_names: List[str] = []
+    shopify_names = {o.name for o in shopify_delivery_orders}
+    split = CloverOrderSplit([], {}, [])
     for o in clover_orders:
         shopify_name = parse_shopify_order_number(o)
         if shopify_name:
-            clover_from_shopify[shopify_name] = o
+            split.clover_from_shopify[shopify_name] = o
             # get anything that might be delayed out of the time range
             if shopify_name not in shopify_names and get_delivery_type(o):
-                missing_shopify_names.append(shopify_name)
+                split.missing_shopify_names.append(shopify_name)
             continue
         if get_delivery_type(o):
-            clover_delivery_orders.append(o)
-    if missing_shopify_names:
-        for name, v in get_data_from_shopify_by_name(
-            missing_shopify_names, delivery_only=True
-        ).items():
-            if v is None:
-                raise ValueError(f"Unable to find Shopify order {name}")
-            shopify_delivery_orders.append(v)
+            split.clover_delivery_orders.append(o)
+    return split
 
-    # if we're empty, return
-    if not clover_delivery_orders and not shopify_delivery_orders:
-        return []
 
+def found_shopify_orders(
+    info_by_name: Mapping[str, Optional[ShopifyOrderInfo]]
+) -> List[ShopifyOrderInfo]:
+    found = []
+    for name, v in info_by_name.items():
+        if v is None:
+            raise ValueError(f"Unable to find Shopify order {name}")
+        found.append(v)
+    return found
+
+
+@dataclass
+class ScheduledOrders:
+    by_clover_id: Dict[str, Delivery]
+    by_online_id: Dict[str, Delivery]
+
+    def unscheduled_clover_orders(self, clover_orders: Sequence[Dict]) -> List[Dict]:
+        return [co for co in clover_orders if co["id"] not in self.by_clover_id]
+
+
+def find_scheduled_orders(
+    clover_delivery_orders: Sequence[Dict],
+    shopify_delivery_orders: Sequence[ShopifyOrderInfo],
+) -> ScheduledOrders:
     scheduled_clover_orders = Delivery.objects.annotate(
         clover_id=Upper("order_number")
     ).filter(clover_id__in=[o["id"] for o in clover_delivery_orders])
-    scheduled_clover_orders_dict: Dict[str, Delivery] = {
-        o.clover_id: o for o in scheduled_clover_orders
-    }
-
     scheduled_shopify_orders = Delivery.objects.filter(
         online_id__in=[o.online_id for o in shopify_delivery_orders]
     )
-    scheduled_shopify_orders_dict: Dict[str, Delivery] = {
-        none_throws(o.online_id): o for o in scheduled_shopify_orders
-    }
-
-    # TEMP: prepopulate the customer cache because the clover orders call doesn't return details
-    incomplete_customers: Set[str] = set()
-    for o in clover_delivery_orders:
-        if "customers" not in o:
-            continue
-        customers = o["customers"]["elements"]
-        if len(customers) != 1:
-            continue
-        customer = customers[0]
-        # treat as proxy for complete
-        if "addresses" in customer:
-            continue
-        incomplete_customers.add(customer["id"])
+    return ScheduledOrders(
+        {o.clover_id: o for o in scheduled_clover_orders},
+        {none_throws(o.online_id): o for o in scheduled_shopify_orders},
+    )
 
-    _ = request_clover_customer_list(list(incomplete_customers))
-    # END TEMP
 
-    orders: List[Delivery] = []
-    for co in clover_delivery_orders:
-        if co["id"] in scheduled_clover_orders_dict:
+def build_candidate_orders(
+    split: CloverOrderSplit,
+    shopify_delivery_orders: Sequence[ShopifyOrderInfo],
+    scheduled: ScheduledOrders,
+    customer_data: Dict[str, Dict],
+    include_processed: bool = False,
+) -> List[CandidateOrder]:
+    orders: List[CandidateOrder] = []
+    for co in split.clover_delivery_orders:
+        if co["id"] in scheduled.by_clover_id:
             if include_processed:
-                orders.append(scheduled_clover_orders_dict[o["id"]])
+                orders.append(
+                    CandidateOrder.from_delivery(scheduled.by_clover_id[co["id"]])
+                )
         else:
-            delivery = Delivery.create_from_clover(co, skip_items=True)
-            delivery.delivery_type = none_throws(get_delivery_type(co))
-            orders.append(delivery)
+            orders.append(CandidateOrder.from_clover(co, customer_data))
 
     for so in shopify_delivery_orders:
-        if so.online_id in scheduled_shopify_orders_dict:
+        if so.online_id in scheduled.by_online_id:
             if include_processed:
-                orders.append(scheduled_shopify_orders_dict[so.online_id])
+                orders.append(
+                    CandidateOrder.from_delivery(scheduled.by_online_id[so.online_id])
+                )
         else:
-            clover_order = clover_from_shopify.get(so.name)
+            clover_order = split.clover_from_shopify.get(so.name)
             if clover_order:
                 order_number = clover_order["id"]
             else:
                 order_number = f"Shopify-{so.name}"
-            delivery = Delivery(order_number=order_number, online_id=so.online_id)
-            delivery.load_from_shopify_info(so)
-            orders.append(delivery)
+            orders.append(CandidateOrder.from_shopify(so, order_number))
 
     orders.sort(key=lambda o: o.created_at, reverse=True)
     return orders
+
+
+def sync_deliveries(
+    deliveries: Sequence[Delivery], force: bool = False
+) -> List[Delivery]:
+    # fetch everything remote concurrently, then apply on this thread so all
+    # database work stays on the request's connection/transaction
+    for delivery in deliveries:
+        if not delivery.order_number:
+            raise ValueError("Order number required to sync.")
+    shopify_deliveries = [d for d in deliveries if d.online_id]
+    clover_deliveries = [d for d in deliveries if not d.online_id]
+
+    with ThreadPoolExecutor(max_workers=SYNC_MAX_WORKERS) as executor:
+        # shopify sessions are global, so all shopify orders go in one batched job
+        shopify_future = executor.submit(
+            get_shopify_data_by_ids, [d.online_id for d in shopify_deliveries]
+        )
+        clover_futures = [
+            executor.submit(request_clover_orders, order_number=d.order_number)
+            for d in clover_deliveries
+        ]
+        shopify_data = shopify_future.result()
+        clover_data = [f.result() for f in clover_futures]
+
+    prefetch_clover_customers(clover_data)
+    # only the deliveries whose source changed since their last sync
+    changed = [
+        delivery
+        for delivery in shopify_deliveries
+        if delivery.apply_sync_data(
+            shopify_data[none_throws(delivery.online_id)], force=force
+        )
+    ]
+    changed.extend(
+        delivery
+        for delivery, order_data in zip(clover_deliveries, clover_data)
+        if delivery.apply_sync_data(order_data, force=force)
+    )
+    return changed
+
+
+def reserve_shift_slots(deliveries: Iterable[Delivery]) -> None:
+    # lock shifts in id order so concurrent bookings can't deadlock
+    counts = Counter(d.delivery_shift_id for d in deliveries)
+    for shift_id in sorted(counts):
+        Shift.objects.reserve(shift_id, counts[shift_id])
+
+
+def create_and_sync_deliveries(deliveries: Sequence[Delivery]) -> List[Delivery]:
+    # skip anything processed by the time the button was hit
+    existing = set(
+        Delivery.objects.filter(
+            order_number__in=[d.order_number for d in deliveries]
+        ).values_list("order_number", flat=True)
+    )
+    new_deliveries: Dict[str, Delivery] = {}
+    for delivery in deliveries:
+        if delivery.order_number in existing:
+            continue
+        new_deliveries.setdefault(none_throws(delivery.order_number), delivery)
+    if not new_deliveries:
+        return []
+
+    reserve_shift_slots(new_deliveries.values())
+    created = Delivery.objects.bulk_create(new_deliveries.values())
+    sync_deliveries(created)
+    now = timezone.now()
+    for delivery in created:
+        delivery.updated_at = now
+    Delivery.objects.bulk_update(created, Delivery.SYNCED_FIELDS)
+    # the bulk writes skip the post_save signal that maintains the fill counts;
+    # counted after the sync, which may have found the order cancelled
+    Shift.objects.adjust_filled_counts(Counter(d.counted_shift_id for d in created))
+    return created
+
+
+ORDER_EVENT_BATCH_SIZE = 100
+
+
+def queue_order_event(source: str, remote_id: str, topic: str) -> OrderEvent:
+    # bursts of updates to one order collapse into a single pending event
+    event, _ = OrderEvent.objects.update_or_create(
+        source=source,
+        remote_id=remote_id,
+        processed_at=None,
+        defaults={"topic": topic},
+    )
+    # synced by the process_order_events cron, so the webhook answers
+    # without waiting on Clover or Shopify
+    return event
+
+
+def process_order_events(limit: int = ORDER_EVENT_BATCH_SIZE) -> int:
+    with transaction.atomic():
+        events = list(
+            OrderEvent.objects.filter(processed_at=None)
+            .order_by("received_at")
+            .select_for_update(skip_locked=True)[:limit]
+        )
+        if not events:
+            return 0
+        clover_ids = [
+            e.remote_id.upper() for e in events if e.source == OrderEvent.CLOVER
+        ]
+        shopify_ids = [e.remote_id for e in events if e.source == OrderEvent.SHOPIFY]
+        # only scheduled orders are upserted; unscheduled ones aren't stored
+        # locally and come from the New Order search, which the webhook wakes
+        deliveries = list(
+            Delivery.objects.annotate(clover_id=Upper("order_number"))
+            .filter(
+                Q(online_id=None, clover_id__in=clover_ids)
+                | Q(online_id__in=shopify_ids)
+            )
+            .exclude(order_number=None)
+        )
+        with defer_shift_count_updates():
+            for delivery in sync_deliveries(deliveries):
+                delivery.save()
+        OrderEvent.objects.filter(pk__in=[e.pk for e in events]).update(
+            processed_at=timezone.now()
+        )
+    return len(events)
@@ -1,17 +1,20 @@
 import csv
 import datetime
+from collections import Counter
 from typing import List
 
 from django.contrib import admin, messages
 from django.contrib.admin.templatetags.admin_urls import add_preserved_filters
 from django.contrib.admin.utils import quote
+from django.core.exceptions import ValidationError
 from django.db.models.query import QuerySet
-from django.forms import ModelForm
+from django.forms import BaseModelFormSet, ModelForm
 from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
 from django.urls import reverse
 
 from .actions import create_onfleet_task_from_order
-from .models import Delivery, Item, Shift
+from .models import Delivery, Item, OrderEvent, Shift, ShiftFullError
+from .signals import defer_shift_count_updates
 
 
 def export_as_csv(
@@ -39,12 +42,14 @@ class IsAvailableFilter(admin.SimpleListFilter):
     parameter_name = "is_future"
 
     def lookups(self, request, model_admin):
-        return (("Yes", "Yes"), ("All", "All"))
+        return (("Yes", "Yes"), ("Available", "Has Open Slots"), ("All", "All"))
 
     def queryset(self, request, queryset):
         value = self.value()
         if value == "Yes":
             return queryset.filter(date__gte=datetime.date.today())
+        if value == "Available":
+            return queryset.available()
 
         return queryset
 
@@ -92,6 +97,20 @@ class DeliveryForm(ModelForm):
         model = Delivery
         exclude: List[str] = []
 
+    def clean(self):
+        cleaned_data = super().clean()
+        shift = cleaned_data.get("delivery_shift")
+        if shift is not None and (
+            self.instance.pk is None or "delivery_shift" in self.changed_data
+        ):
+            # admin saves run in the request transaction, so the lock taken
+            # here is held until this delivery is saved
+            try:
+                Shift.objects.reserve(shift.id)
+            except ShiftFullError as exc:
+                self.add_error("delivery_shift", str(exc))
+        return cleaned_data
+
     # comment this out because it's now applying to all validation on this field
     """
     def __init__(self, *args, **kwargs):
@@ -106,6 +125,25 @@ class DeliveryForm(ModelForm):
     """
 
 
+class DeliveryChangeListFormSet(BaseModelFormSet):
+    def clean(self):
+        super().clean()
+        # each form only checks its own row, so rows moved into the same shift
+        # could each see the last free slot; reserve what they take together
+        counts: Counter = Counter(
+            form.cleaned_data["delivery_shift"].id
+            for form in self.forms
+            if form.cleaned_data.get("delivery_shift") is not None
+            and "delivery_shift" in form.changed_data
+            and form.instance.cancelled_at is None
+        )
+        for shift_id in sorted(counts):
+            try:
+                Shift.objects.reserve(shift_id, counts[shift_id])
+            except ShiftFullError as exc:
+                raise ValidationError(str(exc))
+
+
 class DeliveryAdmin(admin.ModelAdmin):
     form = DeliveryForm
     # formfield_overrides = {
@@ -132,10 +170,14 @@ class DeliveryAdmin(admin.ModelAdmin):
         "generate_delivery_sheet",
         "push_button",
         "online_order_link",
+        "cancelled_at",
     ]
     list_editable = ["delivery_shift"]
     fieldsets = (
-        ("Main", {"fields": ("delivery_shift", "order_number", "online_id")}),
+        (
+            "Main",
+            {"fields": ("delivery_shift", "order_number", "online_id", "cancelled_at")},
+        ),
         (
             "Actions",
             {"fields": ("sync_button", "generate_delivery_sheet", "push_button")},
@@ -174,6 +216,24 @@ class DeliveryAdmin(admin.ModelAdmin):
     save_on_top = True
     inlines = [ItemInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("delivery_shift")
+
+    def get_changelist_formset(self, request, **kwargs):
+        kwargs.setdefault("formset", DeliveryChangeListFormSet)
+        return super().get_changelist_formset(request, **kwargs)
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != "POST":
+            return super().changelist_view(request, extra_context)
+        # list_editable shift changes save row by row
+        with defer_shift_count_updates():
+            return super().changelist_view(request, extra_context)
+
+    def delete_queryset(self, request, queryset):
+        with defer_shift_count_updates():
+            super().delete_queryset(request, queryset)
+
     def response_change(self, request, obj):
         if "_sync" in request.POST:
             preserved_filters = self.get_preserved_filters(request)
@@ -208,7 +268,7 @@ class DeliveryAdmin(admin.ModelAdmin):
 
     def save_model(self, request, obj, form, change):
         if "_sync" in request.POST:
-            obj.sync()
+            obj.sync(force=True)
         super().save_model(request, obj, form, change)
         if "_push" in request.POST:
             create_onfleet_task_from_order(obj)
@@ -256,5 +316,19 @@ class DeliveryAdmin(admin.ModelAdmin):
         return formfield
 
 
+class OrderEventAdmin(admin.ModelAdmin):
+    list_display = ("source", "remote_id", "topic", "received_at", "processed_at")
+    list_filter = ("source", "topic")
+    search_fields = ("remote_id",)
+    ordering = ("-received_at",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 admin.site.register(Shift, ShiftAdmin)
 admin.site.register(Delivery, DeliveryAdmin)
+admin.site.register(OrderEvent, OrderEventAdmin)
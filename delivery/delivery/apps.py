@@ -7,6 +7,7 @@ class DeliveryConfig(AppConfig):
 
     def ready(self):
         try:
+            import delivery.delivery.live  # noqa F401
             import delivery.delivery.signals  # noqa F401
         except ImportError:
             pass
@@ -0,0 +1,82 @@
+import datetime
+import itertools
+
+import pytest
+from django.urls import reverse
+
+from delivery.delivery.models import Delivery, Shift
+from delivery.delivery.signals import defer_shift_count_updates
+from delivery.delivery.tests.factories import ShiftFactory
+from delivery.delivery.tests.test_commands import (
+    ecwid_rows,
+    load_ecwid,
+    write_ecwid_file,
+)
+
+pytestmark = pytest.mark.django_db
+
+ECWID_ORDERS = 1000
+
+
+@pytest.mark.benchmark(group="bookings")
+def test_load_ecwid(benchmark, season, tmp_path):
+    order_numbers = [str(100000 + n) for n in range(ECWID_ORDERS)]
+    path = write_ecwid_file(
+        tmp_path / "orders.tsv",
+        [
+            row
+            for n, order_number in enumerate(order_numbers)
+            for row in ecwid_rows(
+                order_number,
+                season.shifts[n % len(season.shifts)],
+                ["Noble Fir 6ft", "Stand", "Wreath"],
+            )
+        ],
+    )
+
+    def forget_imported():
+        # so every round imports, rather than updates, the orders
+        with defer_shift_count_updates():
+            Delivery.objects.filter(order_number__in=order_numbers).delete()
+
+    out = benchmark.pedantic(load_ecwid, args=(path,), setup=forget_imported, rounds=5)
+    assert f"Saved {ECWID_ORDERS} orders" in out
+
+
+@pytest.mark.benchmark(group="bookings")
+def test_booking_busts_available_shifts(
+    benchmark, client, season, django_capture_on_commit_callbacks
+):
+    # a booking commits, Shift.counts_changed bumps the cache version and
+    # tells the live feeds, and the next availability request rebuilds
+    shift = ShiftFactory(
+        date=season.shifts[-1].date + datetime.timedelta(days=1),
+        time="SP",
+        # roomy enough that the shift stays available for every round
+        slots_available=1000,
+    )
+    order_numbers = (f"BOOKING{n:06d}" for n in itertools.count())
+    url = reverse("available-shifts")
+    client.get(url)
+    version = Shift.available_shifts_cache_version()
+
+    def book():
+        with django_capture_on_commit_callbacks(execute=True):
+            Delivery.objects.create(
+                order_number=next(order_numbers), delivery_shift=shift
+            )
+        return client.get(url)
+
+    response = benchmark.pedantic(book, rounds=200)
+    assert Shift.available_shifts_cache_version() > version
+    [available] = [s for s in response.json()["shifts"] if s["id"] == shift.pk]
+    shift.refresh_from_db()
+    assert available["slots_remaining"] == shift.slots_remaining
+
+
+@pytest.mark.benchmark(group="bookings")
+def test_available_shifts_cached(benchmark, client, season):
+    url = reverse("available-shifts")
+    client.get(url)
+    response = benchmark(client.get, url)
+    assert len(response.json()["shifts"]) == len(season.shifts)
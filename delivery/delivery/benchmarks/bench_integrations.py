@@ -0,0 +1,79 @@
+import datetime
+
+import pytest
+from django.urls import reverse
+
+from delivery.delivery import actions
+from delivery.delivery.models import Delivery
+
+from .season import create_season
+
+pytestmark = pytest.mark.django_db
+
+BUSY_SHIFT_DELIVERIES = 200
+
+
+@pytest.fixture
+def busy_shift(season):
+    # past the season, and rolled back with the test
+    start = season.shifts[-1].date + datetime.timedelta(days=7)
+    return create_season(
+        start, days=1, deliveries_per_shift=BUSY_SHIFT_DELIVERIES
+    ).shifts[0]
+
+
+@pytest.mark.benchmark(group="clover")
+def test_search_clover_orders(benchmark, stub_apis, clear_caches):
+    candidates = benchmark.pedantic(
+        actions.search_clover_orders,
+        args=(datetime.date.today(),),
+        setup=clear_caches,
+        rounds=10,
+    )
+    # the new Clover orders, and the Shopify delivery orders not yet scheduled
+    assert len(candidates) == 600 + 200
+
+
+@pytest.mark.benchmark(group="clover")
+def test_reconciliation_page(benchmark, admin_client, stub_apis, clear_caches):
+    response = benchmark.pedantic(
+        admin_client.get, args=(reverse("shopify_view"),), setup=clear_caches, rounds=5
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.benchmark(group="onfleet")
+def test_serialize_shift_for_onfleet(benchmark, season):
+    shift = season.shifts[0]
+    tasks = benchmark(Delivery.serialize_many_for_onfleet, shift.delivery_set.all())
+    assert len(tasks) == shift.filled_count
+
+
+@pytest.mark.benchmark(group="onfleet-200")
+def test_serialize_busy_shift_for_onfleet(benchmark, busy_shift):
+    tasks = benchmark(
+        Delivery.serialize_many_for_onfleet, busy_shift.delivery_set.all()
+    )
+    assert len(tasks) == BUSY_SHIFT_DELIVERIES
+
+
+@pytest.mark.benchmark(group="onfleet-200")
+def test_serialize_busy_shift_for_onfleet_one_by_one(benchmark, busy_shift):
+    # the per-delivery path serialize_many_for_onfleet replaced, for scale
+    def serialize():
+        return [d.serialize_for_onfleet() for d in busy_shift.delivery_set.all()]
+
+    tasks = benchmark(serialize)
+    assert len(tasks) == BUSY_SHIFT_DELIVERIES
+
+
+@pytest.mark.benchmark(group="onfleet")
+def test_push_shift_to_onfleet(benchmark, season, stub_apis):
+    benchmark(actions.create_onfleet_tasks_from_shift, season.shifts[0])
+
+
+@pytest.mark.benchmark(group="onfleet")
+def test_truck_page(benchmark, admin_client, stub_apis):
+    response = benchmark(admin_client.get, reverse("truck_view"))
+    assert response.status_code == 200
+    assert len(response.context["tasks"]) == len(stub_apis.onfleet_tasks)
@@ -0,0 +1,38 @@
+import pytest
+from django.urls import reverse
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.mark.benchmark(group="pages")
+def test_walk_list(benchmark, admin_client, season):
+    shift = season.shifts[0]
+    response = benchmark(admin_client.get, reverse("walk-list", args=[shift.pk]))
+    assert response.status_code == 200
+
+
+@pytest.mark.benchmark(group="pages")
+def test_delivery_changelist(benchmark, admin_client, season):
+    response = benchmark(
+        admin_client.get, reverse("admin:delivery_delivery_changelist")
+    )
+    assert response.context["cl"].result_count == len(season.deliveries)
+
+
+@pytest.mark.benchmark(group="pages")
+def test_delivery_changelist_by_shift(benchmark, admin_client, season):
+    shift = season.shifts[0]
+    response = benchmark(
+        admin_client.get,
+        reverse("admin:delivery_delivery_changelist"),
+        {"delivery_shift__id__exact": shift.pk},
+    )
+    assert response.context["cl"].result_count == shift.filled_count
+
+
+@pytest.mark.benchmark(group="pages")
+def test_delivery_changelist_search(benchmark, admin_client, season):
+    response = benchmark(
+        admin_client.get, reverse("admin:delivery_delivery_changelist"), {"q": "Lee"}
+    )
+    assert response.status_code == 200
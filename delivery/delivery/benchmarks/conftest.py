@@ -0,0 +1,44 @@
+import datetime
+
+import pytest
+from django.core.cache import cache
+
+from delivery.delivery import shopify
+
+from .season import Season, create_season
+from .stubs import RecordedAPIs, StubServer
+
+
+@pytest.fixture(scope="session")
+def season(django_db_setup, django_db_blocker) -> Season:
+    # committed once for the whole run, outside the per-test transactions
+    with django_db_blocker.unblock():
+        season = create_season(datetime.date.today() + datetime.timedelta(days=1))
+    yield season
+    with django_db_blocker.unblock():
+        season.delete()
+
+
+@pytest.fixture(scope="session")
+def stub_server(season):
+    with StubServer(RecordedAPIs(season)) as server:
+        yield server
+
+
+@pytest.fixture
+def stub_apis(db, settings, monkeypatch, stub_server) -> RecordedAPIs:
+    settings.CLOVER_INTEGRATION_API = stub_server.url("clover/v3")
+    settings.ONFLEET_INTEGRATION_API = stub_server.url("onfleet/v2")
+    monkeypatch.setattr(shopify.shopify, "GraphQL", stub_server.graphql_class())
+    return stub_server.apis
+
+
+@pytest.fixture
+def clear_caches():
+    # pass as a benchmark's setup so each round starts cold, like the first
+    # page load of the day
+    def clear():
+        cache.clear()
+        shopify.CACHE_INFO_BY_NAME.clear()
+
+    return clear
@@ -0,0 +1,72 @@
+import datetime
+from dataclasses import dataclass
+from typing import List
+
+from delivery.delivery.models import Delivery, Item, Shift
+from delivery.delivery.signals import defer_shift_count_updates
+from delivery.delivery.tests.factories import DeliveryFactory, ItemFactory, ShiftFactory
+
+ITEM_NAMES = ("Noble Fir 6ft", "Douglas Fir 7ft", "Stand", "Wreath", "Garland")
+# one delivery in SHOPIFY_EVERY was ordered online
+SHOPIFY_EVERY = 4
+SHOPIFY_FIRST_ID = 4800000000000
+
+
+@dataclass
+class Season:
+    shifts: List[Shift]
+    deliveries: List[Delivery]
+
+    @property
+    def clover_deliveries(self) -> List[Delivery]:
+        return [d for d in self.deliveries if not d.online_id]
+
+    @property
+    def shopify_deliveries(self) -> List[Delivery]:
+        return [d for d in self.deliveries if d.online_id]
+
+    def delete(self) -> None:
+        with defer_shift_count_updates():
+            Delivery.objects.filter(delivery_shift__in=self.shifts).delete()
+        Shift.objects.filter(pk__in=[s.pk for s in self.shifts]).delete()
+
+
+def create_season(
+    start: datetime.date,
+    days: int = 30,
+    deliveries_per_shift: int = 50,
+    items_per_delivery: int = 3,
+) -> Season:
+    """
+    An AM and a PM shift a day from start, each booked with deliveries and
+    their items, written with bulk inserts so a season takes seconds.
+    """
+    shifts = Shift.objects.bulk_create(
+        ShiftFactory.build(
+            date=start + datetime.timedelta(days=n),
+            time=time,
+            slots_available=deliveries_per_shift + 10,
+        )
+        for n in range(days)
+        for time in ("AM", "PM")
+    )
+    deliveries = []
+    for shift in shifts:
+        for delivery in DeliveryFactory.build_batch(
+            deliveries_per_shift, delivery_shift=shift
+        ):
+            if len(deliveries) % SHOPIFY_EVERY == 0:
+                delivery.online_id = str(SHOPIFY_FIRST_ID + len(deliveries))
+            deliveries.append(delivery)
+    deliveries = Delivery.objects.bulk_create(deliveries)
+    Item.objects.bulk_create(
+        ItemFactory.build(
+            delivery=delivery, item_name=ITEM_NAMES[(delivery.pk + n) % len(ITEM_NAMES)]
+        )
+        for delivery in deliveries
+        for n in range(items_per_delivery)
+    )
+    Shift.objects.filter(pk__in=[s.pk for s in shifts]).recount()
+    for shift in shifts:
+        shift.filled_count = deliveries_per_shift
+    return Season(shifts, deliveries)
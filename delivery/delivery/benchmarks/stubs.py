@@ -0,0 +1,253 @@
+import copy
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict
+from urllib.parse import parse_qs, urlsplit
+
+import shopify
+
+from .season import Season
+
+PAYLOADS_DIR = Path(__file__).parent / "payloads"
+
+_SHIFT_TIMES = {"AM": "9:30 AM - 2:00 PM", "PM": "3:00 PM - 7:00 PM"}
+_CUSTOMER_IDS = re.compile(r"'([^']+)'")
+_ORDER_NAMES = re.compile(r'name:"([^"]+)"')
+
+
+def load_payload(name: str) -> Dict:
+    with open(PAYLOADS_DIR / f"{name}.json") as f:
+        return json.load(f)
+
+
+class RecordedAPIs:
+    """
+    The recorded Clover, Shopify and Onfleet responses in payloads/, fanned out
+    to one busy day against a season: Clover orders that are new, already
+    scheduled or placed through Shopify, Shopify orders with and without a
+    delivery, some only found by name, and a route of Onfleet tasks.
+    """
+
+    def __init__(
+        self,
+        season: Season,
+        new_clover_orders: int = 600,
+        new_shopify_orders: int = 200,
+        late_shopify_orders: int = 20,
+        trucks: int = 10,
+    ):
+        clover = load_payload("clover")
+        self.clover_orders = [
+            self._clover_order(clover["order"], d.order_number)
+            for d in season.clover_deliveries[:300]
+        ]
+        self.clover_customers = {}
+        for n in range(new_clover_orders):
+            order = self._clover_order(clover["order"], f"N{n:012d}")
+            customer = copy.deepcopy(clover["customer"])
+            customer["id"] = f"C{n:012d}"
+            customer["lastName"] = f"Lee{n}"
+            order["customers"]["elements"][0]["id"] = customer["id"]
+            self.clover_orders.append(order)
+            self.clover_customers[customer["id"]] = customer
+
+        order = load_payload("shopify")["order"]
+        shifts = season.shifts
+        self.shopify_orders = [
+            self._shopify_order(order, n, d.online_id, d.delivery_shift)
+            for n, d in enumerate(season.shopify_deliveries[:200])
+        ]
+        self.shopify_orders.extend(
+            self._shopify_order(order, n, str(n), shifts[n % len(shifts)])
+            for n in range(1000, 1000 + new_shopify_orders)
+        )
+        # pickup orders come back from the search too
+        for pickup in self.shopify_orders[::10]:
+            pickup["customAttributes"][0]["value"] = "pickup"
+        # delayed out of the searched range, so only found by name
+        self.late_shopify_orders = [
+            self._shopify_order(order, n, str(n), shifts[n % len(shifts)])
+            for n in range(5000, 5000 + late_shopify_orders)
+        ]
+        for n, linked in enumerate(
+            self.shopify_orders[1::4] + self.late_shopify_orders
+        ):
+            clover_order = self._clover_order(clover["order"], f"S{n:012d}")
+            clover_order[
+                "title"
+            ] = f"Shopify Order ID: {linked['name'][1:]}-SkuIQ Order #{n}"
+            self.clover_orders.append(clover_order)
+
+        onfleet = load_payload("onfleet")
+        self.onfleet_tasks = []
+        self.onfleet_workers = []
+        route = [d for d in season.deliveries if d.delivery_shift == shifts[0]]
+        for n in range(trucks):
+            worker = copy.deepcopy(onfleet["worker"])
+            worker.update(id=f"W{n:03d}", name=f"Truck {n + 1}")
+            for m, delivery in enumerate(route[n::trucks]):
+                task = self._onfleet_task(onfleet["task"], delivery.order_number)
+                task.update(id=f"T{n:03d}{m:03d}", worker=worker["id"])
+                worker["tasks"].append(task["id"])
+                self.onfleet_tasks.append(task)
+            self.onfleet_workers.append(worker)
+        team = copy.deepcopy(onfleet["team"])
+        team["workers"] = [w["id"] for w in self.onfleet_workers]
+        self.onfleet_teams = [team]
+        self.onfleet_task = onfleet["task"]
+
+    @staticmethod
+    def _clover_order(template: Dict, order_id: str) -> Dict:
+        order = copy.deepcopy(template)
+        order["id"] = order_id
+        order["href"] = order["href"].replace("ORDER", order_id)
+        return order
+
+    @staticmethod
+    def _shopify_order(template: Dict, n: int, online_id: str, shift) -> Dict:
+        order = copy.deepcopy(template)
+        order["name"] = f"#{n}"
+        order["id"] = f"gid://shopify/Order/{online_id}"
+        for attribute in order["customAttributes"]:
+            if attribute["key"] == "Delivery-Date":
+                attribute["value"] = f"{shift.date:%Y/%m/%d}"
+            elif attribute["key"] == "Delivery-Day":
+                attribute["value"] = f"{shift.date:%A}"
+            elif attribute["key"] == "Delivery-Time":
+                attribute["value"] = _SHIFT_TIMES[shift.time]
+        return order
+
+    @staticmethod
+    def _onfleet_task(template: Dict, order_number: str) -> Dict:
+        task = copy.deepcopy(template)
+        task["metadata"][0]["value"] = order_number
+        task["notes"] = f"Order Number: {order_number}"
+        return task
+
+    def clover_orders_page(self, offset: int, limit: int) -> Dict:
+        return {"elements": self.clover_orders[offset : offset + limit]}
+
+    def clover_customer_list(self, filter_str: str) -> Dict:
+        ids = _CUSTOMER_IDS.findall(filter_str)
+        return {
+            "elements": [
+                self.clover_customers[i] for i in ids if i in self.clover_customers
+            ]
+        }
+
+    def shopify_orders_page(self, variables: Dict) -> Dict:
+        names = _ORDER_NAMES.findall(variables["query"])
+        if names:
+            orders = [
+                o
+                for o in self.shopify_orders + self.late_shopify_orders
+                if o["name"] in names or o["name"][1:] in names
+            ]
+        else:
+            orders = self.shopify_orders
+        offset = int(variables.get("after") or 0)
+        end = offset + variables["first"]
+        return {
+            "data": {
+                "orders": {
+                    "pageInfo": {
+                        "hasNextPage": end < len(orders),
+                        "endCursor": str(end),
+                    },
+                    "edges": [{"node": o} for o in orders[offset:end]],
+                }
+            }
+        }
+
+    def onfleet_batch(self, body: Dict) -> Dict:
+        created = []
+        for n, task in enumerate(body["tasks"]):
+            created.append({**copy.deepcopy(self.onfleet_task), **task, "id": f"B{n}"})
+        return {"tasks": created}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "StubServer"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        apis = self.server.apis
+        resource = url.path.rstrip("/").rpartition("/")[2]
+        if url.path.startswith("/clover/") and resource == "orders":
+            data = apis.clover_orders_page(
+                int(query.get("offset", 0)), int(query["limit"])
+            )
+        elif url.path.startswith("/clover/") and resource == "customers":
+            data = apis.clover_customer_list(query["filter"])
+        elif url.path.startswith("/onfleet/") and resource == "workers":
+            data = apis.onfleet_workers
+        elif url.path.startswith("/onfleet/") and resource == "teams":
+            data = apis.onfleet_teams
+        elif url.path.startswith("/onfleet/") and resource == "tasks":
+            data = apis.onfleet_tasks
+        else:
+            self.send_error(404)
+            return
+        self.send_json(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path == "/shopify/graphql.json":
+            self.send_json(self.server.apis.shopify_orders_page(body["variables"]))
+        elif self.path == "/onfleet/v2/tasks/batch":
+            self.send_json(self.server.apis.onfleet_batch(body))
+        else:
+            self.send_error(404)
+
+    def send_json(self, data) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Serves RecordedAPIs on a loopback port: Clover under /clover/v3, Onfleet
+    under /onfleet/v2 and Shopify's GraphQL endpoint at /shopify/graphql.json.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, apis: RecordedAPIs):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.apis = apis
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def url(self, path: str) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/{path}"
+
+    def __enter__(self) -> "StubServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def graphql_class(self) -> type:
+        # shopify.GraphQL, posting to this server instead of the shop
+        endpoint = self.url("shopify/graphql.json")
+
+        class StubGraphQL(shopify.GraphQL):
+            def __init__(self):
+                super().__init__()
+                self.endpoint = endpoint
+
+        return StubGraphQL
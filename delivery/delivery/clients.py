@@ -0,0 +1,151 @@
+import asyncio
+import datetime
+import weakref
+from os import path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import httpx
+from django.conf import settings
+from django.core.cache import cache
+
+from . import clover, graphql, shopify
+from .profiling import timed
+
+CLIENT_TIMEOUT = 30
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    # one connection pool per event loop, shared by every integration; under
+    # uvicorn that's one per worker
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = httpx.AsyncClient(timeout=CLIENT_TIMEOUT)
+    return client
+
+
+class CloverClient:
+    def __init__(self, http: Optional[httpx.AsyncClient] = None):
+        self.http = http or get_http_client()
+
+    async def get(self, url: str, params: Dict) -> httpx.Response:
+        with timed("clover"):
+            return await self.http.get(
+                url, params=params, headers=clover.clover_headers()
+            )
+
+    async def get_orders(
+        self, filters=None, offset=None, limit=None, order_number=None
+    ) -> Dict:
+        response = await self.get(
+            clover.clover_orders_url(order_number),
+            clover.clover_orders_params(filters=filters, offset=offset, limit=limit),
+        )
+        if order_number and response.status_code == 404:
+            raise ValueError(f"Order {order_number} not found in Clover.")
+        response.raise_for_status()
+        return response.json()
+
+    async def search_orders(
+        self, filters: List[str], chunk_size: int = 1000
+    ) -> List[Dict]:
+        orders_list: List[Dict] = []
+        offset = 0
+        while True:
+            orders_data = await self.get_orders(
+                filters=filters, limit=chunk_size, offset=offset
+            )
+            orders = orders_data.get("elements", None)
+            if not orders:
+                break
+            orders_list.extend(orders)
+            if len(orders) < chunk_size:
+                break
+            offset += chunk_size
+        return orders_list
+
+    async def search_by_dates(
+        self,
+        start_date: Union[datetime.datetime, datetime.date],
+        end_date: Optional[Union[datetime.datetime, datetime.date]] = None,
+    ) -> List[Dict]:
+        return await self.search_orders(
+            clover.created_time_filters(start_date, end_date)
+        )
+
+    async def prefetch_customers(self, orders: Sequence[Dict]) -> Dict[str, Dict]:
+        customer_data, incomplete_customers = clover.split_cached_customers(orders)
+        if not incomplete_customers:
+            return customer_data
+        response = await self.get(
+            clover.clover_customers_url(),
+            clover.clover_customer_list_params(list(incomplete_customers)),
+        )
+        response.raise_for_status()
+        fetched = {c["id"]: c for c in response.json()["elements"]}
+        await cache.aset_many(
+            {clover.customer_cache_key(k): data for k, data in fetched.items()}
+        )
+        customer_data.update(fetched)
+        return customer_data
+
+
+class ShopifyClient:
+    def __init__(self, http: Optional[httpx.AsyncClient] = None):
+        self.http = http or get_http_client()
+        session = shopify.shopify_session()
+        self.url = f"{session.site}/graphql.json"
+        self.headers = {"X-Shopify-Access-Token": session.token}
+
+    async def execute(self, query: graphql.Query, /, **variables: Any) -> Dict:
+        with timed("shopify"):
+            response = await self.http.post(
+                self.url, json=query.payload(variables), headers=self.headers
+            )
+        response.raise_for_status()
+        return query.parse(response.json())
+
+    async def search_orders(
+        self,
+        search: str,
+        query: graphql.Query = shopify.ORDER_SEARCH_QUERY,
+        chunk_size: int = shopify.ORDER_SEARCH_PAGE_SIZE,
+    ) -> List[Dict]:
+        orders: List[Dict] = []
+        after = None
+        while True:
+            page = (
+                await self.execute(query, query=search, first=chunk_size, after=after)
+            )["orders"]
+            orders.extend(edge["node"] for edge in page["edges"])
+            if not page["pageInfo"]["hasNextPage"]:
+                return orders
+            after = page["pageInfo"]["endCursor"]
+
+
+class OnfleetClient:
+    def __init__(self, http: Optional[httpx.AsyncClient] = None):
+        self.http = http or get_http_client()
+        self.auth = httpx.BasicAuth(settings.ONFLEET_API_KEY, "")
+
+    async def get(self, resource: str, params: Optional[Dict] = None) -> Any:
+        with timed("onfleet"):
+            response = await self.http.get(
+                path.join(settings.ONFLEET_INTEGRATION_API, resource),
+                params=params,
+                auth=self.auth,
+            )
+        return response.json()
+
+    async def get_trucks_data(
+        self, tasks_params: Dict
+    ) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+        # workers, teams and tasks don't depend on each other
+        workers, teams, tasks = await asyncio.gather(
+            self.get("workers"), self.get("teams"), self.get("tasks", tasks_params)
+        )
+        return workers, teams, tasks
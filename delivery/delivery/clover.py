@@ -1,30 +1,37 @@
 import datetime
+import hmac
 import re
 from os import path
-from typing import Dict, Optional, Sequence, Union
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
 
+import pytz
 import requests
 from django.conf import settings
 from django.core.cache import cache
 
 from delivery.delivery.constants import DELIVERY_TYPE_COSTS, DeliveryTypes
+from delivery.delivery.profiling import timed
 
 
-def request_clover(url, params):
+def clover_headers() -> Dict[str, str]:
     if not settings.CLOVER_API_KEY:
         raise ValueError("Environment CLOVER_API_KEY not set.")
-    headers = {
+    return {
         "Content-Type": "Application/JSON",
         "Authorization": "Bearer " + settings.CLOVER_API_KEY,
     }
-    return requests.get(
-        url,
-        params=params,
-        headers=headers,
-    )
 
 
-def request_clover_orders(order_number=None, filters=None, offset=None, limit=None):
+def request_clover(url, params):
+    with timed("clover"):
+        return requests.get(
+            url,
+            params=params,
+            headers=clover_headers(),
+        )
+
+
+def clover_orders_url(order_number: Optional[str] = None) -> str:
     if not settings.CLOVER_MERCHANT_ID:
         raise ValueError("Environment CLOVER_MERCHANT_ID not set.")
     if not settings.CLOVER_INTEGRATION_API:
@@ -37,7 +44,10 @@ def request_clover_orders(order_number=None, filters=None, offset=None, limit=No
     )
     if order_number:
         orders_url = path.join(orders_url, order_number.upper())
+    return orders_url
+
 
+def clover_orders_params(filters=None, offset=None, limit=None) -> Dict:
     order_params = {"expand": "lineItems,customers"}
     if filters:
         order_params["filter"] = filters
@@ -45,7 +55,12 @@ def request_clover_orders(order_number=None, filters=None, offset=None, limit=No
         order_params["limit"] = limit
     if offset:
         order_params["offset"] = offset
+    return order_params
 
+
+def request_clover_orders(order_number=None, filters=None, offset=None, limit=None):
+    orders_url = clover_orders_url(order_number)
+    order_params = clover_orders_params(filters=filters, offset=offset, limit=limit)
     order_response = request_clover(orders_url, order_params)
 
     if order_number and order_response.status_code == 404:
@@ -61,14 +76,33 @@ def search_clover_by_dates(
     end_date: Optional[Union[datetime.datetime, datetime.date]] = None,
     chunk_size: int = 1000,
 ) -> Sequence[Dict]:
-    end_date = end_date or start_date
+    return _request_all_clover_orders(
+        created_time_filters(start_date, end_date), chunk_size
+    )
 
+
+def created_time_filters(
+    start_date: Union[datetime.datetime, datetime.date],
+    end_date: Optional[Union[datetime.datetime, datetime.date]] = None,
+) -> List[str]:
+    end_date = end_date or start_date
     start_time = datetime.datetime.combine(start_date, datetime.datetime.min.time())
     end_time = datetime.datetime.combine(end_date, datetime.datetime.max.time())
-    filters = [
+    return [
         f"createdTime>={int(start_time.timestamp()) * 1000}",
         f"createdTime<={int(end_time.timestamp()) * 1000}",
     ]
+
+
+def search_clover_by_modified_time(
+    since: datetime.datetime, chunk_size: int = 1000
+) -> Sequence[Dict]:
+    return _request_all_clover_orders(
+        [f"modifiedTime>={int(since.timestamp() * 1000)}"], chunk_size
+    )
+
+
+def _request_all_clover_orders(filters: List[str], chunk_size: int) -> Sequence[Dict]:
     orders_list = []
     offset = 0
 
@@ -87,12 +121,36 @@ def search_clover_by_dates(
     return orders_list
 
 
-def _customer_cache_key(id: str) -> str:
+def parse_modified_time(order_data: Dict) -> Optional[datetime.datetime]:
+    modified_time = order_data.get("modifiedTime", None)
+    if not modified_time:
+        return None
+    return datetime.datetime.fromtimestamp(modified_time / 1000, tz=pytz.UTC)
+
+
+def verify_webhook(auth_header: str) -> bool:
+    # clover signs webhooks with a fixed auth code rather than a body HMAC
+    if not settings.CLOVER_WEBHOOK_AUTH_CODE:
+        return False
+    return hmac.compare_digest(settings.CLOVER_WEBHOOK_AUTH_CODE, auth_header)
+
+
+def parse_webhook_order_ids(payload: Dict) -> List[Tuple[str, str]]:
+    # {"merchants": {mid: [{"objectId": "O:<order id>", "type": "UPDATE"}]}}
+    order_ids = []
+    for update in payload.get("merchants", {}).get(settings.CLOVER_MERCHANT_ID, []):
+        object_type, _, object_id = update.get("objectId", "").partition(":")
+        if object_type == "O" and object_id:
+            order_ids.append((object_id, update.get("type", "")))
+    return order_ids
+
+
+def customer_cache_key(id: str) -> str:
     return f"CLOVER/CLOVER_CUSTOMER_{id}"
 
 
 def request_clover_customer(id: str):
-    data = cache.get(_customer_cache_key(id), None)
+    data = cache.get(customer_cache_key(id), None)
     if data:
         return data
     customers_url = path.join(
@@ -110,30 +168,139 @@ def request_clover_customer(id: str):
         response.raise_for_status()
 
     data = response.json()
-    cache.set(_customer_cache_key(id), data)
+    cache.set(customer_cache_key(id), data)
     return data
 
 
-def request_clover_customer_list(ids: Sequence[str]):
-    customers_url = path.join(
+def clover_customers_url() -> str:
+    return path.join(
         settings.CLOVER_INTEGRATION_API,
         "merchants",
         settings.CLOVER_MERCHANT_ID,
         "customers",
     )
+
+
+def clover_customer_list_params(ids: Sequence[str]) -> Dict:
     customer_query_param_list = "','".join(ids)
     filter_str = f"id in ('{customer_query_param_list}')"
-    params = {"filter": filter_str, "expand": "addresses,emailAddresses,phoneNumbers"}
-    response = request_clover(customers_url, params)
+    return {"filter": filter_str, "expand": "addresses,emailAddresses,phoneNumbers"}
+
+
+def request_clover_customer_list(ids: Sequence[str]):
+    response = request_clover(clover_customers_url(), clover_customer_list_params(ids))
     if response.status_code != 200:
         response.raise_for_status()
 
     customer_data = {c["id"]: c for c in response.json()["elements"]}
     for k, data in customer_data.items():
-        cache.set(_customer_cache_key(k), data)
+        cache.set(customer_cache_key(k), data)
     return customer_data
 
 
+def get_order_customer(order_data: Dict) -> Optional[Dict]:
+    if not order_data.get("customers", None) or not order_data["customers"].get(
+        "elements", None
+    ):
+        return None
+    customers = order_data["customers"]["elements"]
+    if len(customers) != 1:
+        return None
+    return customers[0]
+
+
+def prefetch_clover_customers(orders: Sequence[Dict]) -> Dict[str, Dict]:
+    # the clover orders call doesn't return customer details, so fill them in
+    # from the cache and a single list request instead of one call per order
+    customer_data, incomplete_customers = split_cached_customers(orders)
+    if incomplete_customers:
+        customer_data.update(request_clover_customer_list(list(incomplete_customers)))
+    return customer_data
+
+
+def split_cached_customers(orders: Sequence[Dict]) -> Tuple[Dict[str, Dict], Set[str]]:
+    # returns the customer details already on hand, and the ids still to fetch
+    customer_data: Dict[str, Dict] = {}
+    incomplete_customers: Set[str] = set()
+    for o in orders:
+        customer = get_order_customer(o)
+        if customer is None:
+            continue
+        # treat as proxy for complete
+        if "addresses" in customer:
+            customer_data[customer["id"]] = customer
+            continue
+        data = cache.get(customer_cache_key(customer["id"]), None)
+        if data:
+            customer_data[customer["id"]] = data
+            continue
+        incomplete_customers.add(customer["id"])
+    return customer_data, incomplete_customers
+
+
+def parse_customer_phone_number(customer_data: Dict) -> Optional[str]:
+    if not customer_data.get("phoneNumbers", None) or not customer_data[
+        "phoneNumbers"
+    ].get("elements", None):
+        return None
+    phone_numbers = customer_data["phoneNumbers"]["elements"]
+    # first look for best phone number
+    phone_number = next(
+        (p for p in phone_numbers if p["phoneNumber"]), phone_numbers[0]
+    )
+    return phone_number["phoneNumber"]
+
+
+def parse_customer_address(customer_data: Dict) -> Optional[Dict]:
+    if not customer_data.get("addresses", None) or not customer_data["addresses"].get(
+        "elements", None
+    ):
+        return None
+    addresses = customer_data["addresses"]["elements"]
+    # first look for best address
+    return next((a for a in addresses if a["address1"]), addresses[0])
+
+
+def parse_customer_email(customer_data: Dict) -> Optional[str]:
+    if not customer_data.get("emailAddresses", None) or not customer_data[
+        "emailAddresses"
+    ].get("elements", None):
+        return None
+    emails = customer_data["emailAddresses"]["elements"]
+    # first look for best address
+    email = next((e for e in emails if e["emailAddress"]), emails[0])
+    return email["emailAddress"]
+
+
+def parse_line_items(order_data: Dict) -> List[Dict]:
+    if not order_data.get("lineItems", None):
+        return []
+    if not order_data["lineItems"].get("elements", None):
+        return []
+    items = order_data["lineItems"]["elements"]
+    # clover has a line item per unit, so roll them up by name
+    item_dict: Dict[str, int] = {}
+    for item in items:
+        if item["refunded"]:
+            continue
+        item_name = item["name"]
+        if is_clover_delivery_item(item_name):
+            continue
+        item_dict[item_name] = item_dict.get(item_name, 0) + 1
+    parsed = []
+    for item in items:
+        if item["refunded"]:
+            continue
+        item_name = item["name"]
+        quantity = item_dict.pop(item_name, 0)
+        if quantity <= 0:
+            continue
+        parsed.append(
+            {"clover_id": item["id"], "item_name": item_name, "quantity": quantity}
+        )
+    return parsed
+
+
 def is_clover_delivery_item(item_name):
     return (
         "Shipping and Handling" in item_name
@@ -0,0 +1,76 @@
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Mapping, Optional, Sequence, Union
+
+import shopify
+
+from .profiling import timed
+
+# a selection set: field names, plus {field: sub-selection} for nested objects,
+# e.g. ("id", "name", {"customer": ("firstName", "lastName")})
+Fields = Sequence[Union[str, Mapping[str, "Fields"]]]
+
+
+class GraphQLError(ValueError):
+    pass
+
+
+def render_fields(fields: Fields) -> str:
+    parts = []
+    for field in fields:
+        if isinstance(field, str):
+            parts.append(field)
+            continue
+        for name, subfields in field.items():
+            parts.append(f"{name} {{ {render_fields(subfields)} }}")
+    return " ".join(parts)
+
+
+@dataclass(frozen=True)
+class Query:
+    name: str
+    text: str
+
+    def execute(self, /, **variables: Any) -> Dict:
+        with timed("shopify"):
+            response = shopify.GraphQL().execute(
+                self.text, variables=variables, operation_name=self.name
+            )
+        return self.parse(json.loads(response))
+
+    def payload(self, variables: Mapping[str, Any]) -> Dict:
+        # the request body, for clients that don't go through shopify.GraphQL
+        return {"query": self.text, "variables": variables, "operationName": self.name}
+
+    def parse(self, response: Dict) -> Dict:
+        if response.get("errors"):
+            raise GraphQLError(f"{self.name} failed: {response['errors']}")
+        return response["data"]
+
+
+def compile_query(name: str, variables: Mapping[str, str], fields: Fields) -> Query:
+    """
+    Builds the query text once; values are passed to execute() as variables,
+    so the text stays the same from call to call and never embeds user input.
+    """
+    params = ", ".join(f"${var}: {type_}" for var, type_ in variables.items())
+    signature = f"{name}({params})" if params else name
+    return Query(name, f"query {signature} {{ {render_fields(fields)} }}")
+
+
+def connection(node_fields: Fields) -> Fields:
+    return (
+        {"pageInfo": ("hasNextPage", "endCursor"), "edges": ({"node": node_fields},)},
+    )
+
+
+def paginate(
+    query: Query, path: str, /, after: Optional[str] = None, **variables: Any
+) -> Iterator[Dict]:
+    # query must take an $after cursor and select connection() at path
+    while True:
+        page = query.execute(after=after, **variables)[path]
+        yield from (edge["node"] for edge in page["edges"])
+        if not page["pageInfo"]["hasNextPage"]:
+            return
+        after = page["pageInfo"]["endCursor"]
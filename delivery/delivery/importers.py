@@ -0,0 +1,553 @@
+import csv
+import datetime
+import json
+from abc import ABC, abstractmethod
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import django
+import phonenumbers
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from .actions import CandidateOrder
+from .clover import get_order_customer, parse_customer_address, parse_customer_email
+from .clover import parse_line_items as parse_clover_line_items
+from .clover import prefetch_clover_customers
+from .models import Delivery, Item, Shift
+from .shopify import parse_delivery_type_from_data as parse_shopify_delivery_type
+from .shopify import parse_line_items as parse_shopify_line_items
+from .shopify import parse_order_info_from_data as parse_shopify_order_info
+
+IMPORT_BATCH_SIZE = 500
+# rows handed to each parser process at a time
+PARSE_CHUNK_SIZE = 5000
+
+
+@dataclass
+class ItemRecord:
+    item_name: str
+    quantity: int = 1
+    note: Optional[str] = None
+    clover_id: Optional[str] = None
+    is_pulled: bool = False
+
+
+@dataclass
+class OrderRecord:
+    # fields left as None don't overwrite what's already saved
+    order_number: str
+    online_id: Optional[str] = None
+    recipient_first_name: Optional[str] = None
+    recipient_last_name: Optional[str] = None
+    recipient_phone_number: Optional[str] = None
+    recipient_email: Optional[str] = None
+    address_line_1: Optional[str] = None
+    address_line_2: Optional[str] = None
+    address_city: Optional[str] = None
+    address_postal_code: Optional[str] = None
+    notes: Optional[str] = None
+    delivery_type: Optional[int] = None
+    created_at: Optional[datetime.datetime] = None
+    # either the shift id, or the date and time code to look it up by
+    shift_id: Optional[int] = None
+    shift_date: Optional[datetime.date] = None
+    shift_time: Optional[str] = None
+    items: List[ItemRecord] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+    def delivery_fields(self) -> Dict[str, Any]:
+        return {
+            name: getattr(self, name)
+            for name in DELIVERY_FIELDS
+            if getattr(self, name) is not None
+        }
+
+    def clean(self) -> None:
+        if self.recipient_phone_number is None:
+            return
+        try:
+            self.recipient_phone_number = phonenumbers.format_number(
+                phonenumbers.parse(self.recipient_phone_number, "US"),
+                phonenumbers.PhoneNumberFormat.E164,
+            )
+        except Exception as e:
+            self.recipient_phone_number = None
+            self.warnings.append(
+                f"Unable to parse phone number for {self.order_number}: {e}"
+            )
+
+    def merge(self, other: "OrderRecord") -> None:
+        # the rest of an order that a chunk boundary split off
+        for name in ("shift_id", "shift_date", "shift_time"):
+            if getattr(other, name) is not None:
+                setattr(self, name, getattr(other, name))
+        self.items.extend(other.items)
+        self.warnings.extend(other.warnings)
+
+
+DELIVERY_FIELDS = [
+    f.name
+    for f in fields(OrderRecord)
+    if f.name
+    not in ("order_number", "shift_id", "shift_date", "shift_time", "items", "warnings")
+]
+
+
+class OrderSource(ABC):
+    """
+    Adapter that turns one input into OrderRecords. Subclasses split the input
+    into chunks and parse each chunk; parsing runs in a process pool when the
+    source sets ``parallel`` and the caller asks for workers.
+    """
+
+    # parse_chunk doesn't touch the database or network
+    parallel = False
+    # an order can span several rows, so a chunk boundary may split it
+    split_orders = False
+
+    @abstractmethod
+    def chunks(self) -> Iterator[Any]:
+        ...
+
+    @abstractmethod
+    def parse(self, chunk: Any) -> List[OrderRecord]:
+        ...
+
+    def parse_chunk(self, chunk: Any) -> List[OrderRecord]:
+        records = self.parse(chunk)
+        for record in records:
+            record.clean()
+        return records
+
+    def _parsed_chunks(self, workers: int) -> Iterator[List[OrderRecord]]:
+        if workers <= 1 or not self.parallel:
+            for chunk in self.chunks():
+                yield self.parse_chunk(chunk)
+            return
+        # bound the chunks in flight so large files still stream
+        with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+            pending: deque = deque()
+            for chunk in self.chunks():
+                pending.append(pool.submit(self.parse_chunk, chunk))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def records(self, workers: int = 1) -> Iterator[OrderRecord]:
+        previous = None
+        for records in self._parsed_chunks(workers):
+            for record in records:
+                if (
+                    self.split_orders
+                    and previous is not None
+                    and previous.order_number == record.order_number
+                ):
+                    previous.merge(record)
+                    continue
+                if previous is not None:
+                    yield previous
+                previous = record
+        if previous is not None:
+            yield previous
+
+
+class DelimitedFileSource(OrderSource):
+    """
+    One row per item, with an order's rows next to each other. The main
+    process only splits the file into rows; mapping them runs in the parse.
+    """
+
+    parallel = True
+    split_orders = True
+    delimiter = ","
+    order_number_column = "order_number"
+
+    def __init__(self, path: str, chunk_size: int = PARSE_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+
+    def chunks(self) -> Iterator[List[Dict[str, str]]]:
+        with open(self.path, newline="") as f:
+            chunk = []
+            for row in csv.DictReader(f, delimiter=self.delimiter):
+                chunk.append(row)
+                if len(chunk) >= self.chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+    def parse(self, chunk: List[Dict[str, str]]) -> List[OrderRecord]:
+        records: List[OrderRecord] = []
+        for row in chunk:
+            order_number = row[self.order_number_column]
+            if not records or records[-1].order_number != order_number:
+                records.append(self.parse_order(row))
+            self.parse_item(row, records[-1])
+        return records
+
+    @abstractmethod
+    def parse_order(self, row: Dict[str, str]) -> OrderRecord:
+        ...
+
+    @abstractmethod
+    def parse_item(self, row: Dict[str, str], record: OrderRecord) -> None:
+        ...
+
+
+class CsvSource(DelimitedFileSource):
+    """
+    Columns are named after OrderRecord fields, plus item_name and quantity
+    for the row's item; shift_date is YYYY-MM-DD.
+    """
+
+    def parse_order(self, row: Dict[str, str]) -> OrderRecord:
+        record = OrderRecord(row["order_number"])
+        for name in DELIVERY_FIELDS:
+            if row.get(name):
+                setattr(record, name, row[name])
+        if record.delivery_type is not None:
+            record.delivery_type = int(record.delivery_type)
+        if record.created_at is not None:
+            record.created_at = datetime.datetime.fromisoformat(record.created_at)
+        return record
+
+    def parse_item(self, row: Dict[str, str], record: OrderRecord) -> None:
+        if row.get("shift_date"):
+            record.shift_date = datetime.date.fromisoformat(row["shift_date"])
+            record.shift_time = row["shift_time"]
+        if row.get("item_name"):
+            record.items.append(
+                ItemRecord(row["item_name"], int(row.get("quantity") or 1))
+            )
+
+
+class EcwidSource(DelimitedFileSource):
+    """Ecwid order export (TSV), where the shift is booked as a line item."""
+
+    delimiter = "\t"
+
+    def parse_order(self, row: Dict[str, str]) -> OrderRecord:
+        record = OrderRecord(
+            row["order_number"],
+            recipient_email=row["email"],
+            recipient_phone_number=row["shipto_person_phone"],
+            address_line_1=row["shipto_person_street_1"],
+            address_line_2=row["shipto_person_street_2"],
+            address_city=row["shipto_person_city"],
+            address_postal_code=row["shipto_person_postal_code"],
+            notes=row["order_comments"],
+        )
+        recipient_name = row["shipto_person_name"].split(" ")
+        if len(recipient_name) == 2:
+            record.recipient_first_name = recipient_name[0]
+            record.recipient_last_name = recipient_name[1]
+        else:
+            record.recipient_last_name = " ".join(recipient_name)
+        return record
+
+    def parse_item(self, row: Dict[str, str], record: OrderRecord) -> None:
+        item_name = row["name"]
+        if "Delivery" in item_name or "shift" in item_name or "shfft" in item_name:
+            delivery = item_name.split(" ")
+            if "Delivery" in item_name:
+                date = datetime.datetime.strptime(delivery[0], "%m/%d").date()
+                date = date.replace(year=2019)
+                weekday = delivery[1]
+            else:
+                date = datetime.datetime.strptime(delivery[1], "%m/%d/%Y").date()
+                weekday = delivery[0]
+            if weekday not in date.strftime("%A"):
+                record.warnings.append(f"Invalid delivery shift {item_name}")
+                return
+            record.shift_date = date
+            record.shift_time = delivery[2]
+            return
+        record.items.append(
+            ItemRecord(
+                item_name,
+                int(row["quantity"]),
+                note="ECWID order " + record.order_number,
+            )
+        )
+
+
+class JsonlSource(OrderSource):
+    """One JSON object per line, keyed like OrderRecord with a list of items."""
+
+    parallel = True
+
+    def __init__(self, path: str, chunk_size: int = PARSE_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+
+    def chunks(self) -> Iterator[List[str]]:
+        with open(self.path) as f:
+            chunk = []
+            for line in f:
+                if line.strip():
+                    chunk.append(line)
+                if len(chunk) >= self.chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+    def parse(self, chunk: List[str]) -> List[OrderRecord]:
+        records = []
+        for line in chunk:
+            data = json.loads(line)
+            items = [ItemRecord(**item) for item in data.pop("items", [])]
+            if data.get("shift_date"):
+                data["shift_date"] = datetime.date.fromisoformat(data["shift_date"])
+            if data.get("created_at"):
+                data["created_at"] = datetime.datetime.fromisoformat(data["created_at"])
+            records.append(OrderRecord(items=items, **data))
+        return records
+
+
+class CloverSource(OrderSource):
+    """Clover order payloads, e.g. from request_clover_orders."""
+
+    def __init__(self, orders: Sequence[Dict], chunk_size: int = 100):
+        self.orders = orders
+        self.chunk_size = chunk_size
+
+    def chunks(self):
+        for start in range(0, len(self.orders), self.chunk_size):
+            orders = self.orders[start : start + self.chunk_size]
+            yield orders, prefetch_clover_customers(orders)
+
+    def parse(self, chunk) -> List[OrderRecord]:
+        orders, customers = chunk
+        return [self.order_record(order_data, customers) for order_data in orders]
+
+    @staticmethod
+    def order_record(order_data: Dict, customers: Dict[str, Dict]) -> OrderRecord:
+        # also what Delivery.load_from_clover syncs from
+        customer = get_order_customer(order_data)
+        details = customers.get(customer["id"], {}) if customer else {}
+        candidate = CandidateOrder.from_clover(order_data, customers)
+        record = OrderRecord(
+            order_data["id"],
+            recipient_first_name=candidate.recipient_first_name,
+            recipient_last_name=candidate.recipient_last_name,
+            recipient_phone_number=candidate.recipient_phone_number,
+            recipient_email=parse_customer_email(details) if details else None,
+            notes=order_data.get("note"),
+            delivery_type=candidate.delivery_type,
+            created_at=candidate.created_at,
+            items=[
+                ItemRecord(is_pulled=True, **item)
+                for item in parse_clover_line_items(order_data)
+            ],
+        )
+        address = parse_customer_address(details) if details else None
+        if address is not None:
+            record.address_line_1 = address.get("address1")
+            record.address_line_2 = address.get("address2")
+            record.address_city = address["city"]
+            record.address_postal_code = address["zip"]
+        return record
+
+
+class ShopifySource(OrderSource):
+    """Shopify order payloads, e.g. from get_data_by_ids."""
+
+    def __init__(self, orders: Sequence[Dict], chunk_size: int = 100):
+        self.orders = orders
+        self.chunk_size = chunk_size
+
+    def chunks(self):
+        for start in range(0, len(self.orders), self.chunk_size):
+            yield self.orders[start : start + self.chunk_size]
+
+    def parse(self, chunk) -> List[OrderRecord]:
+        return [self.order_record(order_data) for order_data in chunk]
+
+    @staticmethod
+    def order_record(order_data: Dict) -> OrderRecord:
+        # also what Delivery.load_from_shopify syncs from
+        info = parse_shopify_order_info(order_data)
+        candidate = CandidateOrder.from_shopify(info, info.name)
+        shipping_address = order_data["shippingAddress"]
+        return OrderRecord(
+            info.name,
+            online_id=info.online_id,
+            recipient_first_name=candidate.recipient_first_name,
+            recipient_last_name=candidate.recipient_last_name,
+            recipient_phone_number=candidate.recipient_phone_number,
+            address_line_1=shipping_address["address1"],
+            address_line_2=shipping_address["address2"],
+            address_city=shipping_address["city"],
+            address_postal_code=shipping_address["zip"],
+            notes=order_data["note"],
+            delivery_type=parse_shopify_delivery_type(order_data),
+            created_at=candidate.created_at,
+            shift_id=candidate.delivery_shift_id,
+            items=[ItemRecord(**item) for item in parse_shopify_line_items(order_data)],
+        )
+
+
+# what one bad record can raise when its batch is written
+SAVE_ERRORS = (DatabaseError, ValidationError, ValueError)
+
+
+@dataclass
+class ImportResult:
+    saved: int = 0
+    skipped: int = 0
+    failed: int = 0
+
+
+class OrderSink:
+    """
+    Dedupes, validates and bulk-upserts OrderRecords into deliveries and
+    their items, one transaction per batch.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = IMPORT_BATCH_SIZE,
+        skip_existing: bool = False,
+        warn: Callable[[str], None] = print,
+        info: Optional[Callable[[str], None]] = None,
+    ):
+        self.batch_size = batch_size
+        self.skip_existing = skip_existing
+        self.warn = warn
+        self.info = info
+        self.result = ImportResult()
+        self.shift_ids = {
+            (date, time): pk
+            for pk, date, time in Shift.objects.values_list("pk", "date", "time")
+        }
+        self.order_ids: Dict[str, int] = {}
+        for pk, order_number in Delivery.objects.order_by("pk").values_list(
+            "pk", "order_number"
+        ):
+            self.order_ids.setdefault(order_number, pk)
+
+    def resolve_shift(self, record: OrderRecord) -> Optional[int]:
+        if record.shift_id is not None:
+            return record.shift_id
+        return self.shift_ids.get((record.shift_date, record.shift_time))
+
+    def validate(self, record: OrderRecord) -> bool:
+        for warning in record.warnings:
+            self.warn(warning)
+        if record.order_number in self.order_ids and self.skip_existing:
+            if self.info:
+                self.info(f"Skipping existing order {record.order_number}")
+            return False
+        record.shift_id = self.resolve_shift(record)
+        if record.shift_id is None:
+            self.warn(f"Unable to determine shift for order {record.order_number}")
+            return False
+        if not record.items:
+            self.warn(f"No items found for order {record.order_number}")
+            return False
+        return True
+
+    def write(self, records: Iterable[OrderRecord]) -> ImportResult:
+        batch: Dict[str, OrderRecord] = {}
+        for record in records:
+            if not self.validate(record):
+                self.result.skipped += 1
+                continue
+            # a later record for the same order replaces the earlier one
+            batch[record.order_number] = record
+            if len(batch) >= self.batch_size:
+                self.flush(list(batch.values()))
+                batch = {}
+        self.flush(list(batch.values()))
+        return self.result
+
+    def flush(self, batch: List[OrderRecord]) -> None:
+        if not batch:
+            return
+        try:
+            with transaction.atomic():
+                saved = [self.save(batch)]
+        except SAVE_ERRORS:
+            # e.g. a phone number already used by another order, or a value
+            # the column can't hold; retry one at a time so the rest of the
+            # batch still goes in
+            saved = []
+            for record in batch:
+                try:
+                    with transaction.atomic():
+                        saved.append(self.save([record]))
+                except SAVE_ERRORS as e:
+                    self.warn(f"Unable to save order {record.order_number}: {e}")
+                    self.result.failed += 1
+                    continue
+                self.result.saved += 1
+        else:
+            self.result.saved += len(batch)
+        for new_deliveries in saved:
+            for delivery in new_deliveries:
+                self.order_ids[delivery.order_number] = delivery.pk
+        if self.info:
+            self.info(f"Saved {self.result.saved} orders")
+
+    def save(self, batch: List[OrderRecord]) -> List[Delivery]:
+        existing = Delivery.objects.in_bulk(
+            [
+                self.order_ids[record.order_number]
+                for record in batch
+                if record.order_number in self.order_ids
+            ]
+        )
+        now = timezone.now()
+        new_deliveries = []
+        updated_deliveries = []
+        # bulk_create stamps created_at with now, so set the source's after
+        backdated = []
+        items = []
+        shift_deltas: Counter = Counter()
+        for record in batch:
+            delivery = existing.get(self.order_ids.get(record.order_number))
+            if delivery is None:
+                delivery = Delivery(order_number=record.order_number)
+                new_deliveries.append(delivery)
+                if record.created_at is not None:
+                    backdated.append((delivery, record.created_at))
+            else:
+                shift_deltas[delivery.counted_shift_id] -= 1
+                delivery.updated_at = now
+                updated_deliveries.append(delivery)
+            for name, value in record.delivery_fields().items():
+                setattr(delivery, name, value)
+            delivery.delivery_shift_id = record.shift_id
+            shift_deltas[delivery.counted_shift_id] += 1
+            items.extend(
+                Item(delivery=delivery, **asdict(item)) for item in record.items
+            )
+
+        Delivery.objects.bulk_create(new_deliveries)
+        for delivery, created_at in backdated:
+            delivery.created_at = created_at
+        Delivery.objects.bulk_update(
+            updated_deliveries + [delivery for delivery, _ in backdated],
+            ["delivery_shift", "updated_at", *DELIVERY_FIELDS],
+        )
+        Item.objects.filter(delivery__in=updated_deliveries).delete()
+        Item.objects.bulk_create(items)
+        # bulk writes skip the delivery signals, so settle the fill counts
+        # once per batch instead of once per order
+        Shift.objects.adjust_filled_counts(shift_deltas)
+        return new_deliveries
+
+
+def import_orders(
+    sources: Iterable[OrderSource], sink: OrderSink, workers: int = 1
+) -> ImportResult:
+    for source in sources:
+        sink.write(source.records(workers=workers))
+    return sink.result
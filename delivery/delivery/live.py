@@ -0,0 +1,381 @@
+import asyncio
+import datetime
+import json
+import traceback
+from abc import ABC, abstractmethod
+from http.cookies import SimpleCookie
+from importlib import import_module
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.dispatch import receiver
+from django.http import HttpRequest
+from django.http.request import split_domain_port, validate_host
+
+from .actions import CandidateOrder, search_clover_orders_async
+from .clients import OnfleetClient
+from .models import Shift, shift_counts_changed
+from .onfleet import task_order_number, truck_board_tasks_params
+
+# /ws/delivery/live/<feed>, see FEEDS
+LIVE_FEED_PREFIX = "/ws/delivery/live/"
+
+ONFLEET_TASK_COMPLETED = 3
+
+
+class Broadcaster:
+    """
+    Fans messages out to every connected websocket in this process. publish()
+    can be called from any thread, e.g. a sync view's on_commit callback.
+    """
+
+    def __init__(self):
+        self._subscribers: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = set()
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers = {s for s in self._subscribers if s[1] is not queue}
+
+    def publish(self, message: Dict) -> None:
+        for loop, queue in list(self._subscribers):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+
+
+class LiveFeed(ABC):
+    """
+    State shared by every open page of one kind. While any page is
+    subscribed, a single task refreshes it every `interval_setting` seconds
+    and publishes the changes to all of them, so N open pages cost one
+    remote poll instead of N.
+    """
+
+    interval_setting: str
+    staff_only = False
+
+    def __init__(self):
+        self.broadcaster = Broadcaster()
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    @abstractmethod
+    def snapshot(self) -> Optional[Dict]:
+        # the current state, for a page that just connected
+        ...
+
+    @abstractmethod
+    def reset(self) -> None:
+        ...
+
+    @abstractmethod
+    async def poll(self) -> None:
+        ...
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop_if_idle(self) -> None:
+        if self._task is not None and not self.broadcaster.has_subscribers:
+            self._task.cancel()
+            self._task = None
+            self.reset()
+
+    def call_soon(self, callback: Callable, *args) -> bool:
+        # runs callback on the feed's loop from any thread; False when the
+        # feed isn't running in this process
+        task = self._task
+        if task is None or task.get_loop().is_closed():
+            return False
+        task.get_loop().call_soon_threadsafe(callback, *args)
+        return True
+
+    def wake(self) -> None:
+        # poll now instead of at the next interval, e.g. after a webhook
+        wake = self._wake
+        if wake is not None:
+            self.call_soon(wake.set)
+
+    async def _run(self) -> None:
+        assert self._wake is not None
+        while True:
+            self._wake.clear()
+            try:
+                await self.poll()
+            except Exception:
+                traceback.print_exc()
+            try:
+                await asyncio.wait_for(
+                    self._wake.wait(), getattr(settings, self.interval_setting)
+                )
+            except asyncio.TimeoutError:
+                pass
+
+
+def order_summary(order: CandidateOrder) -> Dict:
+    return {
+        "order_number": order.order_number,
+        "created_at": order.created_at.isoformat(),
+        "recipient_name": " ".join(
+            filter(None, [order.recipient_first_name, order.recipient_last_name])
+        ),
+    }
+
+
+class NewOrderPoller(LiveFeed):
+    # runs the New Order search and publishes orders it hasn't seen before
+    interval_setting = "LIVE_POLL_INTERVAL"
+    staff_only = True
+
+    def __init__(self):
+        super().__init__()
+        # latest unscheduled orders, by order number
+        self.orders: Optional[Dict[str, Dict]] = None
+
+    def snapshot(self) -> Optional[Dict]:
+        if self.orders is None:
+            return None
+        return {"type": "orders", "orders": list(self.orders.values())}
+
+    def reset(self) -> None:
+        self.orders = None
+
+    async def poll(self) -> List[Dict]:
+        rows = await search_clover_orders_async(datetime.date.today())
+        orders = {row.order_number: order_summary(row) for row in rows}
+        if self.orders is None:
+            # first search: pages that connected while it ran get everything
+            new_orders = list(orders.values())
+            message = {"type": "orders", "orders": new_orders}
+        else:
+            new_orders = [o for n, o in orders.items() if n not in self.orders]
+            message = {"type": "new_orders", "orders": new_orders}
+        self.orders = orders
+        if new_orders:
+            self.broadcaster.publish(message)
+        return new_orders
+
+
+def worker_summary(worker: Dict) -> Dict:
+    return {"id": worker["id"], "name": worker["name"], "tasks": list(worker["tasks"])}
+
+
+def task_summary(task: Dict) -> Dict:
+    recipients = task.get("recipients") or [{}]
+    return {
+        "id": task["id"],
+        "state": task["state"],
+        "worker": task.get("worker"),
+        "order_number": task_order_number(task),
+        "recipient_name": recipients[0].get("name"),
+        "completed_at": (task.get("completionDetails") or {}).get("time"),
+    }
+
+
+class TruckBoard(LiveFeed):
+    """
+    Today's routes: each worker's task queue plus every task's state. Onfleet
+    webhooks update it as tasks are assigned, started and completed, and
+    only the changed workers and tasks are published; the poll is a slow
+    reconciliation in case a webhook is missed.
+    """
+
+    interval_setting = "TRUCK_BOARD_POLL_INTERVAL"
+
+    def __init__(self):
+        super().__init__()
+        self.workers: Optional[Dict[str, Dict]] = None
+        self.tasks: Optional[Dict[str, Dict]] = None
+
+    def snapshot(self) -> Optional[Dict]:
+        if self.workers is None or self.tasks is None:
+            return None
+        return self.diff({}, self.workers, {}, self.tasks)
+
+    def reset(self) -> None:
+        self.workers = None
+        self.tasks = None
+
+    async def poll(self) -> None:
+        client = OnfleetClient()
+        workers_data, tasks_data = await asyncio.gather(
+            client.get("workers"), client.get("tasks", truck_board_tasks_params())
+        )
+        tasks = {t["id"]: task_summary(t) for t in tasks_data}
+        # workers with a route today, including ones who've finished it
+        route_workers = {t["worker"] for t in tasks.values()}
+        workers = {
+            w["id"]: worker_summary(w)
+            for w in workers_data
+            if w["tasks"] or w["id"] in route_workers
+        }
+        self.update(workers, tasks)
+
+    def apply_task(self, task_data: Dict) -> None:
+        # a task from an onfleet webhook; must run on the feed's loop
+        if self.workers is None or self.tasks is None:
+            return
+        task = task_summary(task_data)
+        if task["worker"] is not None and task["worker"] not in self.workers:
+            # assigned to a worker the board doesn't know yet
+            self.wake()
+            return
+        workers = dict(self.workers)
+        for worker_id, worker in self.workers.items():
+            queued = task["id"] in worker["tasks"]
+            belongs = (
+                worker_id == task["worker"] and task["state"] != ONFLEET_TASK_COMPLETED
+            )
+            if queued and not belongs:
+                workers[worker_id] = {
+                    **worker,
+                    "tasks": [t for t in worker["tasks"] if t != task["id"]],
+                }
+            elif belongs and not queued:
+                workers[worker_id] = {**worker, "tasks": worker["tasks"] + [task["id"]]}
+        self.update(workers, {**self.tasks, task["id"]: task})
+
+    def update(self, workers: Dict[str, Dict], tasks: Dict[str, Dict]) -> None:
+        message = self.diff(self.workers or {}, workers, self.tasks or {}, tasks)
+        self.workers, self.tasks = workers, tasks
+        if any(message[k] for k in message if k != "type"):
+            self.broadcaster.publish(message)
+
+    @staticmethod
+    def diff(
+        old_workers: Dict[str, Dict],
+        workers: Dict[str, Dict],
+        old_tasks: Dict[str, Dict],
+        tasks: Dict[str, Dict],
+    ) -> Dict:
+        return {
+            "type": "route",
+            "workers": {k: w for k, w in workers.items() if old_workers.get(k) != w},
+            "tasks": {k: t for k, t in tasks.items() if old_tasks.get(k) != t},
+            "removed_workers": [k for k in old_workers if k not in workers],
+            "removed_tasks": [k for k in old_tasks if k not in tasks],
+        }
+
+
+new_order_poller = NewOrderPoller()
+truck_board = TruckBoard()
+
+FEEDS: Dict[str, LiveFeed] = {"orders": new_order_poller, "trucks": truck_board}
+
+
+def get_shift_counts(shift_ids: Optional[Sequence[int]] = None) -> List[Dict]:
+    shifts = Shift.objects.order_by("date", "time")
+    if shift_ids is None:
+        shifts = shifts.filter(date__gte=datetime.date.today())
+    else:
+        shifts = shifts.filter(pk__in=shift_ids)
+    return [
+        {
+            "id": shift.pk,
+            "filled_count": shift.filled_count,
+            "slots_available": shift.slots_available,
+            "label": str(shift),
+        }
+        for shift in shifts
+    ]
+
+
+@receiver(shift_counts_changed)
+def publish_shift_counts(sender, shift_ids=None, **kwargs):
+    # skip the query when no page is listening
+    if new_order_poller.broadcaster.has_subscribers:
+        new_order_poller.broadcaster.publish(
+            {"type": "shifts", "shifts": get_shift_counts(shift_ids)}
+        )
+
+
+def get_scope_header(scope: Dict, header: bytes) -> Optional[str]:
+    for name, value in scope.get("headers", []):
+        if name == header:
+            return value.decode("latin-1")
+    return None
+
+
+def is_allowed_origin(scope: Dict) -> bool:
+    # the session cookie goes along with a socket opened from any site, so
+    # only pages served from this app's own hosts may connect
+    origin = get_scope_header(scope, b"origin")
+    if origin is None:
+        return False
+    if origin in settings.CSRF_TRUSTED_ORIGINS:
+        return True
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        # what Django's host validation allows in this case
+        allowed_hosts = [".localhost", "127.0.0.1", "[::1]"]
+    domain, _ = split_domain_port(urlsplit(origin).netloc)
+    return bool(domain) and validate_host(domain, allowed_hosts)
+
+
+def get_scope_user(scope: Dict):
+    # the session cookie the page was loaded with logs in the websocket too
+    cookies = SimpleCookie()
+    cookie = get_scope_header(scope, b"cookie")
+    if cookie is not None:
+        cookies.load(cookie)
+    request = HttpRequest()
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    engine = import_module(settings.SESSION_ENGINE)
+    request.session = engine.SessionStore(morsel.value if morsel else None)
+    return auth.get_user(request)
+
+
+async def live_feed(scope, receive, send):
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+    feed = FEEDS.get(scope["path"][len(LIVE_FEED_PREFIX) :])
+    if feed is None:
+        await send({"type": "websocket.close", "code": 4404})
+        return
+    if not is_allowed_origin(scope):
+        await send({"type": "websocket.close", "code": 4403})
+        return
+    user = await sync_to_async(get_scope_user)(scope)
+    if not (user.is_active and (user.is_staff or not feed.staff_only)):
+        await send({"type": "websocket.close", "code": 4403})
+        return
+    await send({"type": "websocket.accept"})
+
+    # taken together with subscribing, so a poll finishing in between is
+    # either in the snapshot or published to the queue, not both
+    queue = feed.broadcaster.subscribe()
+    snapshot = feed.snapshot()
+    feed.start()
+
+    async def forward():
+        if snapshot is not None:
+            await send({"type": "websocket.send", "text": json.dumps(snapshot)})
+        while True:
+            message = await queue.get()
+            await send({"type": "websocket.send", "text": json.dumps(message)})
+
+    forwarding = asyncio.ensure_future(forward())
+    try:
+        while True:
+            event = await receive()
+            if event["type"] == "websocket.disconnect":
+                break
+            if event["type"] == "websocket.receive" and event.get("text") == "ping":
+                await send({"type": "websocket.send", "text": "pong!"})
+    finally:
+        forwarding.cancel()
+        feed.broadcaster.unsubscribe(queue)
+        feed.stop_if_idle()
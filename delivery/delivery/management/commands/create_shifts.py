@@ -1,9 +1,77 @@
+import json
+from datetime import date as Date
 from datetime import datetime, timedelta
+from typing import Dict, List
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
 from delivery.delivery.models import Shift
 
+DEFAULT_SLOTS = {"AM": 20, "PM": 20}
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+TIME_CODES = {code for code, _ in Shift._meta.get_field("time").choices}
+
+
+def load_spec(path: str) -> Dict[str, Dict[str, int]]:
+    """
+    Returns the slot counts by time code for each weekday, e.g.
+    {"default": {"AM": 20, "PM": 20}, "sat": {"AM": 30, "PM": 30, "SP": 10}}.
+    Weekdays that aren't listed use "default"; an empty mapping skips the day.
+    """
+    with open(path) as spec_file:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError as exc:
+                raise CommandError("PyYAML is required for YAML specs") from exc
+            spec = yaml.safe_load(spec_file)
+        else:
+            spec = json.load(spec_file)
+
+    if not isinstance(spec, dict):
+        raise CommandError("Shift spec must be a mapping of weekday to slots")
+    spec = {str(key).lower()[:3]: value for key, value in spec.items()}
+    unknown_days = set(spec) - set(WEEKDAYS) - {"def"}
+    if unknown_days:
+        raise CommandError(f"Unknown weekdays in spec: {', '.join(unknown_days)}")
+    default = spec.pop("def", DEFAULT_SLOTS)
+    slots_by_weekday = {day: spec.get(day, default) or {} for day in WEEKDAYS}
+    for day, slots in slots_by_weekday.items():
+        unknown_times = set(slots) - TIME_CODES
+        if unknown_times:
+            raise CommandError(
+                f"Unknown shift times for {day}: {', '.join(unknown_times)}"
+            )
+    return slots_by_weekday
+
+
+def build_shifts(
+    start_date: Date, end_date: Date, slots_by_weekday: Dict[str, Dict[str, int]]
+) -> List[Shift]:
+    shifts = []
+    date = start_date
+    while date < end_date:
+        for time, slots in slots_by_weekday[WEEKDAYS[date.weekday()]].items():
+            shifts.append(Shift(date=date, time=time, slots_available=int(slots)))
+        date += timedelta(days=1)
+    return shifts
+
+
+def insert_shifts(shifts: List[Shift]) -> int:
+    """
+    Inserts the shifts, skipping (date, time) pairs that already exist, and
+    returns how many were inserted.
+    """
+    if not shifts:
+        return 0
+    in_range = Shift.objects.filter(
+        date__gte=min(s.date for s in shifts), date__lte=max(s.date for s in shifts)
+    )
+    num_before = in_range.count()
+    Shift.objects.bulk_create(shifts, ignore_conflicts=True)
+    return in_range.count() - num_before
+
 
 class Command(BaseCommand):
     help = "Creates shifts as a template"
@@ -11,17 +79,57 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("start_date")
         parser.add_argument("end_date")
+        parser.add_argument(
+            "--spec",
+            help="JSON (or YAML) file of slot counts by weekday and time code",
+        )
+        parser.add_argument(
+            "--keep-existing",
+            action="store_true",
+            help="Don't change slot counts on shifts that already exist",
+        )
 
     def handle(self, *args, **options):
-        date = datetime.strptime(options["start_date"], "%Y-%m-%d").date()
+        start_date = datetime.strptime(options["start_date"], "%Y-%m-%d").date()
         end_date = datetime.strptime(options["end_date"], "%Y-%m-%d").date()
+        slots_by_weekday = (
+            load_spec(options["spec"])
+            if options["spec"]
+            else {day: DEFAULT_SLOTS for day in WEEKDAYS}
+        )
+        shifts = build_shifts(start_date, end_date, slots_by_weekday)
 
-        while date < end_date:
-            shift = Shift(date=date, time="AM", slots_available=20)
-            shift.save()
-            shift = Shift(date=date, time="PM", slots_available=20)
-            shift.save()
+        with transaction.atomic():
+            in_range = Shift.objects.filter(date__gte=start_date, date__lt=end_date)
+            existing = {
+                (shift.date, shift.time): shift
+                for shift in in_range.select_for_update().only(
+                    "id", "date", "time", "slots_available"
+                )
+            }
+            to_create = []
+            to_update = []
+            for shift in shifts:
+                current = existing.get((shift.date, shift.time))
+                if current is None:
+                    to_create.append(shift)
+                elif (
+                    current.slots_available != shift.slots_available
+                    and not options["keep_existing"]
+                ):
+                    current.slots_available = shift.slots_available
+                    to_update.append(current)
 
-            date += timedelta(days=1)
+            # shifts added by someone else since the read are skipped
+            num_created = insert_shifts(to_create)
+            Shift.objects.bulk_update(to_update, ["slots_available"])
+            in_range.recount()
 
-        self.stdout.write(self.style.SUCCESS("Done"))
+        num_unchanged = len(shifts) - len(to_create) - len(to_update)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {num_created}, updated {len(to_update)}, "
+                f"unchanged {num_unchanged}, "
+                f"skipped {len(to_create) - num_created} shifts"
+            )
+        )
@@ -0,0 +1,73 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from delivery.delivery.importers import (
+    IMPORT_BATCH_SIZE,
+    CsvSource,
+    EcwidSource,
+    JsonlSource,
+    OrderSink,
+    import_orders,
+)
+
+SOURCES = {
+    "csv": CsvSource,
+    "ecwid": EcwidSource,
+    "jsonl": JsonlSource,
+}
+EXTENSION_FORMATS = {
+    ".csv": "csv",
+    ".tsv": "ecwid",
+    ".jsonl": "jsonl",
+}
+
+
+class Command(BaseCommand):
+    help = "Imports deliveries from order export files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="+")
+        parser.add_argument(
+            "--format",
+            choices=sorted(SOURCES),
+            help="File format; guessed from the extension by default",
+        )
+        parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Processes to parse files with",
+        )
+        parser.add_argument(
+            "--skip-existing",
+            action="store_true",
+            help="Leave orders that are already in the database alone",
+        )
+
+    def get_source(self, path, file_format):
+        if file_format is None:
+            extension = os.path.splitext(path)[1].lower()
+            if extension not in EXTENSION_FORMATS:
+                raise CommandError(f"Unable to tell the format of {path}")
+            file_format = EXTENSION_FORMATS[extension]
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+        return SOURCES[file_format](path)
+
+    def handle(self, *args, **options):
+        sources = [self.get_source(p, options["format"]) for p in options["files"]]
+        sink = OrderSink(
+            batch_size=options["batch_size"],
+            skip_existing=options["skip_existing"],
+            warn=lambda message: self.stdout.write(self.style.WARNING(message)),
+            info=self.stdout.write if options["verbosity"] > 1 else None,
+        )
+        result = import_orders(sources, sink, workers=options["workers"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Saved {result.saved} orders, skipped {result.skipped}, "
+                f"failed {result.failed}"
+            )
+        )
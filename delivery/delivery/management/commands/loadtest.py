@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+from typing import List
+
+import httpx
+from django.core.management.base import BaseCommand
+
+from delivery.delivery.profiling import percentile
+
+
+async def measure(url: str, num_requests: int, concurrency: int, cookies: dict) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(
+        cookies=cookies, timeout=None, limits=httpx.Limits(max_connections=concurrency)
+    ) as client:
+
+        async def one_request():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one_request() for _ in range(num_requests)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "url": url,
+        "requests": num_requests,
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput": num_requests / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures throughput of concurrent GET requests against running servers, "
+        "e.g. a sync page and its async variant under uvicorn"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("urls", nargs="+")
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument(
+            "--session",
+            help="sessionid cookie of a logged in user, for pages behind login",
+        )
+
+    def handle(self, *args, **options):
+        # one log line per request would drown out the results
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        cookies = {"sessionid": options["session"]} if options["session"] else {}
+        for url in options["urls"]:
+            result = asyncio.run(
+                measure(url, options["requests"], options["concurrency"], cookies)
+            )
+            latency = (
+                f"p50 {result['p50'] * 1000:.0f} ms, p95 {result['p95'] * 1000:.0f} ms"
+                if result["p50"] is not None
+                else "no successful requests"
+            )
+            self.stdout.write(
+                f"{url}: {result['requests']} requests in {result['seconds']:.2f}s "
+                f"({result['throughput']:.1f}/s), {latency}, "
+                f"{result['errors']} errors"
+            )
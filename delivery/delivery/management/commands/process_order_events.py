@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from delivery.delivery.actions import process_order_events
+
+
+class Command(BaseCommand):
+    help = "Sync orders with pending webhook events"
+
+    def handle(self, *args, **options):
+        num_processed = 0
+        while True:
+            processed = process_order_events()
+            if not processed:
+                break
+            num_processed += processed
+        self.stdout.write(self.style.SUCCESS(f"Processed {num_processed} events"))
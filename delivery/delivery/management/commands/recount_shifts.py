@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from delivery.delivery.models import Shift
+
+
+class Command(BaseCommand):
+    help = "Recompute shift fill counts from the deliveries table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--id", type=int, nargs="*")
+
+    def handle(self, *args, **options):
+        shifts = Shift.objects.all()
+        if options["id"]:
+            shifts = shifts.filter(pk__in=options["id"])
+        num_updated = shifts.recount()
+        self.stdout.write(self.style.SUCCESS(f"Recounted {num_updated} shifts"))
@@ -25,4 +25,4 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING("No orders found"))
             return
         for o in orders:
-            print(o)
+            print(o.to_delivery())
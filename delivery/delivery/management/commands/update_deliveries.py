@@ -1,6 +1,15 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Q
+from django.db.models.functions import Upper
+from django.utils.dateparse import parse_datetime
 
+from delivery.delivery.actions import sync_deliveries
+from delivery.delivery.clover import search_clover_by_modified_time
 from delivery.delivery.models import Delivery
+from delivery.delivery.shopify import get_ids_updated_since
+from delivery.delivery.signals import defer_shift_count_updates
+
+SYNC_BATCH_SIZE = 100
 
 
 class Command(BaseCommand):
@@ -8,12 +17,81 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("--id", type=int)
+        parser.add_argument(
+            "--since",
+            help=(
+                "Only sync orders changed at the source since this time "
+                "(ISO 8601), or 'last' for the newest change already synced"
+            ),
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Re-apply orders even when the source hasn't changed",
+        )
+
+    def get_watermark(self, since):
+        if since == "last":
+            return Delivery.objects.aggregate(watermark=Max("source_modified_at"))[
+                "watermark"
+            ]
+        watermark = parse_datetime(since)
+        if watermark is None or watermark.tzinfo is None:
+            raise CommandError(f"Invalid --since time with time zone: {since}")
+        return watermark
 
     def handle(self, *args, **options):
         if options["id"]:
-            deliveries = [Delivery.objects.get(pk=options["id"])]
+            deliveries = Delivery.objects.filter(pk=options["id"])
         else:
             deliveries = Delivery.objects.all()
-        for delivery in deliveries:
-            delivery.sync()
-            delivery.save()
+        deliveries = deliveries.exclude(order_number=None)
+
+        watermark = self.get_watermark(options["since"]) if options["since"] else None
+        if watermark is not None:
+            clover_ids = [
+                o["id"].upper() for o in search_clover_by_modified_time(watermark)
+            ]
+            deliveries = deliveries.annotate(clover_id=Upper("order_number")).filter(
+                Q(online_id=None, clover_id__in=clover_ids)
+                | Q(online_id__in=get_ids_updated_since(watermark))
+            )
+
+        deliveries = list(deliveries.order_by("pk"))
+        num_changed = num_failed = 0
+        for start in range(0, len(deliveries), SYNC_BATCH_SIZE):
+            batch = deliveries[start : start + SYNC_BATCH_SIZE]
+            try:
+                num_changed += self.sync_batch(batch, options["force"])
+                continue
+            except Exception:
+                pass
+            # retry the batch order by order to skip only the ones that fail;
+            # reloaded, since the failed attempt may have applied changes
+            for delivery in Delivery.objects.filter(
+                pk__in=[d.pk for d in batch]
+            ).order_by("pk"):
+                try:
+                    num_changed += self.sync_batch([delivery], options["force"])
+                except Exception as e:
+                    num_failed += 1
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f"Unable to sync order {delivery.order_number}: {e}"
+                        )
+                    )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Updated {num_changed} of {len(deliveries)} orders, "
+                f"failed {num_failed}"
+            )
+        )
+
+    def sync_batch(self, batch, force):
+        # one transaction per batch, so a failure only rolls back its batch
+        # and no transaction stays open across the whole run
+        with defer_shift_count_updates():
+            changed = sync_deliveries(batch, force=force)
+            for delivery in changed:
+                delivery.save()
+        return len(changed)
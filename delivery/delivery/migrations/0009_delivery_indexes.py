@@ -0,0 +1,55 @@
+# Generated by Django 4.1.3 on 2026-10-18 23:35
+
+from django.db import migrations, models
+import django.db.models.functions.text
+import phonenumber_field.modelfields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("delivery", "0008_alter_delivery_recipient_phone_number"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="delivery",
+            name="recipient_phone_number",
+            field=phonenumber_field.modelfields.PhoneNumberField(
+                blank=True,
+                error_messages={
+                    "unique": "Phone numbers must be unique, or it will be a problem for Onfleet. If you have two legitimate deliveries with the same phone number, the easiest workaround is to set one of them to a random number such as 201-111-1111 and put the real number in the notes."
+                },
+                max_length=255,
+                null=True,
+                region="US",
+                unique=True,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="delivery",
+            index=models.Index(
+                django.db.models.functions.text.Upper("order_number"),
+                name="delivery_order_number_upper",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="delivery",
+            index=models.Index(fields=["online_id"], name="delivery_online_id"),
+        ),
+        migrations.AddIndex(
+            model_name="delivery",
+            index=models.Index(
+                fields=[
+                    "delivery_shift",
+                    "recipient_last_name",
+                    "recipient_first_name",
+                ],
+                name="delivery_shift_recipient",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="delivery",
+            index=models.Index(fields=["created_at"], name="delivery_created_at"),
+        ),
+    ]
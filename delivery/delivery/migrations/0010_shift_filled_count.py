@@ -0,0 +1,44 @@
+# Generated by Django 4.1.3 on 2026-10-18 23:41
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def recount_shifts(apps, schema_editor):
+    """Populate filled_count from the existing deliveries."""
+    Shift = apps.get_model("delivery", "Shift")
+    Delivery = apps.get_model("delivery", "Delivery")
+    Shift.objects.update(
+        filled_count=Coalesce(
+            Subquery(
+                Delivery.objects.filter(delivery_shift=OuterRef("pk"))
+                .values("delivery_shift")
+                .annotate(count=Count("pk"))
+                .values("count")
+            ),
+            0,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("delivery", "0009_delivery_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="shift",
+            name="filled_count",
+            field=models.SmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(recount_shifts, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="shift",
+            index=models.Index(
+                fields=["date", "filled_count"], name="shift_date_filled_count"
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.3 on 2026-10-19 00:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("delivery", "0010_shift_filled_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="delivery",
+            name="source_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=64, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="delivery",
+            name="source_modified_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.1.3 on 2026-10-19 00:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("delivery", "0011_delivery_source_sync"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderEvent",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "source",
+                    models.CharField(
+                        choices=[("clover", "Clover"), ("shopify", "Shopify")],
+                        max_length=10,
+                    ),
+                ),
+                ("remote_id", models.CharField(max_length=40)),
+                ("topic", models.CharField(max_length=40)),
+                ("received_at", models.DateTimeField(auto_now=True)),
+                ("processed_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="orderevent",
+            index=models.Index(
+                fields=["processed_at", "received_at"], name="order_event_pending"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.3 on 2026-10-19 00:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("delivery", "0012_orderevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="delivery",
+            name="cancelled_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
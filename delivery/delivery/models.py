@@ -1,30 +1,110 @@
 import datetime
+import hashlib
+import json
 import os
-from typing import Dict, Optional
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
 
-import dateutil.parser
 import phonenumbers
 import pytz
 from django.conf import settings
 from django.core.cache import cache
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Upper
+from django.dispatch import Signal
 from django.template.defaultfilters import truncatechars  # or truncatewords
 from django.urls import reverse
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from phonenumber_field.modelfields import PhoneNumberField
 
-from delivery.delivery.clover import get_delivery_type as get_delivery_type_for_clover
-from delivery.delivery.clover import (
-    is_clover_delivery_item,
-    request_clover_customer,
-    request_clover_orders,
-)
+from delivery.delivery.clover import parse_line_items as parse_clover_line_items
+from delivery.delivery.clover import parse_modified_time as parse_clover_modified_time
+from delivery.delivery.clover import request_clover_customer, request_clover_orders
 from delivery.delivery.constants import DeliveryTypes
 
+ONFLEET_TIMEZONE = pytz.timezone("America/Los_Angeles")
+AVAILABLE_SHIFTS_CACHE_VERSION_KEY = "available_shifts_version"
+
+# sent once fill count changes commit, with the changed shift_ids (None when
+# every shift was recounted)
+shift_counts_changed = Signal()
+
+
+class ShiftFullError(ValueError):
+    pass
+
+
+class ShiftQuerySet(models.QuerySet):
+    def available(
+        self,
+        on_or_after: Optional[datetime.date] = None,
+        min_slots: int = 1,
+        time: Optional[str] = None,
+    ) -> "ShiftQuerySet":
+        shifts = self.filter(
+            date__gte=on_or_after or datetime.date.today(),
+            filled_count__lte=models.F("slots_available") - min_slots,
+        )
+        if time:
+            shifts = shifts.filter(time=time)
+        return shifts.order_by("date", "time")
+
+    def lock(self, shift_ids: Iterable[Optional[int]]) -> None:
+        # locks every shift a save touches up front, in id order, so saves
+        # over overlapping shifts queue on the first row instead of deadlocking
+        ids = sorted({shift_id for shift_id in shift_ids if shift_id is not None})
+        list(
+            self.select_for_update()
+            .filter(pk__in=ids)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+
+    def reserve(self, shift_id: int, count: int = 1) -> "Shift":
+        # must run inside the transaction that saves the deliveries, so the
+        # row lock holds off other bookings for this shift until commit
+        shift = self.select_for_update().get(pk=shift_id)
+        if shift.filled_count + count > shift.slots_available:
+            raise ShiftFullError(
+                "{shift} has {num} of {available} slots remaining.".format(
+                    shift=shift.datetime_display,
+                    num=max(shift.slots_remaining, 0),
+                    available=shift.slots_available,
+                )
+            )
+        return shift
+
+    def adjust_filled_counts(self, deltas: Mapping[Optional[int], int]) -> None:
+        changed_ids = []
+        for shift_id, delta in deltas.items():
+            if shift_id is None or not delta:
+                continue
+            self.filter(pk=shift_id).update(
+                filled_count=models.F("filled_count") + delta
+            )
+            changed_ids.append(shift_id)
+        if changed_ids:
+            transaction.on_commit(lambda: Shift.counts_changed(changed_ids))
+
+    def recount(self) -> int:
+        # repair filled_count from the deliveries table in a single UPDATE
+        transaction.on_commit(Shift.counts_changed)
+        return self.update(
+            filled_count=Coalesce(
+                models.Subquery(
+                    Delivery.objects.filter(
+                        delivery_shift=models.OuterRef("pk"), cancelled_at=None
+                    )
+                    .values("delivery_shift")
+                    .annotate(count=models.Count("pk"))
+                    .values("count")
+                ),
+                0,
+            )
+        )
+
 
 class Shift(models.Model):
-    SHIFT_FILLED_CACHE_TEMPLATE = "shift_{id}_count_filled"
     date = models.DateField()
     time = models.CharField(
         choices=(("AM", "AM"), ("PM", "PM"), ("SP", "Special")),
@@ -33,6 +113,11 @@ class Shift(models.Model):
     slots_available = models.SmallIntegerField(
         default=20,
     )
+    # maintained by the delivery signals and bulk paths, see recount_shifts
+    filled_count = models.SmallIntegerField(
+        default=0,
+        editable=False,
+    )
     comment = models.CharField(
         blank=True,
         null=True,
@@ -43,35 +128,24 @@ class Shift(models.Model):
         null=True,
     )
 
+    objects = ShiftQuerySet.as_manager()
+
     @classmethod
-    def bust_available_shift_cache(cls) -> None:
-        # naive bust for when we have changes
-        cache.delete_many(
-            [
-                Shift.SHIFT_FILLED_CACHE_TEMPLATE.format(id=sid)
-                for sid in cls.objects.all().values_list("id", flat=True)
-            ]
-        )
+    def available_shifts_cache_version(cls) -> int:
+        return cache.get(AVAILABLE_SHIFTS_CACHE_VERSION_KEY, 0)
 
     @classmethod
-    def set_available_shift_cache(cls) -> None:
-        shift_ids = cls.objects.all().values_list("id", flat=True)
-        shift_counts = Delivery.objects.values("delivery_shift_id").annotate(
-            models.Count("delivery_shift_id")
-        )
-        count_by_shift = {
-            shift_count["delivery_shift_id"]: shift_count["delivery_shift_id__count"]
-            for shift_count in shift_counts
-        }
+    def bust_available_shifts_cache(cls) -> None:
+        # bumping the version orphans every cached available-shifts response
+        try:
+            cache.incr(AVAILABLE_SHIFTS_CACHE_VERSION_KEY)
+        except ValueError:
+            cache.set(AVAILABLE_SHIFTS_CACHE_VERSION_KEY, 1, None)
 
-        cache.set_many(
-            {
-                Shift.SHIFT_FILLED_CACHE_TEMPLATE.format(id=sid): count_by_shift.get(
-                    sid, 0
-                )
-                for sid in shift_ids
-            }
-        )
+    @classmethod
+    def counts_changed(cls, shift_ids: Optional[Sequence[int]] = None) -> None:
+        cls.bust_available_shifts_cache()
+        shift_counts_changed.send(cls, shift_ids=shift_ids)
 
     @property
     def date_display(self):
@@ -83,14 +157,7 @@ class Shift(models.Model):
 
     @property
     def slots_filled(self) -> int:
-        if self.id is None:
-            return 0
-        cache_key = self.SHIFT_FILLED_CACHE_TEMPLATE.format(id=self.id)
-        count = cache.get(cache_key, None)
-        if count is None:
-            self.set_available_shift_cache()
-            count = cache.get(cache_key, 0)
-        return count
+        return self.filled_count
 
     @property
     def slots_remaining(self):
@@ -110,6 +177,17 @@ class Shift(models.Model):
             return None
         return self.date >= datetime.date.today() and self.slots_remaining > 0
 
+    def onfleet_time_window(self) -> Tuple[float, float]:
+        complete_after = datetime.datetime.combine(
+            min(self.date, datetime.date.today()),
+            datetime.time(13 if self.time == "PM" else 9, tzinfo=ONFLEET_TIMEZONE),
+        )
+        complete_before = datetime.datetime.combine(
+            self.date,
+            datetime.time(18 if self.time == "PM" else 12, tzinfo=ONFLEET_TIMEZONE),
+        )
+        return (complete_after.timestamp() * 1000, complete_before.timestamp() * 1000)
+
     def push_button(self):
         if not self.id:
             return "[save record first]"
@@ -129,8 +207,10 @@ class Shift(models.Model):
         return mark_safe(
             format_html(
                 '<a class="button" href="{walk}" target="_blank">Generate Walk List</a>&nbsp;'
+                '<a class="button" href="{sheets}?shift={id}" target="_blank">Generate Delivery Sheets</a>&nbsp;'
                 '<button class="button onfleet-button shift" name="_push" data-id="{id}">Send to Onfleet</button>',
                 walk=reverse("walk-list", args=[self.id]),
+                sheets=reverse("order-sheets"),
                 id=self.id,
             )
         )
@@ -146,22 +226,52 @@ class Shift(models.Model):
 
     class Meta:
         unique_together = (("date", "time"),)
+        indexes = [
+            models.Index(
+                fields=["date", "filled_count"], name="shift_date_filled_count"
+            ),
+        ]
 
 
 # dirty hack import this here to avoid initialization error
 # due to circular dependency with delivery.delivery.shopify
-from delivery.delivery.shopify import ShopifyOrderInfo, get_data_by_id
-from delivery.delivery.shopify import (
-    parse_delivery_type_from_data as parse_delivery_type_from_shopify_data,
-)
-from delivery.delivery.shopify import (
-    parse_order_info_from_data as parse_shopify_order_info_from_data,
-)
+from delivery.delivery.shopify import get_data_by_id
+from delivery.delivery.shopify import parse_cancelled_at as parse_shopify_cancelled_at
+from delivery.delivery.shopify import parse_line_items as parse_shopify_line_items
+from delivery.delivery.shopify import parse_updated_at as parse_shopify_updated_at
 
 DUPLICATE_PHONE_MESSAGE = "Phone numbers must be unique, or it will be a problem for Onfleet. If you have two legitimate deliveries with the same phone number, the easiest workaround is to set one of them to a random number such as 201-111-1111 and put the real number in the notes."
 
 
+ADDRESS_FIELDS = (
+    "address_line_1",
+    "address_line_2",
+    "address_city",
+    "address_postal_code",
+)
+
+
 class Delivery(models.Model):
+    # fields written by load_from_clover/load_from_shopify, for bulk_update
+    SYNCED_FIELDS = [
+        "delivery_shift",
+        "recipient_last_name",
+        "recipient_first_name",
+        "recipient_phone_number",
+        "recipient_email",
+        "address_line_1",
+        "address_line_2",
+        "address_city",
+        "address_postal_code",
+        "notes",
+        "delivery_type",
+        "created_at",
+        "updated_at",
+        "source_modified_at",
+        "source_hash",
+        "cancelled_at",
+    ]
+
     order_number = models.CharField(
         verbose_name="clover order number",
         blank=True,
@@ -233,6 +343,23 @@ class Delivery(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # modifiedTime/updatedAt and a hash of the last payload applied by sync
+    source_modified_at = models.DateTimeField(blank=True, null=True, editable=False)
+    source_hash = models.CharField(blank=True, null=True, max_length=64, editable=False)
+    cancelled_at = models.DateTimeField(blank=True, null=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the stored shift so the save signal can move the fill count
+        if {"delivery_shift_id", "cancelled_at"} <= instance.__dict__.keys():
+            instance._loaded_counted_shift_id = instance.counted_shift_id
+        return instance
+
+    @property
+    def counted_shift_id(self) -> Optional[int]:
+        # cancelled orders keep their shift for reference but free the slot
+        return None if self.cancelled_at else self.delivery_shift_id
 
     @property
     def recipient_sort_name(self):
@@ -279,121 +406,88 @@ class Delivery(models.Model):
     #
     # CLOVER sync
     #
-    def _load_clover_items(self, order_data):
-        if not order_data.get("lineItems", None):
-            return
-        if not order_data["lineItems"].get("elements", None):
-            return
-        items = order_data["lineItems"]["elements"]
-        current_items = [i.item_name for i in self.item_set.all()]
-        item_dict: Dict[str, int] = {}
-        for item in items:
-            if item["refunded"]:
-                continue
-            item_name = item["name"]
-            if item_name in current_items:
+    def reconcile_items(self, line_items: Sequence[Dict]) -> None:
+        # line_items are Item field dicts from the remote order. Rows pulled
+        # from it before are matched by clover_id, then name, and updated or
+        # deleted to follow quantity changes and refunds; rows added by hand
+        # (is_pulled=False) are only ever adopted by name, never deleted.
+        existing = list(Item.objects.filter(delivery=self))
+        by_clover_id = {i.clover_id: i for i in existing if i.clover_id}
+        by_name: Dict[str, Item] = {}
+        for item in existing:
+            by_name.setdefault(item.item_name, item)
+        matched: Set[int] = set()
+        to_create = []
+        to_update = []
+        for line_item in line_items:
+            item = by_clover_id.get(line_item.get("clover_id"))
+            if item is None or item.pk in matched:
+                item = by_name.get(line_item["item_name"])
+            if item is None or item.pk in matched:
+                to_create.append(Item(delivery=self, is_pulled=True, **line_item))
                 continue
-            if is_clover_delivery_item(item_name):
-                continue
-            item_dict[item_name] = item_dict.get(item_name, 0) + 1
-        for item in items:
-            item_name = item["name"]
-            quantity = item_dict.pop(item_name, 0)
-            if quantity <= 0:
-                continue
-            self.item_set.create(
-                clover_id=item["id"],
-                item_name=item_name,
-                quantity=quantity,
-                is_pulled=True,
+            matched.add(item.pk)
+            changes = {
+                field: value
+                for field, value in {**line_item, "is_pulled": True}.items()
+                if getattr(item, field) != value
+            }
+            if changes:
+                for field, value in changes.items():
+                    setattr(item, field, value)
+                to_update.append(item)
+
+        stale = [i.pk for i in existing if i.is_pulled and i.pk not in matched]
+        if stale:
+            Item.objects.filter(pk__in=stale).delete()
+        if to_update:
+            Item.objects.bulk_update(
+                to_update, ["item_name", "quantity", "clover_id", "is_pulled"]
             )
+        if to_create:
+            Item.objects.bulk_create(to_create)
 
-    def _load_clover_customer(self, order_data):
-        if not order_data.get("customers", None) or not order_data["customers"].get(
-            "elements", None
-        ):
+    def _load_clover_items(self, order_data):
+        # skip if the order data doesn't have items (vs. all refunded)
+        if not order_data.get("lineItems", None):
             return
-        customers = order_data["customers"]["elements"]
-        if len(customers) != 1:
+        self.reconcile_items(parse_clover_line_items(order_data))
+
+    def load_from_clover(self, order_data, skip_items=False):
+        # the field mapping is the Clover import adapter's, which builds on
+        # these models and so is imported here
+        from delivery.delivery.importers import CloverSource
+
+        customers = (order_data.get("customers") or {}).get("elements") or []
+        if len(customers) > 1:
             raise ValueError(
                 f"Unexpected number ({len(customers)}) of customers found on order"
             )
-        customer = customers[0]
-        self.recipient_last_name = customer.get("lastName")
-        self.recipient_first_name = customer.get("firstName")
-        # get customer data from Clover
-        if customer["href"]:
-            customer_data = request_clover_customer(customer["id"])
-            self.recipient_last_name = self.recipient_last_name or customer_data.get(
-                "lastName", None
-            )
-            self.recipient_first_name = self.recipient_first_name or customer_data.get(
-                "firstName", None
+        customer_data = {}
+        if customers and customers[0]["href"]:
+            # get customer data from Clover
+            customer_data[customers[0]["id"]] = request_clover_customer(
+                customers[0]["id"]
             )
-            #
-            # get address data
-            if customer_data["addresses"] and customer_data["addresses"]["elements"]:
-                try:
-                    # first look for best address
-                    address = next(
-                        a
-                        for a in customer_data["addresses"]["elements"]
-                        if a["address1"]
-                    )
-                except StopIteration:
-                    address = customer_data["addresses"]["elements"][0]
-                self.address_line_1 = address.get("address1")
-                self.address_line_2 = address.get("address2")
-                self.address_city = address["city"]
-                self.address_postal_code = address["zip"]
-            #
-            # get phone numbers
-            if (
-                self.recipient_phone_number is None
-                and customer_data["phoneNumbers"]
-                and customer_data["phoneNumbers"]["elements"]
-            ):
-                try:
-                    # first look for best address
-                    phone_number = next(
-                        a
-                        for a in customer_data["phoneNumbers"]["elements"]
-                        if a["phoneNumber"]
-                    )
-                except StopIteration:
-                    phone_number = customer_data["phoneNumbers"]["elements"][0]
-                self.recipient_phone_number = phone_number["phoneNumber"]
-            # get email address
-            if (
-                customer_data["emailAddresses"]
-                and customer_data["emailAddresses"]["elements"]
-            ):
-                try:
-                    # first look for best address
-                    email = next(
-                        a
-                        for a in customer_data["emailAddresses"]["elements"]
-                        if a["emailAddress"]
-                    )
-                except StopIteration:
-                    email = customer_data["emailAddresses"]["elements"][0]
-                self.recipient_email = email["emailAddress"]
+        record = CloverSource.order_record(order_data, customer_data)
 
-    def load_from_clover(self, order_data, skip_items=False):
         if not self.notes:
-            self.notes = order_data.get("note", self.notes)
-        clover_created_time = order_data.get("createdTime", None)
-        self.created_at = (
-            datetime.datetime.fromtimestamp(clover_created_time / 1000, tz=pytz.UTC)
-            if clover_created_time
-            else datetime.datetime.now()
-        )
-        self.delivery_type = (
-            get_delivery_type_for_clover(order_data) or DeliveryTypes.WHITE_GLOVE
-        )
+            self.notes = record.notes
+        self.created_at = record.created_at
+        self.delivery_type = record.delivery_type or DeliveryTypes.WHITE_GLOVE
         if not skip_items:
             self._load_clover_items(order_data)
-        self._load_clover_customer(order_data)
+        if not customers:
+            return
+        self.recipient_last_name = record.recipient_last_name
+        self.recipient_first_name = record.recipient_first_name
+        if any(getattr(record, name) is not None for name in ADDRESS_FIELDS):
+            for name in ADDRESS_FIELDS:
+                setattr(self, name, getattr(record, name))
+        if self.recipient_phone_number is None:
+            self.recipient_phone_number = record.recipient_phone_number
+        if record.recipient_email is not None:
+            self.recipient_email = record.recipient_email
 
     @classmethod
     def create_from_clover(
@@ -413,43 +507,34 @@ class Delivery(models.Model):
     # Shopify
     #
     def _load_line_items_from_shopify(self, order_data) -> None:
-        # for now, skip sync if we have existing items
-        if self.item_set.count():
-            return
-        # for now, skip if the order data doesn't have items (vs. error)
-        try:
-            items = [o["node"] for o in order_data["lineItems"]["edges"]]
-        except KeyError:
+        # skip if the order data doesn't have items (vs. error)
+        if "lineItems" not in order_data:
             return
-        for item in items:
-            self.item_set.create(item_name=item["name"], quantity=item["quantity"])
+        self.reconcile_items(parse_shopify_line_items(order_data))
+
+    def load_from_shopify(self, order_data) -> None:
+        # the field mapping is the Shopify import adapter's, which builds on
+        # these models and so is imported here
+        from delivery.delivery.importers import ShopifySource
 
-    def load_from_shopify_info(self, info: ShopifyOrderInfo) -> None:
+        record = ShopifySource.order_record(order_data)
+        # online_id aready set
         if not self.recipient_phone_number:
-            self.recipient_phone_number = info.phone
+            self.recipient_phone_number = record.recipient_phone_number
         if not self.recipient_first_name:
-            self.recipient_first_name = info.first_name
+            self.recipient_first_name = record.recipient_first_name
         if not self.recipient_last_name:
-            self.recipient_last_name = info.last_name
+            self.recipient_last_name = record.recipient_last_name
         if not self.created_at:
-            self.created_at = (
-                dateutil.parser.parse(info.created_at)
-                if info.created_at
-                else datetime.datetime.now()
-            )
-        if not hasattr(self, "delivery_shift") and info.shift:
-            self.delivery_shift = info.shift
-
-    def load_from_shopify(self, order_data) -> None:
-        info = parse_shopify_order_info_from_data(order_data)
-        self.load_from_shopify_info(info)
-        # online_id aready set
+            self.created_at = record.created_at
+        if self.delivery_shift_id is None and record.shift_id is not None:
+            self.delivery_shift_id = record.shift_id
 
-        if order_data["note"]:
+        if record.notes:
             if self.notes is None:
-                self.notes = order_data["note"]
-            elif order_data["note"] not in self.notes:
-                self.notes += f"\n\n{order_data['note']}"
+                self.notes = record.notes
+            elif record.notes not in self.notes:
+                self.notes += f"\n\n{record.notes}"
         if order_data["customer"]["lastName"] != self.recipient_last_name:
             notestr = f"Ordered by {order_data['customer']['firstName']} {order_data['customer']['lastName']} ({order_data['customer']['phone'] or 'No Phone Provided'})"
             if self.notes and notestr not in self.notes:
@@ -457,54 +542,81 @@ class Delivery(models.Model):
             elif not self.notes:
                 self.notes = notestr
 
-        shipping_address = order_data["shippingAddress"]
-        if not self.address_line_1:
-            self.address_line_1 = shipping_address["address1"]
-        if not self.address_line_2:
-            self.address_line_2 = shipping_address["address2"]
-        if not self.address_city:
-            self.address_city = shipping_address["city"]
-        if not self.address_postal_code:
-            self.address_postal_code = shipping_address["zip"]
-
-        self.delivery_type = (
-            parse_delivery_type_from_shopify_data(order_data)
-            or DeliveryTypes.WHITE_GLOVE
-        )
+        for name in ADDRESS_FIELDS:
+            if not getattr(self, name):
+                setattr(self, name, getattr(record, name))
+
+        self.delivery_type = record.delivery_type or DeliveryTypes.WHITE_GLOVE
         self._load_line_items_from_shopify(order_data)
+        self._load_shopify_cancellation(order_data)
+
+    def _load_shopify_cancellation(self, order_data) -> None:
+        cancelled_at = parse_shopify_cancelled_at(order_data)
+        if cancelled_at is None or self.cancelled_at is not None:
+            return
+        self.cancelled_at = cancelled_at
+        notestr = "Cancelled in Shopify"
+        self.notes = f"{self.notes}\n\n{notestr}" if self.notes else notestr
 
     #
     # General Sync
     #
-    def sync(self):
+    def fetch_sync_data(self) -> Dict:
         if not self.order_number:
             raise ValueError("Order number required to sync.")
 
         if self.online_id:
-            order_data = get_data_by_id(self.online_id)
+            return get_data_by_id(self.online_id)
+        return request_clover_orders(order_number=self.order_number)
+
+    def apply_sync_data(self, order_data, force: bool = False) -> bool:
+        # returns False without loading anything when the source hasn't
+        # changed since the last sync
+        source_hash = hashlib.sha256(
+            json.dumps(order_data, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        if source_hash == self.source_hash and not force:
+            return False
+        if self.online_id:
             self.load_from_shopify(order_data)
-
+            self.source_modified_at = parse_shopify_updated_at(order_data)
         else:
-            order_data = request_clover_orders(order_number=self.order_number)
             self.load_from_clover(order_data)
+            self.source_modified_at = parse_clover_modified_time(order_data)
+        self.source_hash = source_hash
+        return True
+
+    def sync(self, force: bool = False) -> bool:
+        return self.apply_sync_data(self.fetch_sync_data(), force=force)
 
     #
     # OnFleet
     #
-    def serialize_for_onfleet(self):
-        notes = f"Order Number: {self.order_number}\n"
-        notes += f"{self.get_delivery_type_display()}\n"
-        notes += "Items:"
-        if self.item_set.count() < 1:
-            notes += "\n    No Items Found"
+    def serialize_for_onfleet(
+        self, time_window: Optional[Tuple[float, float]] = None
+    ) -> Dict:
+        # uses prefetched items when called through serialize_many_for_onfleet
+        items = self.item_set.all()
+        lines = [
+            f"Order Number: {self.order_number}",
+            self.get_delivery_type_display(),
+            "Items:",
+        ]
+        if not items:
+            lines.append("    No Items Found")
         else:
-            for item in self.item_set.all():
-                notes += "\n - {item_display}{item_notes}".format(
+            lines.extend(
+                " - {item_display}{item_notes}".format(
                     item_display=item.display,
                     item_notes=" ({})".format(item.note) if item.note else "",
                 )
+                for item in items
+            )
         if self.notes:
-            notes += "\n\n{}".format(self.notes)
+            lines.extend(["", self.notes])
+        complete_after, complete_before = (
+            time_window or self.delivery_shift.onfleet_time_window()
+        )
         return {
             "metadata": [
                 {
@@ -543,27 +655,26 @@ class Delivery(models.Model):
                     "phone": self.recipient_phone_number_formatted,
                 }
             ],
-            "completeAfter": datetime.datetime.combine(
-                min(self.delivery_shift.date, datetime.date.today()),
-                datetime.time(
-                    13 if self.delivery_shift.time == "PM" else 9,
-                    tzinfo=pytz.timezone("America/Los_Angeles"),
-                ),
-            ).timestamp()
-            * 1000,
-            "completeBefore": datetime.datetime.combine(
-                self.delivery_shift.date,
-                datetime.time(
-                    18 if self.delivery_shift.time == "PM" else 12,
-                    tzinfo=pytz.timezone("America/Los_Angeles"),
-                ),
-            ).timestamp()
-            * 1000,
-            "notes": notes,
+            "completeAfter": complete_after,
+            "completeBefore": complete_before,
+            "notes": "\n".join(lines),
             "quantity": 1,
             "serviceTime": 15,
         }
 
+    @classmethod
+    def serialize_many_for_onfleet(cls, queryset: models.QuerySet) -> List[Dict]:
+        time_windows: Dict[int, Tuple[float, float]] = {}
+        tasks = []
+        for delivery in queryset.select_related("delivery_shift").prefetch_related(
+            "item_set"
+        ):
+            shift = delivery.delivery_shift
+            if shift.id not in time_windows:
+                time_windows[shift.id] = shift.onfleet_time_window()
+            tasks.append(delivery.serialize_for_onfleet(time_windows[shift.id]))
+        return tasks
+
     def sync_button(self):
         if not self.id:
             return "[save record first]"
@@ -615,6 +726,20 @@ class Delivery(models.Model):
 
     class Meta:
         verbose_name_plural = "Deliveries"
+        indexes = [
+            # order numbers are matched case-insensitively against Clover ids
+            models.Index(Upper("order_number"), name="delivery_order_number_upper"),
+            models.Index(fields=["online_id"], name="delivery_online_id"),
+            models.Index(
+                fields=[
+                    "delivery_shift",
+                    "recipient_last_name",
+                    "recipient_first_name",
+                ],
+                name="delivery_shift_recipient",
+            ),
+            models.Index(fields=["created_at"], name="delivery_created_at"),
+        ]
 
 
 class Item(models.Model):
@@ -648,3 +773,28 @@ class Item(models.Model):
         if self.quantity != 1:
             ret += " - {}".format(self.quantity)
         return ret
+
+
+class OrderEvent(models.Model):
+    # order changes pushed by the Shopify and Clover webhooks, waiting to sync
+    CLOVER = "clover"
+    SHOPIFY = "shopify"
+
+    source = models.CharField(
+        choices=((CLOVER, "Clover"), (SHOPIFY, "Shopify")),
+        max_length=10,
+    )
+    remote_id = models.CharField(max_length=40)
+    topic = models.CharField(max_length=40)
+    received_at = models.DateTimeField(auto_now=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["processed_at", "received_at"], name="order_event_pending"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_source_display()} {self.remote_id} ({self.topic})"
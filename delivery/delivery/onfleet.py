@@ -0,0 +1,46 @@
+import datetime
+import hashlib
+import hmac
+import re
+from typing import Dict, Optional
+
+from django.conf import settings
+
+from .models import ONFLEET_TIMEZONE
+
+# https://docs.onfleet.com/reference/webhooks#trigger-ids
+TRUCK_BOARD_TRIGGERS = ("taskStarted", "taskCompleted", "taskAssigned")
+
+# the random token onfleet sends to check a new webhook url
+WEBHOOK_CHECK_PATTERN = re.compile(r"[A-Za-z0-9_~-]{1,128}")
+
+
+def task_order_number(task: Dict) -> Optional[str]:
+    return next(
+        (m["value"] for m in task.get("metadata", []) if m["name"] == "order_number"),
+        None,
+    )
+
+
+def truck_board_tasks_params() -> Dict[str, str]:
+    # every task since midnight, in any state, so finished routes stay listed
+    midnight = ONFLEET_TIMEZONE.localize(
+        datetime.datetime.combine(
+            datetime.datetime.now(ONFLEET_TIMEZONE), datetime.time()
+        )
+    )
+    return {"from": str(int(midnight.timestamp() * 1000))}
+
+
+def is_webhook_check(value: str) -> bool:
+    return WEBHOOK_CHECK_PATTERN.fullmatch(value) is not None
+
+
+def verify_webhook(body: bytes, signature_header: str) -> bool:
+    # onfleet signs the body with the hex-encoded webhook secret, HMAC-SHA512
+    if not settings.ONFLEET_WEBHOOK_SECRET:
+        return False
+    digest = hmac.new(
+        bytes.fromhex(settings.ONFLEET_WEBHOOK_SECRET), body, hashlib.sha512
+    ).hexdigest()
+    return hmac.compare_digest(digest, signature_header.lower())
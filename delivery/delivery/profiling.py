@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import statistics
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+PROFILES_CACHE_KEY = "request_profiles"
+# columns of the admin profiling page, besides the request total
+PROFILED_COMPONENTS = ("sql", "template", "clover", "shopify", "onfleet")
+PROFILED_VIEWS_CACHE_KEY = "request_profiles:views"
+
+
+@dataclass
+class Timing:
+    seconds: float = 0.0
+    count: int = 0
+
+
+# what the current request has spent, by component ("sql", "clover", ...);
+# None outside a profiled request, which makes every timer a no-op
+_timings: ContextVar[Optional[Dict[str, Timing]]] = ContextVar("timings", default=None)
+
+
+def record(name: str, seconds: float) -> None:
+    timings = _timings.get()
+    if timings is None:
+        return
+    timing = timings.setdefault(name, Timing())
+    timing.seconds += seconds
+    timing.count += 1
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    if _timings.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def time_query(execute, sql, params, many, context):
+    # a connection.execute_wrappers entry, installed by install_query_timer
+    if _timings.get() is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record("sql", time.perf_counter() - start)
+
+
+def install_query_timer(connection) -> None:
+    # called as each connection opens, so every thread's connection is timed,
+    # including the ones sync_to_async runs queries on for async views
+    if settings.PROFILING_ENABLED and time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        with timed("template"):
+            return self.template.render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    # the Django template backend, with each top-level render timed
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def view_name(request) -> Optional[str]:
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return None
+    return getattr(match.func, "view_class", match.func).__name__
+
+
+def server_timing(timings: Dict[str, Timing]) -> str:
+    return ", ".join(
+        f'{name};dur={timing.seconds * 1000:.1f};desc="{timing.count}x"'
+        for name, timing in timings.items()
+    )
+
+
+def _sample(timings: Dict[str, Timing]) -> Dict[str, float]:
+    sample = {name: timing.seconds for name, timing in timings.items()}
+    sample["queries"] = timings["sql"].count if "sql" in timings else 0
+    return sample
+
+
+def save_sample(view: str, timings: Dict[str, Timing]) -> None:
+    # a rolling window per view; concurrent requests can drop a sample, which
+    # is fine for percentiles
+    key = f"{PROFILES_CACHE_KEY}:{view}"
+    samples = cache.get(key, [])
+    samples.append(_sample(timings))
+    cache.set(key, samples[-settings.PROFILING_SAMPLE_SIZE :], None)
+    views = cache.get(PROFILED_VIEWS_CACHE_KEY, set())
+    if view not in views:
+        cache.set(PROFILED_VIEWS_CACHE_KEY, views | {view}, None)
+
+
+async def asave_sample(view: str, timings: Dict[str, Timing]) -> None:
+    # save_sample for async requests, kept off the event loop
+    key = f"{PROFILES_CACHE_KEY}:{view}"
+    samples = await cache.aget(key, [])
+    samples.append(_sample(timings))
+    await cache.aset(key, samples[-settings.PROFILING_SAMPLE_SIZE :], None)
+    views = await cache.aget(PROFILED_VIEWS_CACHE_KEY, set())
+    if view not in views:
+        await cache.aset(PROFILED_VIEWS_CACHE_KEY, views | {view}, None)
+
+
+def get_samples() -> Dict[str, List[Dict[str, float]]]:
+    views = sorted(cache.get(PROFILED_VIEWS_CACHE_KEY, set()))
+    samples = cache.get_many([f"{PROFILES_CACHE_KEY}:{view}" for view in views])
+    return {view: samples.get(f"{PROFILES_CACHE_KEY}:{view}", []) for view in views}
+
+
+def percentile(values: Sequence[float], percent: int) -> Optional[float]:
+    if len(values) < 2:
+        return values[0] if values else None
+    return statistics.quantiles(values, n=100)[percent - 1]
+
+
+def summarize(samples: Sequence[Dict[str, float]]) -> Dict[str, Dict]:
+    # p50/p95 of the total and each component in milliseconds, and of the
+    # query count
+    summary = {}
+    for name in ("total",) + PROFILED_COMPONENTS:
+        values = [sample.get(name, 0.0) * 1000 for sample in samples]
+        summary[name] = {"p50": percentile(values, 50), "p95": percentile(values, 95)}
+    queries = [sample["queries"] for sample in samples]
+    summary["queries"] = {
+        "p50": percentile(queries, 50),
+        "p95": percentile(queries, 95),
+    }
+    return summary
+
+
+class ProfilingMiddleware:
+    """
+    Times each request and what it spends on SQL, templates and the Clover,
+    Shopify and Onfleet APIs. Reports them in a Server-Timing header and a
+    log line, and keeps samples per view for the admin profiling page. Takes
+    itself out of the middleware chain unless PROFILING_ENABLED is set.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine  # type: ignore[attr-defined]
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timings: Dict[str, Timing] = {}
+        token = _timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        view = self.finish(request, response, timings, start)
+        if view is not None:
+            save_sample(view, timings)
+        return response
+
+    async def __acall__(self, request):
+        timings: Dict[str, Timing] = {}
+        token = _timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _timings.reset(token)
+        view = self.finish(request, response, timings, start)
+        if view is not None:
+            await asave_sample(view, timings)
+        return response
+
+    def finish(self, request, response, timings, start) -> Optional[str]:
+        # adds the header and logs; returns the view to keep a sample for
+        timings["total"] = Timing(time.perf_counter() - start, 1)
+        response["Server-Timing"] = server_timing(timings)
+        view = view_name(request)
+        logger.info(
+            json.dumps(
+                {
+                    "message": "request profile",
+                    "view": view,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "timings": {
+                        name: {"ms": round(t.seconds * 1000, 1), "count": t.count}
+                        for name, t in timings.items()
+                    },
+                }
+            )
+        )
+        return view
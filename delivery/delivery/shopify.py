@@ -1,15 +1,21 @@
+import base64
 import datetime
+import functools
+import hashlib
+import hmac
 import json
 import os
 from dataclasses import dataclass
-from typing import Dict, Mapping, Optional, Sequence
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Set
 
 import dateutil.parser
 import shopify
 from django.conf import settings
+from django.core.cache import cache
 
 from delivery.delivery.constants import DELIVERY_TYPE_COSTS, DeliveryTypes
 
+from . import graphql
 from .models import Shift
 
 
@@ -26,91 +32,82 @@ class ShopifyOrderInfo:
     customer_last_name: str
 
 
-_SHIFT_FOR_ORDERS_QUERY = """
-{{
-  orders(query: "{query}", first: {chunk_size} {cursor}) {{
-    pageInfo {{
-        hasNextPage
-    }}
-    edges {{
-      cursor
-      node {{
-        createdAt
-        name
-        id
-        customAttributes {{
-          key
-          value
-        }}
-        shippingAddress {{
-            firstName
-            lastName
-            address1
-            address2
-            city
-            zip
-            phone
-        }}
-        customer {{
-            firstName
-            lastName
-            phone
-            defaultAddress {{
-                phone
-            }}
-        }}
-      }}
-    }}
-  }}
-}}
-"""
-
-
-_ORDER_INFO_QUERY = """
-{{
-  order(id: "gid://shopify/Order/{oid}") {{
-    createdAt
-    name
-    id
-    customAttributes {{
-        key
-        value
-    }}
-    lineItems (first: 10){{
-        edges {{
-            node {{
-                name
-                quantity
-
-            }}
-        }}
-    }}
-    totalShippingPriceSet {{
-        shopMoney {{
-            amount
-        }}
-    }}
-    note
-    shippingAddress {{
-        firstName
-        lastName
-        address1
-        address2
-        city
-        zip
-        phone
-    }}
-    customer {{
-        firstName
-        lastName
-        phone
-        defaultAddress {{
-            phone
-        }}
-    }}
-  }}
-}}
-"""
+_ADDRESS_FIELDS = (
+    "firstName",
+    "lastName",
+    "address1",
+    "address2",
+    "city",
+    "zip",
+    "phone",
+)
+_CUSTOMER_FIELDS = ("firstName", "lastName", "phone", {"defaultAddress": ("phone",)})
+
+# only what parse_order_info_from_data and _is_delivery_order read
+_ORDER_SUMMARY_FIELDS = (
+    "createdAt",
+    "name",
+    "id",
+    {
+        "customAttributes": ("key", "value"),
+        "shippingAddress": ("firstName", "lastName", "phone"),
+        "customer": _CUSTOMER_FIELDS,
+    },
+)
+
+_LINE_ITEMS_PAGE_SIZE = 50
+_LINE_ITEMS_FIELDS = graphql.connection(("name", "quantity", "currentQuantity"))
+
+_ORDER_INFO_FIELDS = (
+    "createdAt",
+    "updatedAt",
+    "cancelledAt",
+    "name",
+    "id",
+    "note",
+    {
+        "customAttributes": ("key", "value"),
+        f"lineItems(first: {_LINE_ITEMS_PAGE_SIZE})": _LINE_ITEMS_FIELDS,
+        "totalShippingPriceSet": ({"shopMoney": ("amount",)},),
+        "shippingAddress": _ADDRESS_FIELDS,
+        "customer": _CUSTOMER_FIELDS,
+    },
+)
+
+
+def _compile_search_query(name: str, node_fields: graphql.Fields) -> graphql.Query:
+    return graphql.compile_query(
+        name,
+        {"query": "String!", "first": "Int!", "after": "String"},
+        (
+            {
+                "orders(query: $query, first: $first, after: $after)": (
+                    graphql.connection(node_fields)
+                )
+            },
+        ),
+    )
+
+
+def _compile_nodes_query(name: str, order_fields: graphql.Fields) -> graphql.Query:
+    return graphql.compile_query(
+        name,
+        {"ids": "[ID!]!"},
+        ({"nodes(ids: $ids)": ({"... on Order": order_fields},)},),
+    )
+
+
+ORDER_SEARCH_QUERY = _compile_search_query("OrderSearch", _ORDER_SUMMARY_FIELDS)
+ORDER_SEARCH_PAGE_SIZE = 100
+_ORDER_ID_SEARCH_QUERY = _compile_search_query("OrderIdSearch", ("id",))
+_ORDER_INFO_QUERY = _compile_nodes_query("OrderInfo", _ORDER_INFO_FIELDS)
+_ORDER_UPDATED_AT_QUERY = _compile_nodes_query("OrderUpdatedAt", ("updatedAt",))
+
+# keep each batch well under Shopify's per-query cost limit
+_ORDER_INFO_BATCH_SIZE = 20
+_ORDER_UPDATED_AT_BATCH_SIZE = 100
+# entries are checked against the order's updatedAt before use
+_ORDER_INFO_CACHE_TIMEOUT = 60 * 60 * 24
 
 
 _TIME_TO_SHIFT_MAP = {
@@ -122,30 +119,25 @@ _TIME_TO_SHIFT_MAP = {
 CACHE_INFO_BY_NAME: Dict[str, ShopifyOrderInfo] = {}
 
 
-def _get_orders_for_query(query: str, chunk_size: int = 100) -> Sequence[Dict]:
-    orders = []
+def shopify_session() -> shopify.Session:
+    return shopify.Session(
+        settings.SHOPIFY_APP_URL,
+        settings.SHOPIFY_API_VERSION,
+        settings.SHOPIFY_APP_SECRET,
+    )
+
+
+def _get_orders_for_query(
+    search: str,
+    query: graphql.Query = ORDER_SEARCH_QUERY,
+    chunk_size: int = ORDER_SEARCH_PAGE_SIZE,
+) -> Sequence[Dict]:
     with shopify.Session.temp(
         settings.SHOPIFY_APP_URL,
         settings.SHOPIFY_API_VERSION,
         settings.SHOPIFY_APP_SECRET,
     ):
-        cursor = None
-        while True:
-            response = json.loads(
-                shopify.GraphQL().execute(
-                    _SHIFT_FOR_ORDERS_QUERY.format(
-                        query=query,
-                        chunk_size=chunk_size,
-                        cursor=f', after: "{cursor}"' if cursor else "",
-                    )
-                )
-            )
-            data = response["data"]
-            orders.extend([n["node"] for n in data["orders"]["edges"]])
-            if not data["orders"]["pageInfo"]["hasNextPage"]:
-                break
-            cursor = data["orders"]["edges"][-1]["cursor"]
-    return orders
+        return list(graphql.paginate(query, "orders", query=search, first=chunk_size))
 
 
 def _parse_shopify_delivery_time(order) -> Optional[Shift]:
@@ -182,7 +174,17 @@ def _parse_phone_number(order) -> str:
 
 
 def _format_order_name_query(order_names: Sequence[str]) -> str:
-    return " OR ".join([f"name:{n}" for n in order_names])
+    # quoted, so a name can't add its own search terms
+    return " OR ".join([f"name:{json.dumps(n)}" for n in order_names])
+
+
+def _format_search_query(*filters: str, include_cancelled: bool = False) -> str:
+    # let Shopify drop cancelled orders instead of paging them over to skip;
+    # delivery orders are only marked by a custom attribute, which the search
+    # syntax can't filter on, so that check stays client-side
+    if not include_cancelled:
+        filters += ("-status:cancelled",)
+    return " AND ".join(f"({f})" if " OR " in f else f for f in filters)
 
 
 def _is_delivery_order(order_data) -> bool:
@@ -218,6 +220,20 @@ def parse_order_info_from_data(order_data: Dict) -> ShopifyOrderInfo:
     )
 
 
+def parse_line_items(order_data: Dict) -> List[Dict]:
+    try:
+        items = [o["node"] for o in order_data["lineItems"]["edges"]]
+    except KeyError:
+        return []
+    # currentQuantity drops refunded and removed units
+    parsed = []
+    for item in items:
+        quantity = item.get("currentQuantity", item["quantity"])
+        if quantity > 0:
+            parsed.append({"item_name": item["name"], "quantity": quantity})
+    return parsed
+
+
 def parse_delivery_type_from_data(order_data: Dict) -> Optional[DeliveryTypes]:
     shipping_cost = order_data["totalShippingPriceSet"]["shopMoney"]["amount"]
     try:
@@ -233,15 +249,30 @@ def parse_delivery_type_from_data(order_data: Dict) -> Optional[DeliveryTypes]:
 def get_data_from_shopify_by_name(
     order_names: Sequence[str], delivery_only: bool = False
 ) -> Mapping[str, Optional[ShopifyOrderInfo]]:
-    unknown = [o for o in order_names if o not in CACHE_INFO_BY_NAME]
+    unknown = uncached_names(order_names)
     if unknown:
-        orders = _get_orders_for_query(_format_order_name_query(unknown))
-        for o in orders:
-            if delivery_only and not _is_delivery_order(o):
-                continue
-            info = parse_order_info_from_data(o)
-            CACHE_INFO_BY_NAME[info.name] = info
+        cache_order_info(
+            _get_orders_for_query(name_search(unknown)), delivery_only=delivery_only
+        )
+    return cached_order_info(order_names)
+
+
+def uncached_names(order_names: Sequence[str]) -> List[str]:
+    return [o for o in order_names if o not in CACHE_INFO_BY_NAME]
 
+
+def name_search(order_names: Sequence[str]) -> str:
+    return _format_search_query(_format_order_name_query(order_names))
+
+
+def cache_order_info(orders: Sequence[Dict], delivery_only: bool = False) -> None:
+    for info in parse_orders(orders, delivery_only=delivery_only):
+        CACHE_INFO_BY_NAME[info.name] = info
+
+
+def cached_order_info(
+    order_names: Sequence[str],
+) -> Mapping[str, Optional[ShopifyOrderInfo]]:
     return {o: CACHE_INFO_BY_NAME.get(o, None) for o in order_names}
 
 
@@ -250,31 +281,174 @@ def get_data_by_time_range(
     end_date: Optional[datetime.date] = None,
     delivery_only: bool = False,
 ) -> Sequence[ShopifyOrderInfo]:
+    return parse_orders(
+        _get_orders_for_query(time_range_search(start_date, end_date)),
+        delivery_only=delivery_only,
+    )
+
 
+def time_range_search(
+    start_date: datetime.date, end_date: Optional[datetime.date] = None
+) -> str:
     start_time = datetime.datetime.combine(start_date, datetime.datetime.min.time())
     date_filter = f"created_at:>{start_time.isoformat()}"
     if end_date:
         end_time = datetime.datetime.combine(end_date, datetime.datetime.max.time())
         date_filter += f" AND created_at:<{end_time.isoformat()}"
-    orders = []
-    for o in _get_orders_for_query(date_filter):
-        if delivery_only and not _is_delivery_order(o):
-            continue
-        orders.append(parse_order_info_from_data(o))
-    return orders
+    return _format_search_query(date_filter)
+
+
+def parse_orders(
+    orders: Sequence[Dict], delivery_only: bool = False
+) -> List[ShopifyOrderInfo]:
+    # looks up each order's shift, so call from sync code
+    return [
+        parse_order_info_from_data(o)
+        for o in orders
+        if not delivery_only or _is_delivery_order(o)
+    ]
+
+
+def get_ids_updated_since(since: datetime.datetime) -> Set[str]:
+    # cancelled orders included, so their cancellation syncs
+    orders = _get_orders_for_query(
+        _format_search_query(
+            f"updated_at:>={since.isoformat()}", include_cancelled=True
+        ),
+        _ORDER_ID_SEARCH_QUERY,
+    )
+    return {os.path.basename(o["id"]) for o in orders}
 
 
-def get_data_by_id(online_id: str) -> Dict:
+def parse_updated_at(order_data: Dict) -> Optional[datetime.datetime]:
+    if not order_data.get("updatedAt"):
+        return None
+    return dateutil.parser.parse(order_data["updatedAt"])
+
+
+def parse_cancelled_at(order_data: Dict) -> Optional[datetime.datetime]:
+    if not order_data.get("cancelledAt"):
+        return None
+    return dateutil.parser.parse(order_data["cancelledAt"])
+
+
+def verify_webhook(body: bytes, hmac_header: str) -> bool:
+    if not settings.SHOPIFY_WEBHOOK_SECRET:
+        return False
+    digest = hmac.new(
+        settings.SHOPIFY_WEBHOOK_SECRET.encode(), body, hashlib.sha256
+    ).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode(), hmac_header)
+
+
+def forget_order_info(name: str) -> None:
+    CACHE_INFO_BY_NAME.pop(name.lstrip("#"), None)
+
+
+def _order_gid(online_id: str) -> str:
+    return f"gid://shopify/Order/{online_id}"
+
+
+def _get_nodes(query: graphql.Query, online_ids: Sequence[str]) -> Dict[str, Dict]:
+    nodes = query.execute(ids=[_order_gid(oid) for oid in online_ids])["nodes"]
+    return dict(zip(online_ids, nodes))
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_line_items_query(num_orders: int) -> graphql.Query:
+    # one aliased page per order, so follow-up pages are batched across orders
+    variables = {}
+    fields = {}
+    for n in range(num_orders):
+        variables.update({f"id{n}": "ID!", f"after{n}": "String"})
+        fields[f"o{n}: order(id: $id{n})"] = (
+            {
+                f"lineItems(first: {_LINE_ITEMS_PAGE_SIZE}, after: $after{n})": (
+                    _LINE_ITEMS_FIELDS
+                )
+            },
+        )
+    return graphql.compile_query("OrderLineItems", variables, (fields,))
+
+
+def _chunks(values: Sequence, size: int) -> Iterator[Sequence]:
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def _order_info_cache_key(online_id: str) -> str:
+    return f"shopify_order_{online_id}"
+
+
+def _get_updated_at(online_ids: Sequence[str]) -> Dict[str, Optional[str]]:
+    updated_at = {}
+    for chunk in _chunks(online_ids, _ORDER_UPDATED_AT_BATCH_SIZE):
+        data = _get_nodes(_ORDER_UPDATED_AT_QUERY, chunk)
+        updated_at.update(
+            {oid: order["updatedAt"] if order else None for oid, order in data.items()}
+        )
+    return updated_at
+
+
+def _fetch_remaining_line_items(data_by_id: Dict[str, Dict]) -> None:
+    # orders with more line items than fit on the first page get follow-up
+    # pages, still batched across orders
+    pending = {
+        oid: order["lineItems"]["pageInfo"]["endCursor"]
+        for oid, order in data_by_id.items()
+        if order and order["lineItems"]["pageInfo"]["hasNextPage"]
+    }
+    while pending:
+        next_pending = {}
+        for chunk in _chunks(list(pending.items()), _ORDER_INFO_BATCH_SIZE):
+            variables = {}
+            for n, (oid, cursor) in enumerate(chunk):
+                variables.update({f"id{n}": _order_gid(oid), f"after{n}": cursor})
+            pages = _compile_line_items_query(len(chunk)).execute(**variables)
+            for n, (oid, _) in enumerate(chunk):
+                page = pages[f"o{n}"]["lineItems"]
+                line_items = data_by_id[oid]["lineItems"]
+                line_items["edges"].extend(page["edges"])
+                line_items["pageInfo"] = page["pageInfo"]
+                if line_items["pageInfo"]["hasNextPage"]:
+                    next_pending[oid] = line_items["pageInfo"]["endCursor"]
+        pending = next_pending
+
+
+def get_data_by_ids(online_ids: Sequence[str]) -> Dict[str, Dict]:
+    online_ids = list(dict.fromkeys(online_ids))
+    data_by_id: Dict[str, Dict] = {}
+    if not online_ids:
+        return data_by_id
+    cached = cache.get_many([_order_info_cache_key(oid) for oid in online_ids])
     with shopify.Session.temp(
         settings.SHOPIFY_APP_URL,
         settings.SHOPIFY_API_VERSION,
         settings.SHOPIFY_APP_SECRET,
     ):
-        response = json.loads(
-            shopify.GraphQL().execute(
-                _ORDER_INFO_QUERY.format(
-                    oid=online_id,
-                )
-            )
-        )
-    return response["data"]["order"]
+        # unchanged orders cost one cheap updatedAt lookup instead of a refetch
+        cached_ids = [oid for oid in online_ids if _order_info_cache_key(oid) in cached]
+        for oid, updated_at in _get_updated_at(cached_ids).items():
+            order = cached[_order_info_cache_key(oid)]
+            if updated_at is not None and order["updatedAt"] == updated_at:
+                data_by_id[oid] = order
+
+        fetched: Dict[str, Dict] = {}
+        stale_ids = [oid for oid in online_ids if oid not in data_by_id]
+        for chunk in _chunks(stale_ids, _ORDER_INFO_BATCH_SIZE):
+            fetched.update(_get_nodes(_ORDER_INFO_QUERY, chunk))
+        _fetch_remaining_line_items(fetched)
+    cache.set_many(
+        {
+            _order_info_cache_key(oid): order
+            for oid, order in fetched.items()
+            if order is not None
+        },
+        _ORDER_INFO_CACHE_TIMEOUT,
+    )
+    data_by_id.update(fetched)
+    return {oid: data_by_id[oid] for oid in online_ids}
+
+
+def get_data_by_id(online_id: str) -> Dict:
+    return get_data_by_ids([online_id])[online_id]
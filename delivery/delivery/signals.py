@@ -1,14 +1,84 @@
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Mapping, Optional
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 from .models import Delivery, Shift
+from .profiling import install_query_timer
+
+_deferred = threading.local()
+
+
+@contextmanager
+def defer_shift_count_updates():
+    """
+    Collects the shift fill count changes from delivery saves and deletes in
+    the block and applies them once on exit, in the same transaction. Works as
+    a decorator too; nested blocks fold into the outermost one.
+    """
+    if getattr(_deferred, "deltas", None) is not None:
+        yield
+        return
+    _deferred.deltas = Counter()
+    _deferred.needs_recount = False
+    try:
+        with transaction.atomic():
+            yield
+            deltas, needs_recount = _deferred.deltas, _deferred.needs_recount
+            _deferred.deltas = None
+            if needs_recount:
+                Shift.objects.recount()
+            else:
+                Shift.objects.adjust_filled_counts(deltas)
+    finally:
+        _deferred.deltas = None
+
+
+def _adjust_filled_counts(deltas: Mapping[Optional[int], int]) -> None:
+    if getattr(_deferred, "deltas", None) is None:
+        Shift.objects.adjust_filled_counts(deltas)
+        return
+    _deferred.deltas.update(deltas)
+
+
+def _recount() -> None:
+    if getattr(_deferred, "deltas", None) is None:
+        Shift.objects.recount()
+        return
+    _deferred.needs_recount = True
 
 
 @receiver(post_save, sender=Delivery)
-def handle_delivery_save(*args, **kwargs):
-    Shift.bust_available_shift_cache()
+def handle_delivery_save(sender, instance, created, *args, **kwargs):
+    if created:
+        _adjust_filled_counts({instance.counted_shift_id: 1})
+    elif not hasattr(instance, "_loaded_counted_shift_id"):
+        # not loaded from the database, so we don't know the previous shift
+        _recount()
+    elif instance._loaded_counted_shift_id != instance.counted_shift_id:
+        _adjust_filled_counts(
+            {instance._loaded_counted_shift_id: -1, instance.counted_shift_id: 1}
+        )
+    instance._loaded_counted_shift_id = instance.counted_shift_id
 
 
 @receiver(post_delete, sender=Delivery)
-def handle_delivery_delete(*args, **kwargs):
-    Shift.bust_available_shift_cache()
+def handle_delivery_delete(sender, instance, *args, **kwargs):
+    shift_id = getattr(instance, "_loaded_counted_shift_id", instance.counted_shift_id)
+    _adjust_filled_counts({shift_id: -1})
+
+
+@receiver(post_save, sender=Shift)
+@receiver(post_delete, sender=Shift)
+def handle_shift_change(sender, instance, *args, **kwargs):
+    transaction.on_commit(Shift.bust_available_shifts_cache)
+
+
+@receiver(connection_created)
+def handle_connection_created(sender, connection, **kwargs):
+    install_query_timer(connection)
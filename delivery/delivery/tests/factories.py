@@ -0,0 +1,42 @@
+import datetime
+
+from factory import Faker, Sequence, SubFactory
+from factory.django import DjangoModelFactory
+
+from delivery.delivery.models import Delivery, Item, Shift
+
+
+class ShiftFactory(DjangoModelFactory):
+
+    date = Sequence(lambda n: datetime.date.today() + datetime.timedelta(days=n))
+    time = "AM"
+    slots_available = 20
+
+    class Meta:
+        model = Shift
+        django_get_or_create = ["date", "time"]
+
+
+class DeliveryFactory(DjangoModelFactory):
+
+    order_number = Sequence(lambda n: f"ORDER{n:06d}")
+    delivery_shift = SubFactory(ShiftFactory)
+    recipient_first_name = Faker("first_name")
+    recipient_last_name = Faker("last_name")
+    recipient_phone_number = Sequence(lambda n: f"+1415{n:07d}")
+    address_line_1 = Faker("street_address")
+    address_city = "San Francisco"
+    address_postal_code = "94123"
+
+    class Meta:
+        model = Delivery
+
+
+class ItemFactory(DjangoModelFactory):
+
+    delivery = SubFactory(DeliveryFactory)
+    item_name = Faker("word")
+    quantity = 1
+
+    class Meta:
+        model = Item
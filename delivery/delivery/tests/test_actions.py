@@ -0,0 +1,130 @@
+import datetime
+
+import pytest
+
+from delivery.delivery import actions, clover
+from delivery.delivery.constants import DeliveryTypes
+from delivery.delivery.models import Delivery
+from delivery.delivery.tests.factories import DeliveryFactory, ShiftFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def _clover_order(order_number: str):
+    return {
+        "id": order_number,
+        "note": f"note for {order_number}",
+        "createdTime": 1669000000000,
+        "lineItems": {
+            "elements": [
+                {
+                    "id": "LI1",
+                    "name": "Noble Fir 6ft",
+                    "price": 9000,
+                    "refunded": False,
+                },
+                {"id": "LI2", "name": "Delivery", "price": 7500, "refunded": False},
+            ]
+        },
+        "customers": {
+            "elements": [
+                {
+                    "id": "C1",
+                    "href": None,
+                    "firstName": "Ann",
+                    "lastName": "Lee",
+                    "addresses": {},
+                }
+            ]
+        },
+    }
+
+
+class TestCreateAndSyncDeliveries:
+    def test_creates_and_syncs_new_orders(self, monkeypatch):
+        fetched = []
+
+        def fake_request_clover_orders(order_number=None, **__):
+            fetched.append(order_number)
+            return _clover_order(order_number)
+
+        monkeypatch.setattr(
+            actions, "request_clover_orders", fake_request_clover_orders
+        )
+        shift = ShiftFactory()
+        existing = DeliveryFactory(delivery_shift=shift)
+
+        created = actions.create_and_sync_deliveries(
+            [
+                Delivery(order_number="NEW1", delivery_shift=shift),
+                Delivery(order_number="NEW2", delivery_shift=shift),
+                Delivery(order_number="NEW2", delivery_shift=shift),
+                Delivery(order_number=existing.order_number, delivery_shift=shift),
+            ]
+        )
+
+        assert sorted(d.order_number for d in created) == ["NEW1", "NEW2"]
+        assert sorted(fetched) == ["NEW1", "NEW2"]
+        saved = Delivery.objects.get(order_number="NEW1")
+        assert saved.recipient_last_name == "Lee"
+        assert saved.notes == "note for NEW1"
+        assert [i.item_name for i in saved.item_set.all()] == ["Noble Fir 6ft"]
+        shift.refresh_from_db()
+        assert shift.filled_count == 3
+
+    def test_skips_when_nothing_new(self, monkeypatch):
+        monkeypatch.setattr(actions, "request_clover_orders", None)
+        existing = DeliveryFactory()
+
+        assert (
+            actions.create_and_sync_deliveries(
+                [
+                    Delivery(
+                        order_number=existing.order_number,
+                        delivery_shift=existing.delivery_shift,
+                    )
+                ]
+            )
+            == []
+        )
+
+
+class TestSearchCloverOrders:
+    def test_candidates_use_batched_customer_prefetch(self, monkeypatch):
+        orders = []
+        for n in range(3):
+            order = _clover_order(f"NEW{n}")
+            order["customers"]["elements"] = [{"id": f"C{n}", "href": "x"}]
+            orders.append(order)
+        customer_lists = []
+
+        def fake_customer_list(ids):
+            customer_lists.append(sorted(ids))
+            return {
+                i: {
+                    "id": i,
+                    "firstName": "Ann",
+                    "lastName": f"Lee{i}",
+                    "phoneNumbers": {"elements": [{"phoneNumber": "4155550100"}]},
+                }
+                for i in ids
+            }
+
+        monkeypatch.setattr(actions, "search_clover_by_dates", lambda *_: orders)
+        monkeypatch.setattr(
+            actions, "get_shopify_data_by_time_range", lambda *_, **__: []
+        )
+        monkeypatch.setattr(clover, "request_clover_customer_list", fake_customer_list)
+        monkeypatch.setattr(clover, "request_clover_customer", None)
+        DeliveryFactory(order_number="NEW1")
+
+        candidates = actions.search_clover_orders(datetime.date(2022, 11, 21))
+
+        assert customer_lists == [["C0", "C2"]]
+        assert sorted(c.order_number for c in candidates) == ["NEW0", "NEW2"]
+        assert all(isinstance(c, actions.CandidateOrder) for c in candidates)
+        assert not any(hasattr(c, "__dict__") for c in candidates)
+        candidate = next(c for c in candidates if c.order_number == "NEW2")
+        assert candidate.recipient_last_name == "LeeC2"
+        assert candidate.recipient_phone_number == "4155550100"
+        assert candidate.delivery_type == DeliveryTypes.CURBSIDE
@@ -0,0 +1,72 @@
+import pytest
+from django.urls import reverse
+
+from delivery.delivery.models import Shift
+from delivery.delivery.tests.factories import DeliveryFactory, ShiftFactory
+
+pytestmark = pytest.mark.django_db
+
+
+class TestDeliveryAdmin:
+    @pytest.mark.parametrize("num_deliveries", [10, 100])
+    def test_changelist_query_count(
+        self, admin_client, django_assert_num_queries, num_deliveries
+    ):
+        shifts = ShiftFactory.create_batch(20)
+        for n in range(num_deliveries):
+            DeliveryFactory(delivery_shift=shifts[n % 20])
+
+        url = reverse("admin:delivery_delivery_changelist")
+        # warm per-process caches (admin theme) so only the page is measured
+        admin_client.get(url)
+
+        with django_assert_num_queries(12):
+            response = admin_client.get(url)
+
+        assert response.status_code == 200
+        assert "remaining" in response.content.decode()
+
+    def test_add_rejects_full_shift(self, admin_client):
+        shift = ShiftFactory(slots_available=1)
+        DeliveryFactory(delivery_shift=shift)
+
+        response = admin_client.post(
+            reverse("admin:delivery_delivery_add"),
+            {
+                "delivery_shift": shift.id,
+                "order_number": "FULL1",
+                "delivery_type": 1,
+                "item_set-TOTAL_FORMS": 0,
+                "item_set-INITIAL_FORMS": 0,
+            },
+        )
+
+        assert response.status_code == 200
+        assert "0 of 1 slots remaining" in response.content.decode()
+        assert shift.delivery_set.count() == 1
+
+    def test_changelist_rejects_overbooking(self, admin_client):
+        shift = ShiftFactory(slots_available=2)
+        DeliveryFactory(delivery_shift=shift)
+        other = ShiftFactory()
+        moved = DeliveryFactory.create_batch(2, delivery_shift=other)
+        data = {
+            "form-TOTAL_FORMS": 2,
+            "form-INITIAL_FORMS": 2,
+            "_save": "Save",
+        }
+        for n, delivery in enumerate(moved):
+            data[f"form-{n}-id"] = delivery.id
+            data[f"form-{n}-delivery_shift"] = shift.id
+
+        response = admin_client.post(
+            reverse("admin:delivery_delivery_changelist"), data
+        )
+
+        assert response.status_code == 200
+        assert "1 of 2 slots remaining" in response.content.decode()
+        assert shift.delivery_set.count() == 1
+        assert dict(Shift.objects.values_list("pk", "filled_count")) == {
+            shift.pk: 1,
+            other.pk: 2,
+        }
@@ -0,0 +1,199 @@
+import asyncio
+import datetime
+import json
+
+import httpx
+import pytest
+from asgiref.sync import async_to_sync
+from django.urls import reverse
+
+from delivery.delivery import actions, clients, views
+from delivery.delivery.tests.factories import DeliveryFactory
+from delivery.delivery.tests.test_actions import _clover_order
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def integration_settings(settings):
+    settings.CLOVER_API_KEY = "clover-key"
+    settings.CLOVER_MERCHANT_ID = "MID"
+    settings.CLOVER_INTEGRATION_API = "https://clover.test/v3"
+    settings.ONFLEET_API_KEY = "onfleet-key"
+    settings.ONFLEET_INTEGRATION_API = "https://onfleet.test/v2"
+    settings.SHOPIFY_APP_URL = "shop.myshopify.com"
+    settings.SHOPIFY_API_VERSION = "2022-10"
+    settings.SHOPIFY_APP_SECRET = "shopify-token"
+
+
+def mock_http(monkeypatch, handler):
+    # every client built while the patch is active talks to the handler
+    monkeypatch.setattr(
+        clients,
+        "get_http_client",
+        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+
+def onfleet_handler(order_number, barrier=None):
+    async def handler(request):
+        if barrier is not None:
+            # only completes if all three requests are in flight at once
+            barrier.append(request.url.path)
+            while len(barrier) < 3:
+                await asyncio.sleep(0)
+        resource = request.url.path.rpartition("/")[2]
+        data = {
+            "workers": [{"id": "W1", "name": "Truck 1", "tasks": ["T1"]}],
+            "teams": [{"id": "TM1", "name": "Team", "workers": ["W1"]}],
+            "tasks": [
+                {
+                    "id": "T1",
+                    "metadata": [{"name": "order_number", "value": order_number}],
+                }
+            ],
+        }[resource]
+        return httpx.Response(200, json=data)
+
+    return handler
+
+
+class TestOnfleetClient:
+    def test_requests_run_concurrently(self, monkeypatch):
+        delivery = DeliveryFactory()
+        barrier = []
+        mock_http(monkeypatch, onfleet_handler(delivery.order_number, barrier))
+
+        async def run():
+            return await asyncio.wait_for(actions.get_onfleet_trucks_async(), 5)
+
+        teams, workers, tasks = async_to_sync(run)()
+
+        assert sorted(barrier) == ["/v2/tasks", "/v2/teams", "/v2/workers"]
+        assert list(teams) == ["TM1"]
+        assert list(workers) == ["W1"]
+        assert tasks["T1"]["order"] == delivery
+
+
+class TestShopifyClient:
+    def test_search_pages_with_variables(self, monkeypatch):
+        requests = []
+
+        def handler(request):
+            body = json.loads(request.content)
+            requests.append((request, body))
+            after = body["variables"]["after"]
+            return httpx.Response(
+                200,
+                json={
+                    "data": {
+                        "orders": {
+                            "pageInfo": {
+                                "hasNextPage": after is None,
+                                "endCursor": "c1",
+                            },
+                            "edges": [{"node": {"id": "1" if after else "0"}}],
+                        }
+                    }
+                },
+            )
+
+        mock_http(monkeypatch, handler)
+
+        async def run():
+            return await clients.ShopifyClient().search_orders("name:1001")
+
+        assert async_to_sync(run)() == [{"id": "0"}, {"id": "1"}]
+        request, body = requests[0]
+        assert str(request.url) == (
+            "https://shop.myshopify.com/admin/api/2022-10/graphql.json"
+        )
+        assert request.headers["X-Shopify-Access-Token"] == "shopify-token"
+        assert body["operationName"] == "OrderSearch"
+        assert [b["variables"]["after"] for _, b in requests] == [None, "c1"]
+
+
+class TestSearchCloverOrdersAsync:
+    def test_matches_sync_search(self, monkeypatch):
+        order = {
+            **_clover_order("NEW1"),
+            "customers": {"elements": [{"id": "C1", "href": "x"}]},
+        }
+        scheduled = DeliveryFactory(online_id=None)
+
+        def handler(request):
+            if request.url.host == "clover.test":
+                if request.url.path.endswith("/customers"):
+                    return httpx.Response(
+                        200,
+                        json={
+                            "elements": [
+                                {"id": "C1", "firstName": "Ann", "lastName": "Lee"}
+                            ]
+                        },
+                    )
+                elements = [order, _clover_order(scheduled.order_number)]
+                return httpx.Response(200, json={"elements": elements})
+            return httpx.Response(
+                200,
+                json={
+                    "data": {
+                        "orders": {
+                            "pageInfo": {"hasNextPage": False, "endCursor": None},
+                            "edges": [],
+                        }
+                    }
+                },
+            )
+
+        mock_http(monkeypatch, handler)
+
+        rows = async_to_sync(actions.search_clover_orders_async)(
+            datetime.date(2030, 12, 1), include_processed=True
+        )
+
+        by_number = {r.order_number: r for r in rows}
+        assert by_number.keys() == {"NEW1", scheduled.order_number}
+        assert by_number["NEW1"].recipient_last_name == "Lee"
+        assert by_number[scheduled.order_number].delivery == scheduled
+
+
+class TestAsyncViews:
+    def test_trucks(self, admin_client, monkeypatch):
+        delivery = DeliveryFactory()
+        mock_http(monkeypatch, onfleet_handler(delivery.order_number))
+
+        response = admin_client.get(reverse("truck_view_async"))
+
+        assert response.status_code == 200
+        assert delivery.order_number in response.content.decode()
+
+    def test_requires_login(self, client):
+        response = client.get(reverse("truck_view_async"))
+        assert response.status_code == 302
+
+    def test_new_orders_require_staff(self, client, django_user_model):
+        user = django_user_model.objects.create_user("driver", password="x")
+        client.force_login(user)
+        response = client.get(reverse("new_orders_async"))
+        assert response.status_code == 302
+        assert response["Location"].startswith(reverse("admin:login"))
+
+    def test_new_orders(self, admin_client, monkeypatch):
+        searched = []
+
+        async def fake_search(start_date, include_processed=False):
+            searched.append((start_date, include_processed))
+            return [
+                actions.CandidateOrder(
+                    "O1", datetime.datetime(2030, 12, 1, tzinfo=datetime.timezone.utc)
+                )
+            ]
+
+        monkeypatch.setattr(views, "search_clover_orders_async", fake_search)
+
+        response = admin_client.get(reverse("new_orders_async"), {"date": "2030-12-01"})
+
+        assert response.status_code == 200
+        assert searched == [(datetime.date(2030, 12, 1), False)]
+        assert response.context["cl"].result_count == 1
@@ -0,0 +1,307 @@
+import datetime
+import json
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.urls import reverse
+
+from delivery.delivery import actions
+from delivery.delivery.management.commands import create_shifts as create_shifts_command
+from delivery.delivery.management.commands import update_deliveries
+from delivery.delivery.models import Delivery, Item, Shift
+from delivery.delivery.tests.factories import DeliveryFactory, ShiftFactory
+from delivery.delivery.tests.test_actions import _clover_order
+
+pytestmark = pytest.mark.django_db
+
+# a Monday
+START = datetime.date(2030, 1, 7)
+
+
+def create_shifts(*args):
+    out = StringIO()
+    call_command("create_shifts", *args, stdout=out)
+    return out.getvalue()
+
+
+@pytest.fixture
+def spec_path(tmp_path):
+    path = tmp_path / "shifts.json"
+    path.write_text(
+        json.dumps(
+            {
+                "default": {"AM": 20, "PM": 20},
+                "saturday": {"AM": 30, "PM": 30, "SP": 5},
+                "sunday": {},
+            }
+        )
+    )
+    return str(path)
+
+
+class TestCreateShifts:
+    def test_defaults(self):
+        out = create_shifts("2030-01-07", "2030-01-09")
+        assert "Created 4, updated 0, unchanged 0" in out
+        assert set(Shift.objects.values_list("time", "slots_available")) == {
+            ("AM", 20),
+            ("PM", 20),
+        }
+
+    def test_spec_by_weekday(self, spec_path):
+        create_shifts("2030-01-07", "2030-01-14", "--spec", spec_path)
+        saturday = Shift.objects.filter(date=START + datetime.timedelta(days=5))
+        assert dict(saturday.values_list("time", "slots_available")) == {
+            "AM": 30,
+            "PM": 30,
+            "SP": 5,
+        }
+        assert not Shift.objects.filter(date=START + datetime.timedelta(days=6))
+        assert Shift.objects.count() == 5 * 2 + 3
+
+    def test_rerun_over_overlapping_range(self, spec_path):
+        create_shifts("2030-01-07", "2030-01-10")
+        shift = Shift.objects.get(date=START, time="AM")
+        DeliveryFactory(delivery_shift=shift)
+        Shift.objects.filter(pk=shift.pk).update(slots_available=10)
+
+        out = create_shifts("2030-01-07", "2030-01-14", "--spec", spec_path)
+        assert "Created 7, updated 1, unchanged 5" in out
+        shift.refresh_from_db()
+        assert (shift.slots_available, shift.filled_count) == (20, 1)
+
+        out = create_shifts("2030-01-07", "2030-01-14", "--spec", spec_path)
+        assert "Created 0, updated 0, unchanged 13" in out
+
+    def test_insert_counts_only_new_shifts(self):
+        ShiftFactory(date=START, time="AM")
+        assert (
+            create_shifts_command.insert_shifts(
+                [Shift(date=START, time="AM"), Shift(date=START, time="PM")]
+            )
+            == 1
+        )
+        assert Shift.objects.count() == 2
+
+    def test_keep_existing(self):
+        ShiftFactory(date=START, time="AM", slots_available=10)
+        out = create_shifts("2030-01-07", "2030-01-08", "--keep-existing")
+        assert "Created 1, updated 0, unchanged 1" in out
+        assert Shift.objects.get(date=START, time="AM").slots_available == 10
+
+    def test_statement_count(self, spec_path, django_assert_max_num_queries):
+        with django_assert_max_num_queries(8):
+            create_shifts("2030-01-01", "2030-04-01", "--spec", spec_path)
+        assert Shift.objects.count() > 150
+
+    def test_bad_spec(self, tmp_path):
+        path = tmp_path / "shifts.json"
+        path.write_text(json.dumps({"monday": {"XX": 1}}))
+        with pytest.raises(CommandError):
+            create_shifts("2030-01-07", "2030-01-08", "--spec", str(path))
+
+
+ECWID_COLUMNS = [
+    "order_number",
+    "email",
+    "shipto_person_name",
+    "shipto_person_phone",
+    "shipto_person_street_1",
+    "shipto_person_street_2",
+    "shipto_person_city",
+    "shipto_person_postal_code",
+    "order_comments",
+    "name",
+    "quantity",
+]
+
+
+def ecwid_rows(order_number, shift, item_names, phone=None):
+    order = {
+        "order_number": order_number,
+        "email": f"{order_number}@example.com",
+        "shipto_person_name": f"Pat {order_number}",
+        "shipto_person_phone": phone or f"415555{int(order_number) % 10000:04d}",
+        "shipto_person_street_1": "1 Main St",
+        "shipto_person_street_2": "",
+        "shipto_person_city": "San Francisco",
+        "shipto_person_postal_code": "94110",
+        "order_comments": "",
+    }
+    shift_name = f"{shift.date:%A} {shift.date:%m/%d/%Y} {shift.time} shift"
+    yield {**order, "name": shift_name, "quantity": "1"}
+    for item_name in item_names:
+        yield {**order, "name": item_name, "quantity": "1"}
+
+
+def write_ecwid_file(path, rows):
+    with open(path, "w") as f:
+        f.write("\t".join(ECWID_COLUMNS) + "\n")
+        for row in rows:
+            f.write("\t".join(row[column] for column in ECWID_COLUMNS) + "\n")
+    return str(path)
+
+
+def load_ecwid(*args):
+    out = StringIO()
+    call_command("load_ecwid", *args, stdout=out)
+    return out.getvalue()
+
+
+class TestLoadEcwid:
+    def test_import_and_reimport(self, tmp_path):
+        am = ShiftFactory(time="AM")
+        pm = ShiftFactory(date=am.date, time="PM")
+        path = write_ecwid_file(
+            tmp_path / "orders.tsv",
+            [
+                *ecwid_rows("1001", am, ["Noble Fir 6ft", "Stand"]),
+                *ecwid_rows("1002", am, ["Wreath"]),
+            ],
+        )
+        assert "Saved 2 orders, skipped 0" in load_ecwid(path)
+        order = Delivery.objects.get(order_number="1001")
+        assert order.recipient_last_name == "1001"
+        assert str(order.recipient_phone_number) == "+14155551001"
+        assert sorted(order.item_set.values_list("item_name", flat=True)) == [
+            "Noble Fir 6ft",
+            "Stand",
+        ]
+        am.refresh_from_db()
+        assert am.filled_count == 2
+
+        path = write_ecwid_file(
+            tmp_path / "orders.tsv", ecwid_rows("1001", pm, ["Douglas Fir 7ft"])
+        )
+        assert "Saved 1 orders" in load_ecwid(path)
+        order.refresh_from_db()
+        assert order.delivery_shift == pm
+        assert list(order.item_set.values_list("item_name", flat=True)) == [
+            "Douglas Fir 7ft"
+        ]
+        assert Delivery.objects.count() == 2
+        am.refresh_from_db()
+        pm.refresh_from_db()
+        assert (am.filled_count, pm.filled_count) == (1, 1)
+
+    def test_skips_bad_orders(self, tmp_path):
+        shift = ShiftFactory()
+        unknown = ShiftFactory.build(date=datetime.date(2031, 1, 1))
+        path = write_ecwid_file(
+            tmp_path / "orders.tsv",
+            [
+                *ecwid_rows("1001", shift, ["Wreath"]),
+                *ecwid_rows("1002", unknown, ["Wreath"]),
+                *ecwid_rows("1003", shift, []),
+                # duplicate phone number only fails its own order
+                *ecwid_rows("1004", shift, ["Wreath"], phone="4155551001"),
+                *ecwid_rows("1005", shift, ["Wreath"]),
+            ],
+        )
+        out = load_ecwid(path)
+        assert "Saved 2 orders, skipped 2" in out
+        assert "Unable to save order 1004" in out
+        assert set(Delivery.objects.values_list("order_number", flat=True)) == {
+            "1001",
+            "1005",
+        }
+        shift.refresh_from_db()
+        assert shift.filled_count == 2
+
+    def test_benchmark_20k_rows(self, tmp_path, django_assert_max_num_queries):
+        shifts = [ShiftFactory() for _ in range(10)]
+        rows = [
+            row
+            for n in range(5000)
+            for row in ecwid_rows(
+                str(10000 + n),
+                shifts[n % len(shifts)],
+                ["Noble Fir 6ft", "Stand", "Wreath"],
+            )
+        ]
+        assert len(rows) == 20000
+        path = write_ecwid_file(tmp_path / "orders.tsv", rows)
+        # a fixed number of statements per 500-order batch rather than several
+        # per order; SQLite splits each bulk insert by its variable limit, so
+        # the bound is loose enough for both backends
+        with django_assert_max_num_queries(40 * 5000 // 500):
+            assert "Saved 5000 orders" in load_ecwid(path)
+        assert Item.objects.count() == 15000
+        assert sum(Shift.objects.values_list("filled_count", flat=True)) == 5000
+
+
+class TestUpdateDeliveries:
+    def test_delta_pass(self, monkeypatch):
+        first, second = DeliveryFactory.create_batch(2, online_id=None)
+        fetched = []
+
+        def fake_request_clover_orders(order_number=None, **__):
+            fetched.append(order_number)
+            return {**_clover_order(order_number), "modifiedTime": 1900000000000}
+
+        monkeypatch.setattr(
+            actions, "request_clover_orders", fake_request_clover_orders
+        )
+        monkeypatch.setattr(
+            update_deliveries,
+            "search_clover_by_modified_time",
+            # matched case-insensitively, like the other Clover lookups
+            lambda since: [{"id": first.order_number.lower()}],
+        )
+        monkeypatch.setattr(
+            update_deliveries, "get_ids_updated_since", lambda since: set()
+        )
+
+        out = StringIO()
+        call_command("update_deliveries", "--since", "last", stdout=out)
+        # nothing synced yet, so there's no watermark and everything goes
+        assert "Updated 2 of 2 orders" in out.getvalue()
+
+        fetched.clear()
+        call_command("update_deliveries", "--since", "last", stdout=out)
+        assert "Updated 0 of 1 orders" in out.getvalue()
+        assert fetched == [first.order_number]
+
+        first.refresh_from_db()
+        assert first.source_hash
+        assert first.recipient_last_name == "Lee"
+
+    def test_skips_failed_orders(self, monkeypatch):
+        good, bad = DeliveryFactory.create_batch(
+            2, online_id=None, recipient_last_name=None
+        )
+
+        def fake_request_clover_orders(order_number=None, **__):
+            if order_number == bad.order_number:
+                raise ConnectionError("Clover is down")
+            return _clover_order(order_number)
+
+        monkeypatch.setattr(
+            actions, "request_clover_orders", fake_request_clover_orders
+        )
+
+        out = StringIO()
+        call_command("update_deliveries", stdout=out)
+
+        assert f"Unable to sync order {bad.order_number}" in out.getvalue()
+        assert "Updated 1 of 2 orders, failed 1" in out.getvalue()
+        good.refresh_from_db()
+        assert good.recipient_last_name == "Lee"
+
+
+class TestLoadtest:
+    def test_reports_throughput(self, live_server):
+        out = StringIO()
+        call_command(
+            "loadtest",
+            live_server.url + reverse("available-shifts"),
+            "--requests",
+            "10",
+            "--concurrency",
+            "3",
+            stdout=out,
+        )
+        assert "10 requests in" in out.getvalue()
+        assert "0 errors" in out.getvalue()
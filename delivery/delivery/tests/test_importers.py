@@ -0,0 +1,267 @@
+import datetime
+import json
+
+import pytest
+
+from delivery.delivery import clover
+from delivery.delivery.constants import DeliveryTypes
+from delivery.delivery.importers import (
+    CloverSource,
+    CsvSource,
+    DelimitedFileSource,
+    EcwidSource,
+    ItemRecord,
+    JsonlSource,
+    OrderRecord,
+    OrderSink,
+    ShopifySource,
+    import_orders,
+)
+from delivery.delivery.models import Delivery, Shift
+from delivery.delivery.tests.factories import ShiftFactory
+from delivery.delivery.tests.test_actions import _clover_order
+from delivery.delivery.tests.test_commands import ecwid_rows, write_ecwid_file
+
+pytestmark = pytest.mark.django_db
+
+
+def _sink(**kwargs):
+    warnings = []
+    return OrderSink(warn=warnings.append, **kwargs), warnings
+
+
+class TestSources:
+    def test_csv(self, tmp_path):
+        path = tmp_path / "orders.csv"
+        path.write_text(
+            "order_number,recipient_last_name,recipient_phone_number,"
+            "shift_date,shift_time,item_name,quantity\n"
+            "A1,Lee,(415) 555-0101,2030-01-07,AM,Noble Fir 6ft,1\n"
+            "A1,,,,,Stand,2\n"
+            "A2,Kim,not a phone,2030-01-07,PM,Wreath,1\n"
+        )
+        records = list(CsvSource(str(path)).records())
+        assert [r.order_number for r in records] == ["A1", "A2"]
+        assert records[0].recipient_phone_number == "+14155550101"
+        assert (records[0].shift_date, records[0].shift_time) == (
+            datetime.date(2030, 1, 7),
+            "AM",
+        )
+        assert [(i.item_name, i.quantity) for i in records[0].items] == [
+            ("Noble Fir 6ft", 1),
+            ("Stand", 2),
+        ]
+        assert records[1].recipient_phone_number is None
+        assert records[1].warnings
+
+    def test_jsonl(self, tmp_path):
+        path = tmp_path / "orders.jsonl"
+        path.write_text(
+            json.dumps(
+                {
+                    "order_number": "J1",
+                    "recipient_last_name": "Lee",
+                    "shift_id": 3,
+                    "created_at": "2030-01-01T10:00:00+00:00",
+                    "items": [{"item_name": "Wreath", "quantity": 2}],
+                }
+            )
+            + "\n\n"
+        )
+        (record,) = JsonlSource(str(path)).records()
+        assert record.shift_id == 3
+        assert record.created_at.year == 2030
+        assert record.items[0].quantity == 2
+
+    def test_chunk_boundaries_rejoin_orders(self, tmp_path):
+        shift = ShiftFactory.build(date=datetime.date(2030, 1, 7))
+        path = write_ecwid_file(
+            tmp_path / "orders.tsv",
+            [
+                *ecwid_rows("1001", shift, ["Noble Fir 6ft", "Stand"]),
+                *ecwid_rows("1002", shift, ["Wreath"]),
+            ],
+        )
+        whole = list(EcwidSource(path).records())
+        split = list(EcwidSource(path, chunk_size=2).records())
+        assert split == whole
+        assert [len(r.items) for r in split] == [2, 1]
+
+    def test_parallel_parse_matches_serial(self, tmp_path):
+        shift = ShiftFactory.build(date=datetime.date(2030, 1, 7))
+        path = write_ecwid_file(
+            tmp_path / "orders.tsv",
+            [
+                row
+                for n in range(50)
+                for row in ecwid_rows(str(1000 + n), shift, ["Wreath", "Stand"])
+            ],
+        )
+        serial = list(EcwidSource(path, chunk_size=7).records())
+        parallel = list(EcwidSource(path, chunk_size=7).records(workers=2))
+        assert parallel == serial
+        assert len(parallel) == 50
+
+    def test_clover(self):
+        (record,) = CloverSource([_clover_order("C100")]).records()
+        assert record.order_number == "C100"
+        assert record.recipient_last_name == "Lee"
+        assert [i.item_name for i in record.items] == ["Noble Fir 6ft"]
+        assert record.items[0].is_pulled
+
+    def test_shopify(self):
+        shift = ShiftFactory(date=datetime.date(2030, 12, 1), time="AM")
+        order = {
+            "name": "#1001",
+            "id": "gid://shopify/Order/42",
+            "createdAt": "2030-11-01T00:00:00Z",
+            "note": "gate code 1234",
+            "customAttributes": [
+                {"key": "Delivery-Date", "value": "2030/12/01"},
+                {"key": "Delivery-Time", "value": "9:30 AM - 2:00 PM"},
+            ],
+            "totalShippingPriceSet": {"shopMoney": {"amount": "75.0"}},
+            "shippingAddress": {
+                "firstName": "Sam",
+                "lastName": "Ortiz",
+                "address1": "1 Main St",
+                "address2": None,
+                "city": "San Francisco",
+                "zip": "94110",
+                "phone": "(415) 555-0101",
+            },
+            "customer": {"firstName": "Sam", "lastName": "Ortiz", "phone": None},
+            "lineItems": {
+                "edges": [
+                    {"node": {"name": "Wreath", "quantity": 2, "currentQuantity": 2}},
+                    {"node": {"name": "Stand", "quantity": 1, "currentQuantity": 0}},
+                ]
+            },
+        }
+
+        (record,) = ShopifySource([order]).records()
+
+        assert (record.order_number, record.online_id) == ("1001", "42")
+        assert record.recipient_last_name == "Ortiz"
+        assert record.recipient_phone_number == "+14155550101"
+        assert (record.address_line_1, record.address_city) == (
+            "1 Main St",
+            "San Francisco",
+        )
+        assert record.notes == "gate code 1234"
+        assert record.delivery_type == DeliveryTypes.CURBSIDE
+        assert record.shift_id == shift.pk
+        assert [(i.item_name, i.quantity) for i in record.items] == [("Wreath", 2)]
+
+    def test_missing_hook_fails_at_instantiation(self):
+        class NoItems(DelimitedFileSource):
+            def parse_order(self, row):
+                return OrderRecord(row["order_number"])
+
+        with pytest.raises(TypeError, match="parse_item"):
+            NoItems("orders.csv")
+
+    def test_clover_fills_in_prefetched_customers(self, monkeypatch):
+        order = _clover_order("C101")
+        order["customers"]["elements"] = [{"id": "C1", "href": "x"}]
+        monkeypatch.setattr(
+            clover,
+            "request_clover_customer_list",
+            lambda ids: {
+                "C1": {
+                    "id": "C1",
+                    "firstName": "Ann",
+                    "lastName": "Lee",
+                    "phoneNumbers": {"elements": [{"phoneNumber": "4155550100"}]},
+                }
+            },
+        )
+
+        (record,) = CloverSource([order]).records()
+
+        assert record.recipient_first_name == "Ann"
+        assert record.recipient_last_name == "Lee"
+        assert record.recipient_phone_number == "+14155550100"
+
+
+class TestOrderSink:
+    def test_upserts_and_keeps_counts(self):
+        shift = ShiftFactory()
+        other = ShiftFactory()
+        sink, warnings = _sink()
+        created_at = datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc)
+        result = sink.write(
+            [
+                OrderRecord(
+                    "S1",
+                    recipient_last_name="Lee",
+                    shift_date=shift.date,
+                    shift_time=shift.time,
+                    created_at=created_at,
+                    items=[ItemRecord("Wreath")],
+                ),
+                OrderRecord("S2", shift_id=shift.pk, items=[ItemRecord("Stand")]),
+                OrderRecord("S3", shift_id=shift.pk),
+            ]
+        )
+        assert (result.saved, result.skipped) == (2, 1)
+        assert warnings == ["No items found for order S3"]
+        saved = Delivery.objects.get(order_number="S1")
+        assert saved.created_at == created_at
+
+        sink, _ = _sink()
+        sink.write(
+            [OrderRecord("S1", shift_id=other.pk, items=[ItemRecord("Noble Fir")])]
+        )
+        saved.refresh_from_db()
+        assert saved.recipient_last_name == "Lee"
+        assert [i.item_name for i in saved.item_set.all()] == ["Noble Fir"]
+        assert dict(Shift.objects.values_list("pk", "filled_count")) == {
+            shift.pk: 1,
+            other.pk: 1,
+        }
+
+    def test_skips_malformed_record(self):
+        shift = ShiftFactory()
+        sink, warnings = _sink()
+        result = sink.write(
+            [
+                OrderRecord("B1", shift_id=shift.pk, items=[ItemRecord("Wreath")]),
+                OrderRecord(
+                    "B2",
+                    shift_id=shift.pk,
+                    delivery_type="curbside",
+                    items=[ItemRecord("Stand")],
+                ),
+                OrderRecord("B3", shift_id=shift.pk, items=[ItemRecord("Garland")]),
+            ]
+        )
+        assert (result.saved, result.failed) == (2, 1)
+        assert [w.split(":")[0] for w in warnings] == ["Unable to save order B2"]
+        assert set(Delivery.objects.values_list("order_number", flat=True)) == {
+            "B1",
+            "B3",
+        }
+        shift.refresh_from_db()
+        assert shift.filled_count == 2
+
+    def test_import_orders_from_several_sources(self, tmp_path):
+        shift = ShiftFactory()
+        ecwid = write_ecwid_file(
+            tmp_path / "orders.tsv", ecwid_rows("1001", shift, ["Wreath"])
+        )
+        jsonl = tmp_path / "orders.jsonl"
+        jsonl.write_text(
+            json.dumps(
+                {
+                    "order_number": "J1",
+                    "shift_id": shift.pk,
+                    "items": [{"item_name": "Wreath"}],
+                }
+            )
+        )
+        sink, _ = _sink(batch_size=1)
+        result = import_orders([EcwidSource(ecwid), JsonlSource(str(jsonl))], sink)
+        assert result.saved == 2
+        shift.refresh_from_db()
+        assert shift.filled_count == 2
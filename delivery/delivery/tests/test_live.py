@@ -0,0 +1,242 @@
+import asyncio
+import datetime
+import hashlib
+import hmac
+import json
+
+import httpx
+import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from django.urls import reverse
+
+from delivery.delivery import live
+from delivery.delivery.actions import CandidateOrder
+from delivery.delivery.tests.factories import DeliveryFactory, ShiftFactory
+from delivery.delivery.tests.test_clients import mock_http
+
+pytestmark = pytest.mark.django_db
+
+
+class FakeSocket:
+    def __init__(self, session_key=None, feed="orders", origin="http://testserver"):
+        headers = [(b"origin", origin.encode())] if origin else []
+        if session_key:
+            headers.append((b"cookie", f"sessionid={session_key}".encode()))
+        self.scope = {"type": "websocket", "path": live.LIVE_FEED_PREFIX + feed}
+        self.scope["headers"] = headers
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        self.sent: asyncio.Queue = asyncio.Queue()
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send(self, message):
+        await self.sent.put(message)
+
+    async def next_sent(self):
+        return await asyncio.wait_for(self.sent.get(), 5)
+
+    async def next_message(self):
+        return json.loads((await self.next_sent())["text"])
+
+
+def candidate(order_number):
+    return CandidateOrder(
+        order_number, datetime.datetime(2030, 12, 1, tzinfo=datetime.timezone.utc)
+    )
+
+
+class TestLiveFeed:
+    def test_one_search_for_every_page(self, admin_client, monkeypatch, settings):
+        settings.LIVE_POLL_INTERVAL = 60
+        results = [["O1"], ["O1", "O2"]]
+        searches = []
+
+        async def fake_search(start_date):
+            searches.append(start_date)
+            return [candidate(n) for n in results[len(searches) - 1]]
+
+        monkeypatch.setattr(live, "search_clover_orders_async", fake_search)
+        session_key = admin_client.cookies[settings.SESSION_COOKIE_NAME].value
+
+        async def run():
+            pages = [FakeSocket(session_key), FakeSocket(session_key)]
+            feeds = [
+                asyncio.ensure_future(live.live_feed(p.scope, p.receive, p.send))
+                for p in pages
+            ]
+            for page in pages:
+                page.incoming.put_nowait({"type": "websocket.connect"})
+                assert (await page.next_sent())["type"] == "websocket.accept"
+            first = [await page.next_message() for page in pages]
+            live.new_order_poller.wake()
+            second = [await page.next_message() for page in pages]
+            for page in pages:
+                page.incoming.put_nowait({"type": "websocket.disconnect"})
+            await asyncio.gather(*feeds)
+            return first, second
+
+        first, second = async_to_sync(run)()
+
+        assert len(searches) == 2
+        for message in first:
+            assert message["type"] == "orders"
+            assert [o["order_number"] for o in message["orders"]] == ["O1"]
+        for message in second:
+            assert message["type"] == "new_orders"
+            assert [o["order_number"] for o in message["orders"]] == ["O2"]
+        # stops polling once the last page closes
+        assert live.new_order_poller._task is None
+
+    def test_requires_staff(self, client, django_user_model, settings):
+        user = django_user_model.objects.create_user("driver", password="x")
+        client.force_login(user)
+        page = FakeSocket(client.cookies[settings.SESSION_COOKIE_NAME].value)
+
+        async def run():
+            page.incoming.put_nowait({"type": "websocket.connect"})
+            await live.live_feed(page.scope, page.receive, page.send)
+            return await page.next_sent()
+
+        assert async_to_sync(run)() == {"type": "websocket.close", "code": 4403}
+
+    @pytest.mark.parametrize("origin", ["https://evil.example", None])
+    def test_rejects_other_origins(self, admin_client, settings, origin):
+        page = FakeSocket(
+            admin_client.cookies[settings.SESSION_COOKIE_NAME].value, origin=origin
+        )
+
+        async def run():
+            page.incoming.put_nowait({"type": "websocket.connect"})
+            await live.live_feed(page.scope, page.receive, page.send)
+            return await page.next_sent()
+
+        assert async_to_sync(run)() == {"type": "websocket.close", "code": 4403}
+
+    def test_shift_counts_published_on_commit(self, django_capture_on_commit_callbacks):
+        shift = ShiftFactory()
+
+        def book():
+            with django_capture_on_commit_callbacks(execute=True):
+                DeliveryFactory(delivery_shift=shift)
+
+        async def run():
+            queue = live.new_order_poller.broadcaster.subscribe()
+            try:
+                await sync_to_async(book)()
+                return await asyncio.wait_for(queue.get(), 5)
+            finally:
+                live.new_order_poller.broadcaster.unsubscribe(queue)
+
+        message = async_to_sync(run)()
+
+        assert message["type"] == "shifts"
+        [counts] = message["shifts"]
+        assert counts["id"] == shift.pk
+        assert counts["filled_count"] == 1
+        shift.refresh_from_db()
+        assert counts["label"] == str(shift)
+
+
+def post_onfleet(client, payload, secret="ab" * 32):
+    body = json.dumps(payload).encode()
+    signature = hmac.new(bytes.fromhex(secret), body, hashlib.sha512).hexdigest()
+    return client.post(
+        reverse("onfleet-webhook"),
+        body,
+        content_type="application/json",
+        HTTP_X_ONFLEET_SIGNATURE=signature,
+    )
+
+
+def onfleet_task(task_id, state, worker="W1"):
+    return {
+        "id": task_id,
+        "state": state,
+        "worker": worker,
+        "recipients": [{"name": f"Recipient {task_id}"}],
+        "metadata": [{"name": "order_number", "value": f"O{task_id}"}],
+    }
+
+
+class TestTruckBoard:
+    @pytest.fixture(autouse=True)
+    def onfleet_settings(self, settings):
+        settings.ONFLEET_API_KEY = "onfleet-key"
+        settings.ONFLEET_INTEGRATION_API = "https://onfleet.test/v2"
+        settings.ONFLEET_WEBHOOK_SECRET = "ab" * 32
+        settings.TRUCK_BOARD_POLL_INTERVAL = 60
+
+    def test_webhooks_push_only_changes(self, admin_client, monkeypatch, settings):
+        polled = []
+
+        def handler(request):
+            resource = request.url.path.rpartition("/")[2]
+            polled.append(resource)
+            data = {
+                "workers": [
+                    {"id": "W1", "name": "Truck 1", "tasks": ["T1", "T2"]},
+                    {"id": "W2", "name": "Idle", "tasks": []},
+                ],
+                "tasks": [onfleet_task("T1", 2), onfleet_task("T2", 1)],
+            }[resource]
+            return httpx.Response(200, json=data)
+
+        mock_http(monkeypatch, handler)
+        page = FakeSocket(
+            admin_client.cookies[settings.SESSION_COOKIE_NAME].value, feed="trucks"
+        )
+
+        async def run():
+            feed = asyncio.ensure_future(
+                live.live_feed(page.scope, page.receive, page.send)
+            )
+            page.incoming.put_nowait({"type": "websocket.connect"})
+            assert (await page.next_sent())["type"] == "websocket.accept"
+            board = await page.next_message()
+            response = await sync_to_async(post_onfleet)(
+                admin_client,
+                {
+                    "triggerName": "taskCompleted",
+                    "data": {"task": onfleet_task("T1", 3)},
+                },
+            )
+            change = await page.next_message()
+            page.incoming.put_nowait({"type": "websocket.disconnect"})
+            await feed
+            return board, response, change
+
+        board, response, change = async_to_sync(run)()
+
+        assert board["type"] == "route"
+        assert list(board["workers"]) == ["W1"]
+        assert board["workers"]["W1"]["tasks"] == ["T1", "T2"]
+        assert board["tasks"]["T1"]["order_number"] == "OT1"
+        assert response.status_code == 200
+        # the completed task leaves the queue; nothing else is resent
+        assert change == {
+            "type": "route",
+            "workers": {"W1": {"id": "W1", "name": "Truck 1", "tasks": ["T2"]}},
+            "tasks": {"T1": {**board["tasks"]["T1"], "state": 3}},
+            "removed_workers": [],
+            "removed_tasks": [],
+        }
+        assert sorted(polled) == ["tasks", "workers"]
+
+    def test_webhook_rejects_bad_signature(self, client):
+        response = post_onfleet(
+            client, {"triggerName": "taskStarted"}, secret="cd" * 32
+        )
+        assert response.status_code == 401
+
+    def test_webhook_validation(self, client):
+        response = client.get(reverse("onfleet-webhook"), {"check": "abc123"})
+        assert response.content == b"abc123"
+        assert response["Content-Type"] == "text/plain"
+
+    def test_webhook_validation_rejects_markup(self, client):
+        response = client.get(
+            reverse("onfleet-webhook"), {"check": "<script>alert(1)</script>"}
+        )
+        assert response.status_code == 400
+        assert b"script" not in response.content
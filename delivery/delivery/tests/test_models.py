@@ -0,0 +1,408 @@
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models.functions import Upper
+from django.utils import timezone
+
+from delivery.delivery import models
+from delivery.delivery.constants import DeliveryTypes
+from delivery.delivery.models import Delivery, Shift, ShiftFullError
+from delivery.delivery.signals import defer_shift_count_updates
+from delivery.delivery.tests.factories import DeliveryFactory, ItemFactory, ShiftFactory
+
+pytestmark = pytest.mark.django_db
+
+
+class TestDeliveryIndexes:
+    @pytest.fixture(autouse=True)
+    def seeded(self):
+        shifts = ShiftFactory.create_batch(10)
+        for n in range(300):
+            DeliveryFactory(delivery_shift=shifts[n % 10], online_id=str(4000 + n))
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE delivery_delivery")
+                # small tables are cheaper to scan; check the index is usable
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        return shifts
+
+    def test_upper_order_number(self):
+        plan = (
+            Delivery.objects.annotate(clover_id=Upper("order_number"))
+            .filter(clover_id__in=["ORDER000001", "ORDER000002"])
+            .explain()
+        )
+        assert "delivery_order_number_upper" in plan
+
+    def test_online_id(self):
+        plan = Delivery.objects.filter(online_id__in=["4001", "4002"]).explain()
+        assert "delivery_online_id" in plan
+
+    def test_recipient_and_shift(self, seeded):
+        plan = Delivery.objects.filter(
+            recipient_first_name="Ann",
+            recipient_last_name="Lee",
+            delivery_shift_id=seeded[0].id,
+        ).explain()
+        assert "delivery_shift_recipient" in plan
+
+    def test_created_at(self):
+        plan = Delivery.objects.filter(
+            created_at__gte=timezone.now() - datetime.timedelta(days=1)
+        ).explain()
+        assert "delivery_created_at" in plan
+
+
+class TestSerializeManyForOnfleet:
+    @pytest.fixture
+    def shift(self):
+        shift = ShiftFactory(time="PM")
+        for delivery in DeliveryFactory.create_batch(200, delivery_shift=shift):
+            ItemFactory.create_batch(2, delivery=delivery)
+        return shift
+
+    def test_two_queries(self, shift, django_assert_num_queries):
+        with django_assert_num_queries(2):
+            tasks = Delivery.serialize_many_for_onfleet(shift.delivery_set.all())
+        assert len(tasks) == 200
+
+    def test_matches_single_serializer(self, shift):
+        deliveries = shift.delivery_set.order_by("id")
+        assert Delivery.serialize_many_for_onfleet(deliveries) == [
+            d.serialize_for_onfleet() for d in deliveries
+        ]
+
+
+class TestShiftReserve:
+    def test_rejects_overbooking(self):
+        shift = ShiftFactory(slots_available=2)
+        DeliveryFactory(delivery_shift=shift)
+
+        with transaction.atomic():
+            assert Shift.objects.reserve(shift.id) == shift
+        with pytest.raises(ShiftFullError), transaction.atomic():
+            Shift.objects.reserve(shift.id, count=2)
+
+    @pytest.mark.django_db(transaction=True)
+    @pytest.mark.skipif(
+        not connection.features.has_select_for_update,
+        reason="row locks need a database with SELECT ... FOR UPDATE",
+    )
+    def test_parallel_bookings(self):
+        shift = ShiftFactory(slots_available=3)
+        barrier = threading.Barrier(10)
+
+        def book(n: int) -> bool:
+            try:
+                barrier.wait()
+                with transaction.atomic():
+                    Shift.objects.reserve(shift.id)
+                    DeliveryFactory(delivery_shift_id=shift.id)
+                return True
+            except ShiftFullError:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(book, range(10)))
+
+        assert results.count(True) == 3
+        assert shift.delivery_set.count() == 3
+
+
+class TestShiftFilledCount:
+    def test_save_and_delete(self):
+        first, second = ShiftFactory.create_batch(2)
+        delivery = DeliveryFactory(delivery_shift=first)
+        DeliveryFactory(delivery_shift=first)
+        first.refresh_from_db()
+        assert first.filled_count == 2
+
+        delivery = Delivery.objects.get(pk=delivery.pk)
+        delivery.delivery_shift = second
+        delivery.save()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        assert (first.filled_count, second.filled_count) == (1, 1)
+
+        delivery.delete()
+        second.refresh_from_db()
+        assert second.filled_count == 0
+
+    def test_recount_command(self):
+        shift = ShiftFactory()
+        DeliveryFactory.create_batch(3, delivery_shift=shift)
+        Shift.objects.update(filled_count=17)
+
+        call_command("recount_shifts", stdout=StringIO())
+
+        shift.refresh_from_db()
+        assert shift.filled_count == 3
+        assert ShiftFactory().filled_count == 0
+
+
+def _clover_line_items(*items):
+    return {
+        "lineItems": {
+            "elements": [
+                {"id": item_id, "name": name, "price": 100, "refunded": refunded}
+                for item_id, name, refunded in items
+            ]
+        }
+    }
+
+
+class TestReconcileItems:
+    def test_clover_quantity_changes_and_refunds(self):
+        delivery = DeliveryFactory()
+        manual = ItemFactory(delivery=delivery, item_name="Tree stand")
+        delivery._load_clover_items(
+            _clover_line_items(
+                ("A1", "Noble Fir", False),
+                ("A2", "Noble Fir", False),
+                ("B1", "Wreath", False),
+                ("D1", "Delivery", False),
+            )
+        )
+        assert {(i.item_name, i.quantity) for i in delivery.item_set.all()} == {
+            ("Tree stand", manual.quantity),
+            ("Noble Fir", 2),
+            ("Wreath", 1),
+        }
+
+        delivery._load_clover_items(
+            _clover_line_items(
+                ("A1", "Noble Fir", True),
+                ("A2", "Noble Fir", False),
+                ("B1", "Wreath", True),
+            )
+        )
+        items = {i.item_name: i for i in delivery.item_set.all()}
+        assert set(items) == {"Tree stand", "Noble Fir"}
+        assert (items["Noble Fir"].quantity, items["Noble Fir"].clover_id) == (
+            1,
+            "A2",
+        )
+        assert not items["Tree stand"].is_pulled
+
+    def test_shopify_adopts_existing_items_by_name(self):
+        delivery = DeliveryFactory()
+        existing = ItemFactory(delivery=delivery, item_name="Wreath", quantity=1)
+        delivery._load_line_items_from_shopify(
+            {
+                "lineItems": {
+                    "edges": [
+                        {
+                            "node": {
+                                "name": "Wreath",
+                                "quantity": 3,
+                                "currentQuantity": 2,
+                            }
+                        },
+                        {
+                            "node": {
+                                "name": "Garland",
+                                "quantity": 1,
+                                "currentQuantity": 0,
+                            }
+                        },
+                    ]
+                }
+            }
+        )
+        existing.refresh_from_db()
+        assert (existing.quantity, existing.is_pulled) == (2, True)
+        assert delivery.item_set.count() == 1
+
+    def test_bulk_writes(self, django_assert_num_queries):
+        delivery = DeliveryFactory()
+        delivery.reconcile_items(
+            [{"item_name": f"Tree {n}", "quantity": 1} for n in range(20)]
+        )
+        # one read, one delete, one update, one insert regardless of item count
+        with django_assert_num_queries(4):
+            delivery.reconcile_items(
+                [{"item_name": f"Tree {n}", "quantity": 2} for n in range(10, 30)]
+            )
+        assert delivery.item_set.count() == 20
+
+
+class TestConditionalSync:
+    def test_skips_unchanged_source(self, monkeypatch):
+        loads = []
+        monkeypatch.setattr(
+            Delivery, "load_from_clover", lambda self, data: loads.append(data)
+        )
+        delivery = DeliveryFactory(online_id=None)
+        order_data = {"id": delivery.order_number, "modifiedTime": 1900000000000}
+
+        assert delivery.apply_sync_data(order_data)
+        assert delivery.source_modified_at == datetime.datetime(
+            2030, 3, 17, 17, 46, 40, tzinfo=datetime.timezone.utc
+        )
+        assert not delivery.apply_sync_data(dict(order_data))
+        assert len(loads) == 1
+
+        assert delivery.apply_sync_data({**order_data, "note": "gate code 1234"})
+        assert delivery.apply_sync_data(order_data, force=True)
+        assert len(loads) == 3
+
+
+class TestLoadFromClover:
+    def test_fills_in_customer_details(self, monkeypatch):
+        monkeypatch.setattr(
+            models,
+            "request_clover_customer",
+            lambda id: {
+                "id": id,
+                "lastName": "Lee",
+                "addresses": {
+                    "elements": [
+                        {
+                            "address1": "1 Main St",
+                            "address2": None,
+                            "city": "San Francisco",
+                            "zip": "94110",
+                        }
+                    ]
+                },
+                "emailAddresses": {"elements": [{"emailAddress": "ann@example.com"}]},
+                "phoneNumbers": {"elements": [{"phoneNumber": "4155550100"}]},
+            },
+        )
+        delivery = DeliveryFactory(
+            recipient_phone_number=None, notes=None, recipient_email=None
+        )
+        order_data = {
+            "id": delivery.order_number,
+            "note": "gate code 1234",
+            "createdTime": 1669000000000,
+            "customers": {"elements": [{"id": "C1", "href": "x", "firstName": "Ann"}]},
+        }
+
+        delivery.load_from_clover(order_data)
+
+        assert (delivery.recipient_first_name, delivery.recipient_last_name) == (
+            "Ann",
+            "Lee",
+        )
+        assert (delivery.address_line_1, delivery.address_city) == (
+            "1 Main St",
+            "San Francisco",
+        )
+        assert delivery.recipient_email == "ann@example.com"
+        assert delivery.recipient_phone_number == "+14155550100"
+        assert delivery.notes == "gate code 1234"
+        assert delivery.delivery_type == DeliveryTypes.WHITE_GLOVE
+
+    def test_rejects_several_customers(self):
+        customers = {"elements": [{"id": "C1"}, {"id": "C2"}]}
+        with pytest.raises(ValueError, match="customers"):
+            Delivery().load_from_clover({"id": "O1", "customers": customers})
+
+
+class TestShopifyCancellation:
+    def test_frees_shift_slot(self, monkeypatch):
+        monkeypatch.setattr(Delivery, "_load_line_items_from_shopify", lambda *_: None)
+        shift = ShiftFactory(date=datetime.date(2030, 12, 1), time="AM")
+        delivery = DeliveryFactory(delivery_shift=shift, online_id="42", notes=None)
+        order_data = {
+            "name": "#1001",
+            "id": "gid://shopify/Order/42",
+            "createdAt": "2030-11-01T00:00:00Z",
+            "cancelledAt": None,
+            "note": None,
+            "customAttributes": [],
+            "totalShippingPriceSet": {"shopMoney": {"amount": "0.0"}},
+            "shippingAddress": dict.fromkeys(
+                ["firstName", "lastName", "address1", "address2", "city", "zip"],
+                "x",
+            ),
+            "customer": {"firstName": "x", "lastName": "x", "phone": "5555555555"},
+        }
+        order_data["shippingAddress"]["phone"] = None
+
+        delivery.apply_sync_data(order_data)
+        assert delivery.cancelled_at is None
+        delivery.save()
+        shift.refresh_from_db()
+        assert shift.filled_count == 1
+
+        delivery.apply_sync_data({**order_data, "cancelledAt": "2030-11-02T00:00:00Z"})
+        delivery.save()
+        delivery.refresh_from_db()
+        shift.refresh_from_db()
+        assert delivery.cancelled_at is not None
+        assert delivery.delivery_shift == shift
+        assert delivery.notes.endswith("Cancelled in Shopify")
+        assert shift.filled_count == 0
+
+        Shift.objects.recount()
+        shift.refresh_from_db()
+        assert shift.filled_count == 0
+        delivery.delete()
+        shift.refresh_from_db()
+        assert shift.filled_count == 0
+
+
+class TestDeferShiftCountUpdates:
+    def test_applies_once_on_exit(self):
+        first, second = ShiftFactory.create_batch(2)
+        moved = DeliveryFactory(delivery_shift=first)
+        with defer_shift_count_updates():
+            DeliveryFactory.create_batch(3, delivery_shift=first)
+            moved = Delivery.objects.get(pk=moved.pk)
+            moved.delivery_shift = second
+            moved.save()
+            first.refresh_from_db()
+            assert first.filled_count == 1
+        first.refresh_from_db()
+        second.refresh_from_db()
+        assert (first.filled_count, second.filled_count) == (3, 1)
+
+    def test_rolls_back_with_the_block(self):
+        shift = ShiftFactory()
+        with pytest.raises(RuntimeError):
+            with defer_shift_count_updates():
+                DeliveryFactory(delivery_shift=shift)
+                raise RuntimeError
+        shift.refresh_from_db()
+        assert shift.filled_count == 0
+        assert not Delivery.objects.exists()
+
+    def test_busts_available_shifts_cache_on_commit(
+        self, django_capture_on_commit_callbacks
+    ):
+        shift = ShiftFactory()
+        version = Shift.available_shifts_cache_version()
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            with defer_shift_count_updates():
+                DeliveryFactory.create_batch(2, delivery_shift=shift)
+            assert Shift.available_shifts_cache_version() == version
+        assert len(callbacks) == 1
+        assert Shift.available_shifts_cache_version() == version + 1
+
+
+class TestShiftAvailable:
+    def test_single_query(self, django_assert_num_queries):
+        today = datetime.date.today()
+        past = ShiftFactory(date=today - datetime.timedelta(days=1))
+        full = ShiftFactory(date=today, slots_available=1)
+        DeliveryFactory(delivery_shift=full)
+        morning = ShiftFactory(date=today + datetime.timedelta(days=1))
+        evening = ShiftFactory(
+            date=today + datetime.timedelta(days=1), time="PM", slots_available=3
+        )
+        DeliveryFactory.create_batch(2, delivery_shift=evening)
+
+        with django_assert_num_queries(1):
+            assert list(Shift.objects.available()) == [morning, evening]
+        assert list(Shift.objects.available(min_slots=2)) == [morning]
+        assert list(Shift.objects.available(time="PM")) == [evening]
+        assert past in Shift.objects.available(on_or_after=past.date)
@@ -0,0 +1,83 @@
+import json
+import logging
+
+import pytest
+from django.db import connection
+from django.urls import reverse
+
+from delivery.delivery import profiling
+from delivery.delivery.tests.factories import DeliveryFactory, ShiftFactory
+from delivery.delivery.tests.test_clients import mock_http, onfleet_handler
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def enable_profiling(settings):
+    settings.PROFILING_ENABLED = True
+    # the test connection opened before profiling was switched on
+    profiling.install_query_timer(connection)
+    yield
+    connection.execute_wrappers.remove(profiling.time_query)
+
+
+def server_timing(response):
+    timings = {}
+    for entry in response["Server-Timing"].split(", "):
+        name, duration, description = entry.split(";")
+        timings[name] = (float(duration[len("dur=") :]), description)
+    return timings
+
+
+class TestProfilingMiddleware:
+    def test_off_by_default(self, admin_client):
+        response = admin_client.get(reverse("walk-list", args=[ShiftFactory().pk]))
+        assert "Server-Timing" not in response
+        assert profiling.get_samples() == {}
+
+    @pytest.mark.usefixtures("enable_profiling")
+    def test_times_sql_and_templates(self, admin_client, caplog):
+        shift = ShiftFactory()
+        DeliveryFactory(delivery_shift=shift)
+
+        with caplog.at_level(logging.INFO, logger="delivery.delivery.profiling"):
+            response = admin_client.get(reverse("walk-list", args=[shift.pk]))
+
+        timings = server_timing(response)
+        assert {"sql", "template", "total"} <= timings.keys()
+        assert timings["template"] == (timings["template"][0], 'desc="1x"')
+        assert timings["total"][0] >= timings["sql"][0]
+        [log] = [json.loads(r.getMessage()) for r in caplog.records]
+        assert log["view"] == "WalkDetailView"
+        assert log["timings"]["sql"]["count"] > 0
+        [sample] = profiling.get_samples()["WalkDetailView"]
+        assert sample["queries"] == log["timings"]["sql"]["count"]
+
+    @pytest.mark.usefixtures("enable_profiling")
+    def test_times_async_integration_calls(self, admin_client, monkeypatch, settings):
+        settings.ONFLEET_API_KEY = "onfleet-key"
+        settings.ONFLEET_INTEGRATION_API = "https://onfleet.test/v2"
+        delivery = DeliveryFactory()
+        mock_http(monkeypatch, onfleet_handler(delivery.order_number))
+
+        response = admin_client.get(reverse("truck_view_async"))
+
+        timings = server_timing(response)
+        assert timings["onfleet"][1] == 'desc="3x"'
+        # the queries run in sync_to_async threads still count
+        assert "sql" in timings
+        [sample] = profiling.get_samples()["OnfleetTruckAsyncView"]
+        assert sample["onfleet"] > 0
+
+    @pytest.mark.usefixtures("enable_profiling")
+    def test_profiles_page(self, admin_client):
+        shift = ShiftFactory()
+        for _ in range(3):
+            admin_client.get(reverse("walk-list", args=[shift.pk]))
+
+        response = admin_client.get(reverse("request_profiles"))
+
+        [row] = [r for r in response.context["rows"] if r["view"] == "WalkDetailView"]
+        assert row["samples"] == 3
+        assert row["total"]["p95"] >= row["total"]["p50"] > 0
+        assert row["clover"] == {"p50": 0, "p95": 0}
@@ -0,0 +1,180 @@
+import contextlib
+import datetime
+import json
+
+import pytest
+
+from delivery.delivery import graphql, shopify
+
+
+def _line_item(n):
+    return {"node": {"name": f"Tree {n}", "quantity": 1, "currentQuantity": 1}}
+
+
+def _line_items(num_items, after=None):
+    start = int(after) if after else 0
+    end = min(start + shopify._LINE_ITEMS_PAGE_SIZE, num_items)
+    return {
+        "pageInfo": {"hasNextPage": end < num_items, "endCursor": str(end)},
+        "edges": [_line_item(n) for n in range(start, end)],
+    }
+
+
+class FakeGraphQL:
+    """Answers order queries from {online_id: (updated_at, num_items)}."""
+
+    def __init__(self, orders):
+        self.orders = orders
+        self.queries = []
+
+    def __call__(self):
+        return self
+
+    def execute(self, query, variables=None, operation_name=None):
+        self.queries.append((query, variables))
+        if "nodes(ids: $ids)" in query:
+            nodes = []
+            for gid in variables["ids"]:
+                updated_at, num_items = self.orders[gid.rpartition("/")[2]]
+                node = {"updatedAt": updated_at}
+                if "lineItems" in query:
+                    node.update(id=gid, lineItems=_line_items(num_items))
+                nodes.append(node)
+            data = {"nodes": nodes}
+        else:
+            data = {}
+            n = 0
+            while f"id{n}" in variables:
+                _, num_items = self.orders[variables[f"id{n}"].rpartition("/")[2]]
+                data[f"o{n}"] = {
+                    "lineItems": _line_items(num_items, variables[f"after{n}"])
+                }
+                n += 1
+        return json.dumps({"data": data})
+
+
+@pytest.fixture
+def fake_graphql(monkeypatch):
+    graphql = FakeGraphQL({"1": ("2030-01-01", 120), "2": ("2030-01-01", 3)})
+    monkeypatch.setattr(shopify.shopify, "GraphQL", graphql)
+    monkeypatch.setattr(
+        shopify.shopify.Session, "temp", lambda *_: contextlib.nullcontext()
+    )
+    return graphql
+
+
+class TestGetDataByIds:
+    def test_pages_through_line_items(self, fake_graphql):
+        data = shopify.get_data_by_ids(["1", "2"])
+        items = shopify.parse_line_items(data["1"])
+        assert [i["item_name"] for i in items] == [f"Tree {n}" for n in range(120)]
+        assert len(shopify.parse_line_items(data["2"])) == 3
+        # one batch for both orders, then two follow-up pages for the big one
+        assert len(fake_graphql.queries) == 3
+        assert fake_graphql.queries[1][1] == {
+            "id0": "gid://shopify/Order/1",
+            "after0": "50",
+        }
+
+    def test_unchanged_orders_come_from_cache(self, fake_graphql):
+        first = shopify.get_data_by_ids(["1", "2"])
+        fake_graphql.queries.clear()
+
+        assert shopify.get_data_by_ids(["1", "2"]) == first
+        assert len(fake_graphql.queries) == 1
+        assert "lineItems" not in fake_graphql.queries[0][0]
+
+        fake_graphql.orders["2"] = ("2030-01-02", 4)
+        fake_graphql.queries.clear()
+        data = shopify.get_data_by_ids(["1", "2"])
+        assert len(shopify.parse_line_items(data["2"])) == 4
+        assert len(fake_graphql.queries) == 2
+        assert fake_graphql.queries[1][1] == {"ids": ["gid://shopify/Order/2"]}
+
+
+class TestSearchQuery:
+    def test_skips_cancelled_orders(self):
+        assert (
+            shopify._format_search_query("name:1001 OR name:1002")
+            == "(name:1001 OR name:1002) AND -status:cancelled"
+        )
+        assert (
+            shopify._format_search_query("updated_at:>=2030", include_cancelled=True)
+            == "updated_at:>=2030"
+        )
+
+    def test_time_range_query(self, monkeypatch):
+        queries = []
+        monkeypatch.setattr(
+            shopify, "_get_orders_for_query", lambda q, *_: queries.append(q) or []
+        )
+        shopify.get_data_by_time_range(
+            datetime.date(2030, 12, 1), datetime.date(2030, 12, 2)
+        )
+        assert queries == [
+            "created_at:>2030-12-01T00:00:00 AND created_at:<2030-12-02T23:59:59.999999"
+            " AND -status:cancelled"
+        ]
+
+
+class TestQueries:
+    def test_compiled_once_with_variables(self):
+        assert shopify.ORDER_SEARCH_QUERY.text.startswith(
+            "query OrderSearch($query: String!, $first: Int!, $after: String) "
+            "{ orders(query: $query, first: $first, after: $after) "
+            "{ pageInfo { hasNextPage endCursor } edges { node { createdAt name id "
+        )
+        # ids only, when that's all the caller reads
+        assert shopify._ORDER_ID_SEARCH_QUERY.text.endswith("edges { node { id } } } }")
+        assert shopify._compile_line_items_query(2) is (
+            shopify._compile_line_items_query(2)
+        )
+
+    def test_search_pages_with_variables(self, monkeypatch):
+        calls = []
+
+        def execute(query, variables=None, operation_name=None):
+            calls.append((operation_name, variables))
+            after = variables["after"]
+            return json.dumps(
+                {
+                    "data": {
+                        "orders": {
+                            "pageInfo": {
+                                "hasNextPage": after is None,
+                                "endCursor": "c1",
+                            },
+                            "edges": [{"node": {"id": "1" if after else "0"}}],
+                        }
+                    }
+                }
+            )
+
+        monkeypatch.setattr(shopify.shopify.GraphQL, "__init__", lambda self: None)
+        monkeypatch.setattr(
+            shopify.shopify.GraphQL, "execute", lambda _, *a, **k: execute(*a, **k)
+        )
+        monkeypatch.setattr(
+            shopify.shopify.Session, "temp", lambda *_: contextlib.nullcontext()
+        )
+
+        orders = shopify._get_orders_for_query(
+            shopify._format_order_name_query(['1001" OR status:any'])
+        )
+
+        assert orders == [{"id": "0"}, {"id": "1"}]
+        search = r'name:"1001\" OR status:any"'
+        assert calls == [
+            ("OrderSearch", {"after": None, "query": search, "first": 100}),
+            ("OrderSearch", {"after": "c1", "query": search, "first": 100}),
+        ]
+
+    def test_errors_raise(self, monkeypatch):
+        monkeypatch.setattr(shopify.shopify.GraphQL, "__init__", lambda self: None)
+        monkeypatch.setattr(
+            shopify.shopify.GraphQL,
+            "execute",
+            lambda *_, **__: json.dumps({"errors": [{"message": "Throttled"}]}),
+        )
+        with pytest.raises(graphql.GraphQLError, match="Throttled"):
+            shopify._ORDER_UPDATED_AT_QUERY.execute(ids=[])
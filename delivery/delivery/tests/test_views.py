@@ -0,0 +1,386 @@
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+
+import pytest
+import pytz
+from django.urls import reverse
+from django.utils import timezone
+
+from delivery.delivery import actions, views
+from delivery.delivery.actions import CandidateOrder
+from delivery.delivery.models import Delivery, OrderEvent, Shift
+from delivery.delivery.tests.factories import DeliveryFactory, ItemFactory, ShiftFactory
+from delivery.delivery.tests.test_actions import _clover_order
+from delivery.delivery.views import get_new_order_formset_data
+
+pytestmark = pytest.mark.django_db
+
+
+class TestNewOrderFormsetData:
+    def test_single_pass_over_page(self):
+        shift = ShiftFactory()
+        existing = DeliveryFactory(delivery_shift=shift, online_id="123")
+        pending = Delivery(order_number="NEW1", delivery_shift=shift)
+
+        data = get_new_order_formset_data([existing, pending])
+
+        assert data["form-TOTAL_FORMS"] == 2
+        assert data["form-INITIAL_FORMS"] == 2
+        assert data["form-0-id"] == existing.id
+        assert data["form-0-online_id"] == "123"
+        assert data["form-1-id"] is None
+        assert data["form-1-order_number"] == "NEW1"
+        assert data["form-1-delivery_shift"] == shift.id
+
+
+class TestNewOrderView:
+    def test_builds_only_visible_page(self, admin_client, monkeypatch):
+        built = []
+
+        class Row(CandidateOrder):
+            def to_delivery(self):
+                built.append(self.order_number)
+                return super().to_delivery()
+
+        rows = [
+            Row(f"O{n}", datetime.datetime(2022, 11, 1, tzinfo=pytz.UTC))
+            for n in range(150)
+        ]
+        monkeypatch.setattr(views, "search_clover_orders", lambda *_, **__: rows)
+
+        response = admin_client.get(reverse("new_orders"), {"p": 2})
+
+        assert response.status_code == 200
+        assert built == [f"O{n}" for n in range(100, 150)]
+        assert response.context["cl"].formset.total_form_count() == 50
+
+    def test_get_reserves_nothing(self, admin_client, monkeypatch):
+        full = ShiftFactory(slots_available=1)
+        DeliveryFactory(delivery_shift=full)
+        rows = [
+            CandidateOrder(
+                f"O{n}",
+                datetime.datetime(2022, 11, 1, tzinfo=pytz.UTC),
+                delivery_shift_id=full.id,
+            )
+            for n in range(2)
+        ]
+        monkeypatch.setattr(views, "search_clover_orders", lambda *_, **__: rows)
+        reserved = []
+        monkeypatch.setattr(
+            type(Shift.objects), "reserve", lambda *args: reserved.append(args)
+        )
+
+        response = admin_client.get(reverse("new_orders"))
+
+        assert response.status_code == 200
+        assert reserved == []
+        formset = response.context["cl"].formset
+        assert not formset.non_form_errors()
+        assert not any("delivery_shift" in errors for errors in formset.errors)
+        assert "slots remaining" not in response.content.decode()
+
+    def test_moving_cancelled_order_keeps_counts(self, admin_client, monkeypatch):
+        monkeypatch.setattr(views, "search_clover_orders", lambda *_, **__: [])
+        source = ShiftFactory()
+        full = ShiftFactory(slots_available=1)
+        DeliveryFactory(delivery_shift=full)
+        target = ShiftFactory()
+        cancelled = DeliveryFactory(delivery_shift=source, cancelled_at=timezone.now())
+        live = DeliveryFactory(delivery_shift=source)
+        data = {"form-TOTAL_FORMS": 2, "_save": "Save"}
+        for n, (delivery, shift) in enumerate([(cancelled, full), (live, target)]):
+            data.update(
+                {
+                    f"form-{n}-id": delivery.id,
+                    f"form-{n}-order_number": delivery.order_number,
+                    f"form-{n}-delivery_shift": shift.id,
+                    f"form-{n}-recipient_phone_number": "",
+                    f"form-{n}-online_id": "",
+                }
+            )
+
+        response = admin_client.post(reverse("new_orders"), data)
+
+        assert response.status_code == 200
+        cancelled.refresh_from_db()
+        assert cancelled.delivery_shift == full
+        assert {
+            s.pk: s.filled_count
+            for s in Shift.objects.filter(pk__in=[source.pk, full.pk, target.pk])
+        } == {source.pk: 0, full.pk: 1, target.pk: 1}
+
+    def test_locks_all_shifts_before_reserving(self, admin_client, monkeypatch):
+        monkeypatch.setattr(views, "search_clover_orders", lambda *_, **__: [])
+        source, target, other = ShiftFactory(), ShiftFactory(), ShiftFactory()
+        moved = DeliveryFactory(delivery_shift=source)
+        calls = []
+        manager = type(Shift.objects)
+        lock, reserve = manager.lock, manager.reserve
+        monkeypatch.setattr(
+            manager,
+            "lock",
+            lambda self, ids: calls.append(("lock", set(ids))) or lock(self, ids),
+        )
+        monkeypatch.setattr(
+            manager,
+            "reserve",
+            lambda self, pk, count=1: calls.append(("reserve", pk))
+            or reserve(self, pk, count),
+        )
+        data = {"form-TOTAL_FORMS": 2, "_save": "Save"}
+        for n, (pk, order_number, shift) in enumerate(
+            [(moved.id, moved.order_number, target), ("", "NEW1", other)]
+        ):
+            data.update(
+                {
+                    f"form-{n}-id": pk,
+                    f"form-{n}-order_number": order_number,
+                    f"form-{n}-delivery_shift": shift.id,
+                    f"form-{n}-recipient_phone_number": "",
+                    f"form-{n}-online_id": "",
+                }
+            )
+        monkeypatch.setattr(actions, "sync_deliveries", lambda d, **_: [])
+
+        response = admin_client.post(reverse("new_orders"), data)
+
+        assert response.status_code == 200
+        assert calls[0] == ("lock", {source.id, target.id, other.id})
+        assert [name for name, _ in calls].count("lock") == 1
+        assert Delivery.objects.filter(order_number="NEW1").exists()
+
+
+class TestOrderSheetsView:
+    def test_shift_sheets(self, admin_client, django_assert_max_num_queries):
+        shift = ShiftFactory()
+        for delivery in DeliveryFactory.create_batch(30, delivery_shift=shift):
+            ItemFactory(delivery=delivery, item_name=f"Tree for {delivery.id}")
+        other = ItemFactory(
+            item_name="Other shift tree", delivery__recipient_last_name="Outsider"
+        ).delivery
+
+        with django_assert_max_num_queries(6):
+            response = admin_client.get(reverse("order-sheets"), {"shift": shift.id})
+
+        assert response.status_code == 200
+        assert len(response.context["object_list"]) == 30
+        content = response.content.decode()
+        assert content.count('class="order-sheet"') == 30
+        assert content.count("<div") == content.count("</div>")
+        assert "Other shift tree" not in content
+        assert other.recipient_last_name not in content
+
+    def test_ids(self, admin_client):
+        deliveries = DeliveryFactory.create_batch(3)
+        ids = ",".join(str(d.id) for d in deliveries[:2])
+
+        response = admin_client.get(reverse("order-sheets"), {"ids": ids})
+
+        assert response.status_code == 200
+        assert {d.id for d in response.context["object_list"]} == {
+            d.id for d in deliveries[:2]
+        }
+
+    def test_requires_filter(self, admin_client):
+        assert admin_client.get(reverse("order-sheets")).status_code == 404
+
+
+class TestAvailableShiftsView:
+    def test_json(self, client):
+        today = datetime.date.today()
+        shift = ShiftFactory(date=today, time="PM", slots_available=5)
+        DeliveryFactory(delivery_shift=shift)
+        ShiftFactory(date=today - datetime.timedelta(days=1))
+
+        response = client.get(reverse("available-shifts"), {"limit": 10})
+
+        assert response.status_code == 200
+        assert response.json() == {
+            "shifts": [
+                {
+                    "id": shift.id,
+                    "date": today.isoformat(),
+                    "time": "PM",
+                    "slots_remaining": 4,
+                }
+            ]
+        }
+        assert "max-age=30" in response["Cache-Control"]
+
+    def test_booking_busts_cache(self, client, django_capture_on_commit_callbacks):
+        shift = ShiftFactory(date=datetime.date.today(), slots_available=2)
+        url = reverse("available-shifts")
+        assert client.get(url).json()["shifts"][0]["slots_remaining"] == 2
+        with django_capture_on_commit_callbacks(execute=True):
+            DeliveryFactory(delivery_shift=shift)
+        assert client.get(url).json()["shifts"][0]["slots_remaining"] == 1
+
+    @pytest.mark.parametrize(
+        "params",
+        [
+            {"min_slots": "x"},
+            {"min_slots": "-1"},
+            {"min_slots": "0"},
+            {"min_slots": "9" * 30},
+            {"time": "XX"},
+            {"date": "9" * 30},
+        ],
+    )
+    def test_bad_params(self, client, params):
+        response = client.get(reverse("available-shifts"), params)
+        assert response.status_code == 400
+
+    def test_cache_key_ignores_query_spelling(self, client, monkeypatch):
+        ShiftFactory(date=datetime.date.today(), time="AM")
+        keys = []
+        set_cache = views.cache.set
+        monkeypatch.setattr(
+            views.cache,
+            "set",
+            lambda key, *args: keys.append(key) or set_cache(key, *args),
+        )
+        url = reverse("available-shifts")
+
+        client.get(url, {"time": "AM", "min_slots": "1"})
+        client.get(url, {"min_slots": "01", "time": "AM", "junk": "1"})
+        client.get(f"{url}?time=AM&time=AM&x=2")
+
+        assert len(keys) == 1
+
+
+@pytest.fixture
+def webhook_settings(settings):
+    settings.SHOPIFY_WEBHOOK_SECRET = "shopify-secret"
+    settings.CLOVER_WEBHOOK_AUTH_CODE = "clover-code"
+    settings.CLOVER_MERCHANT_ID = "MID"
+    return settings
+
+
+def post_shopify(client, payload, topic="orders/updated", secret="shopify-secret"):
+    body = json.dumps(payload).encode()
+    signature = base64.b64encode(
+        hmac.new(secret.encode(), body, hashlib.sha256).digest()
+    ).decode()
+    return client.post(
+        reverse("shopify-webhook"),
+        body,
+        content_type="application/json",
+        HTTP_X_SHOPIFY_HMAC_SHA256=signature,
+        HTTP_X_SHOPIFY_TOPIC=topic,
+    )
+
+
+def post_clover(client, payload, auth="clover-code"):
+    return client.post(
+        reverse("clover-webhook"),
+        json.dumps(payload),
+        content_type="application/json",
+        HTTP_X_CLOVER_AUTH=auth,
+    )
+
+
+@pytest.mark.usefixtures("webhook_settings")
+class TestWebhooks:
+    def test_shopify_rejects_bad_signature(self, client):
+        response = post_shopify(client, {"id": 1, "name": "#1001"}, secret="wrong")
+        assert response.status_code == 401
+        assert not OrderEvent.objects.exists()
+
+    def test_shopify_queues_event(
+        self, client, monkeypatch, django_capture_on_commit_callbacks
+    ):
+        synced = []
+        monkeypatch.setattr(
+            actions, "sync_deliveries", lambda d, **_: synced.extend(d) or []
+        )
+        delivery = DeliveryFactory(online_id="42")
+
+        with django_capture_on_commit_callbacks(execute=True):
+            post_shopify(client, {"id": 42, "name": "#1001"})
+            # a burst of updates for the same order share one pending event
+            response = post_shopify(client, {"id": 42, "name": "#1001"})
+
+        assert response.status_code == 200
+        event = OrderEvent.objects.get()
+        assert (event.source, event.remote_id) == (OrderEvent.SHOPIFY, "42")
+        # the webhook answers without syncing; the cron does that
+        assert event.processed_at is None
+        assert synced == []
+
+        assert actions.process_order_events() == 1
+        event.refresh_from_db()
+        assert event.processed_at is not None
+        assert synced == [delivery]
+
+    def test_shopify_ignores_other_topics(self, client):
+        response = post_shopify(client, {"id": 1}, topic="products/update")
+        assert response.status_code == 200
+        assert not OrderEvent.objects.exists()
+
+    def test_clover_rejects_bad_auth(self, client):
+        payload = {"merchants": {"MID": [{"objectId": "O:ABC", "type": "UPDATE"}]}}
+        assert post_clover(client, payload, auth="wrong").status_code == 401
+        assert not OrderEvent.objects.exists()
+
+    def test_clover_verification(self, client, caplog):
+        response = post_clover(client, {"verificationCode": "abc"}, auth="")
+        assert response.status_code == 200
+        assert "verification code: abc" in caplog.text
+
+    def test_clover_rejects_malformed_body(self, client):
+        response = client.post(
+            reverse("clover-webhook"), "{not json", content_type="application/json"
+        )
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize("order_number", ["ORDER1", "order1"])
+    def test_clover_syncs_order(
+        self, client, monkeypatch, django_capture_on_commit_callbacks, order_number
+    ):
+        delivery = DeliveryFactory(
+            online_id=None, recipient_last_name=None, order_number=order_number
+        )
+        monkeypatch.setattr(
+            actions,
+            "request_clover_orders",
+            lambda order_number=None, **_: _clover_order(order_number),
+        )
+        payload = {
+            "merchants": {
+                "MID": [
+                    {"objectId": "O:ORDER1", "type": "UPDATE"},
+                    {"objectId": "I:ITEM", "type": "UPDATE"},
+                ]
+            }
+        }
+
+        with django_capture_on_commit_callbacks(execute=True):
+            assert post_clover(client, payload).status_code == 200
+        assert actions.process_order_events() == 1
+
+        delivery.refresh_from_db()
+        assert delivery.recipient_last_name == "Lee"
+        assert OrderEvent.objects.get().processed_at is not None
+
+    def test_failed_sync_stays_pending(self, client, admin_client, monkeypatch):
+        DeliveryFactory(online_id="42")
+
+        def fail(*_, **__):
+            raise ConnectionError
+
+        monkeypatch.setattr(actions, "sync_deliveries", fail)
+        post_shopify(client, {"id": 42, "name": "#1001"})
+        with pytest.raises(ConnectionError):
+            actions.process_order_events()
+        assert OrderEvent.objects.get().processed_at is None
+
+        monkeypatch.setattr(actions, "sync_deliveries", lambda d, **_: [])
+        process_url = reverse("process-order-events")
+        assert client.get(process_url).status_code == 403
+        response = client.get(process_url, HTTP_X_APPENGINE_CRON="true")
+        assert response.json() == {"processed": 1}
+        assert admin_client.get(process_url).json() == {"processed": 0}
@@ -2,21 +2,52 @@ from django.contrib import admin
 from django.urls import path
 
 from .views import (
+    AvailableShiftsView,
+    CloverWebhookView,
     CreateOnfleetOrderView,
     CreateOnfleetShiftView,
+    NewOrderAsyncView,
     NewOrderView,
+    OnfleetTruckAsyncView,
     OnfleetTruckView,
+    OnfleetWebhookView,
     OrderDetailView,
+    OrderSheetsView,
+    ProcessOrderEventsView,
+    RequestProfilesView,
+    ShopifyReconciliationAsyncView,
     ShopifyReconciliationView,
+    ShopifyWebhookView,
+    TruckBoardView,
     WalkDetailView,
 )
 
 urlpatterns = [
     path("shift/<int:pk>/walk", WalkDetailView.as_view(), name="walk-list"),
     path("shift/<int:pk>/onfleet", CreateOnfleetShiftView, name="onfleet-shift"),
+    path("shifts/available", AvailableShiftsView, name="available-shifts"),
     path("deliveries/<int:pk>/sheet", OrderDetailView.as_view(), name="order-sheet"),
+    path("deliveries/sheets", OrderSheetsView.as_view(), name="order-sheets"),
     path("deliveries/<int:pk>/onfleet", CreateOnfleetOrderView, name="onfleet-order"),
     path("trucks", OnfleetTruckView, name="truck_view"),
+    path("trucks/live", TruckBoardView, name="truck_board"),
     path("deliveries/shopify", ShopifyReconciliationView, name="shopify_view"),
     path("orders/new", admin.site.admin_view(NewOrderView), name="new_orders"),
+    path(
+        "profiling",
+        admin.site.admin_view(RequestProfilesView),
+        name="request_profiles",
+    ),
+    # async variants of the integration-heavy pages, for the ASGI deployment
+    path("async/trucks", OnfleetTruckAsyncView, name="truck_view_async"),
+    path(
+        "async/deliveries/shopify",
+        ShopifyReconciliationAsyncView,
+        name="shopify_view_async",
+    ),
+    path("async/orders/new", NewOrderAsyncView, name="new_orders_async"),
+    path("webhooks/shopify", ShopifyWebhookView, name="shopify-webhook"),
+    path("webhooks/clover", CloverWebhookView, name="clover-webhook"),
+    path("webhooks/onfleet", OnfleetWebhookView, name="onfleet-webhook"),
+    path("webhooks/process", ProcessOrderEventsView, name="process-order-events"),
 ]
@@ -1,43 +1,79 @@
 # from django.shortcuts import render
+import asyncio
 import dataclasses
 import datetime
+import functools
+import json
+import logging
 import os
 import re
 import traceback
+from collections import Counter
 from distutils.util import strtobool
-from typing import Dict
+from typing import Dict, Optional, Sequence, Tuple
 from urllib.parse import urlencode
 
+from asgiref.sync import sync_to_async
 from dateutil.parser import parse
 from django.conf import settings
+from django.contrib import messages
 from django.contrib.admin import SimpleListFilter
 from django.contrib.admin import site as admin_site
 from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import cache
 from django.core.paginator import Paginator
+from django.db import transaction
 from django.db.models.functions import Upper
-from django.http import HttpResponse, HttpResponseNotFound
+from django.forms import BaseModelFormSet
+from django.http import Http404, HttpResponse, HttpResponseNotFound, JsonResponse
 from django.shortcuts import render
 from django.template.defaulttags import register
 from django.template.response import TemplateResponse
 from django.urls import reverse
+from django.utils.cache import add_never_cache_headers, patch_response_headers
 from django.utils.encoding import force_str
 from django.utils.safestring import mark_safe
-from django.views.decorators.http import require_POST
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 from django.views.generic.detail import DetailView
+from django.views.generic.list import ListView
 
 from .actions import (
+    CandidateOrder,
+    create_and_sync_deliveries,
     create_onfleet_task_from_order,
     create_onfleet_tasks_from_shift,
     get_onfleet_trucks,
+    get_onfleet_trucks_async,
+    process_order_events,
+    queue_order_event,
+    reserve_shift_slots,
     search_clover_orders,
+    search_clover_orders_async,
 )
 from .admin import DeliveryAdmin
-from .clover import parse_shopify_order_number, search_clover_by_dates
-from .models import Delivery, Shift
-from .shopify import ShopifyOrderInfo
+from .clients import CloverClient, ShopifyClient
+from .clover import (
+    parse_shopify_order_number,
+    parse_webhook_order_ids,
+    search_clover_by_dates,
+)
+from .clover import verify_webhook as verify_clover_webhook
+from .live import new_order_poller, truck_board
+from .models import Delivery, OrderEvent, Shift, ShiftFullError
+from .onfleet import TRUCK_BOARD_TRIGGERS, is_webhook_check
+from .onfleet import verify_webhook as verify_onfleet_webhook
+from .profiling import PROFILED_COMPONENTS, get_samples, summarize
+from .shopify import ShopifyOrderInfo, forget_order_info
 from .shopify import get_data_by_time_range as get_shopify_data_by_time_range
+from .shopify import parse_orders as parse_shopify_orders
+from .shopify import time_range_search
+from .shopify import verify_webhook as verify_shopify_webhook
+
+logger = logging.getLogger(__name__)
 
 
 @register.filter(name="lookup")
@@ -52,7 +88,181 @@ class WalkDetailView(LoginRequiredMixin, DetailView):
 
 class OrderDetailView(LoginRequiredMixin, DetailView):
     template_name = "delivery/order.html"
-    model = Delivery
+    queryset = Delivery.objects.select_related("delivery_shift")
+
+
+class OrderSheetsView(LoginRequiredMixin, ListView):
+    template_name = "delivery/sheets.html"
+
+    def get_queryset(self):
+        queryset = Delivery.objects.select_related("delivery_shift").prefetch_related(
+            "item_set"
+        )
+        shift_id = self.request.GET.get("shift")
+        ids = [
+            i
+            for value in self.request.GET.getlist("ids")
+            for i in value.split(",")
+            if i
+        ]
+        try:
+            if shift_id:
+                queryset = queryset.filter(
+                    delivery_shift_id=int(shift_id), cancelled_at=None
+                )
+            elif ids:
+                queryset = queryset.filter(pk__in=[int(i) for i in ids])
+            else:
+                raise Http404("Specify a shift or delivery ids.")
+        except ValueError:
+            raise Http404("Invalid shift or delivery ids.")
+        return queryset.order_by(
+            "delivery_shift__date", "delivery_shift__time", "recipient_last_name"
+        )
+
+
+AVAILABLE_SHIFTS_CACHE_TIMEOUT = 30
+AVAILABLE_SHIFTS_MAX_LIMIT = 100
+# slots_available is a smallint
+AVAILABLE_SHIFTS_MAX_MIN_SLOTS = 32767
+SHIFT_TIMES = {time for time, _ in Shift._meta.get_field("time").choices}
+
+
+def get_available_shifts_params(
+    params,
+) -> Tuple[Optional[datetime.date], int, Optional[str], int]:
+    try:
+        on_or_after = parse(params["date"]).date() if params.get("date") else None
+    except OverflowError as exc:
+        raise ValueError(str(exc))
+    min_slots = int(params.get("min_slots", 1))
+    if not 1 <= min_slots <= AVAILABLE_SHIFTS_MAX_MIN_SLOTS:
+        raise ValueError(
+            f"min_slots must be between 1 and {AVAILABLE_SHIFTS_MAX_MIN_SLOTS}"
+        )
+    time = params.get("time") or None
+    if time is not None and time not in SHIFT_TIMES:
+        raise ValueError(f"time must be one of {', '.join(sorted(SHIFT_TIMES))}")
+    limit = int(params.get("limit", AVAILABLE_SHIFTS_MAX_LIMIT))
+    limit = max(0, min(limit, AVAILABLE_SHIFTS_MAX_LIMIT))
+    return on_or_after, min_slots, time, limit
+
+
+@require_GET
+def AvailableShiftsView(request):
+    try:
+        on_or_after, min_slots, time, limit = get_available_shifts_params(request.GET)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    # keyed by the parsed values, so reordered or unknown parameters share
+    # an entry rather than each adding one
+    cache_key = "available_shifts:{version}:{date}:{min_slots}:{time}:{limit}".format(
+        version=Shift.available_shifts_cache_version(),
+        date=on_or_after.isoformat() if on_or_after else "",
+        min_slots=min_slots,
+        time=time or "",
+        limit=limit,
+    )
+    data = cache.get(cache_key)
+    if data is None:
+        shifts = Shift.objects.available(
+            on_or_after=on_or_after,
+            min_slots=min_slots,
+            time=time,
+        ).values("id", "date", "time", "slots_available", "filled_count")[:limit]
+        data = {
+            "shifts": [
+                {
+                    "id": shift["id"],
+                    "date": shift["date"].isoformat(),
+                    "time": shift["time"],
+                    "slots_remaining": shift["slots_available"] - shift["filled_count"],
+                }
+                for shift in shifts
+            ]
+        }
+        # busted by Shift.bust_available_shifts_cache once bookings commit
+        cache.set(cache_key, data, AVAILABLE_SHIFTS_CACHE_TIMEOUT)
+    response = JsonResponse(data)
+    patch_response_headers(response, AVAILABLE_SHIFTS_CACHE_TIMEOUT)
+    return response
+
+
+SHOPIFY_WEBHOOK_TOPICS = ("orders/create", "orders/updated", "orders/cancelled")
+
+
+@csrf_exempt
+@require_POST
+def ShopifyWebhookView(request):
+    if not verify_shopify_webhook(
+        request.body, request.headers.get("X-Shopify-Hmac-Sha256", "")
+    ):
+        return HttpResponse(status=401)
+    topic = request.headers.get("X-Shopify-Topic", "")
+    if topic in SHOPIFY_WEBHOOK_TOPICS:
+        payload = json.loads(request.body)
+        forget_order_info(payload.get("name", ""))
+        queue_order_event(OrderEvent.SHOPIFY, str(payload["id"]), topic)
+        transaction.on_commit(new_order_poller.wake)
+    return HttpResponse()
+
+
+@csrf_exempt
+@require_POST
+def CloverWebhookView(request):
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return HttpResponse(status=400)
+    if not isinstance(payload, dict):
+        return HttpResponse(status=400)
+    if "verificationCode" in payload:
+        # sent once when the webhook url is registered; enter it in the
+        # clover dashboard to finish setup
+        logger.warning(
+            "Clover webhook verification code: %s", payload["verificationCode"]
+        )
+        return HttpResponse()
+    if not verify_clover_webhook(request.headers.get("X-Clover-Auth", "")):
+        return HttpResponse(status=401)
+    for order_id, topic in parse_webhook_order_ids(payload):
+        queue_order_event(OrderEvent.CLOVER, order_id, topic)
+    transaction.on_commit(new_order_poller.wake)
+    return HttpResponse()
+
+
+@csrf_exempt
+def OnfleetWebhookView(request):
+    if request.method == "GET":
+        # onfleet checks a new webhook url by having it echo this back;
+        # plain text and token-shaped only, so nothing else is reflected
+        check = request.GET.get("check", "")
+        if not is_webhook_check(check):
+            return HttpResponse(status=400)
+        return HttpResponse(check, content_type="text/plain")
+    if request.method != "POST":
+        return HttpResponse(status=405)
+    if not verify_onfleet_webhook(
+        request.body, request.headers.get("X-Onfleet-Signature", "")
+    ):
+        return HttpResponse(status=401)
+    payload = json.loads(request.body)
+    task = (payload.get("data") or {}).get("task")
+    if payload.get("triggerName") in TRUCK_BOARD_TRIGGERS and task:
+        # only reaches boards served by this process; the others catch up
+        # on their next poll
+        truck_board.call_soon(truck_board.apply_task, task)
+    return HttpResponse()
+
+
+@require_GET
+def ProcessOrderEventsView(request):
+    # App Engine strips X-Appengine-Cron from outside requests
+    if request.headers.get("X-Appengine-Cron") != "true" and not (
+        request.user.is_authenticated and request.user.is_staff
+    ):
+        return HttpResponse(status=403)
+    return JsonResponse({"processed": process_order_events()})
 
 
 @require_POST
@@ -83,13 +293,57 @@ def CreateOnfleetShiftView(request, pk):
     return HttpResponse(status=200)
 
 
+def async_login_required(view=None, staff=False):
+    """
+    login_required (or staff_member_required, with staff=True) for async
+    views, which Django's decorators don't support yet. Also opts the view out
+    of ATOMIC_REQUESTS, which can't wrap an async view.
+    """
+    if view is None:
+        return functools.partial(async_login_required, staff=staff)
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # request.user is lazy and queries the database on first access
+        def has_access():
+            return request.user.is_authenticated and (
+                request.user.is_staff or not staff
+            )
+
+        if not await sync_to_async(has_access)():
+            login_url = reverse("admin:login") if staff else None
+            return redirect_to_login(request.get_full_path(), login_url)
+        return await view(request, *args, **kwargs)
+
+    return transaction.non_atomic_requests(wrapper)
+
+
 @login_required
 def OnfleetTruckView(request):
     try:
-        teams, workers, tasks = get_onfleet_trucks()
+        trucks = get_onfleet_trucks()
     except Exception as exc:
         traceback.print_exc()
         return HttpResponse(str(exc), status=500)
+    return _render_trucks(request, *trucks)
+
+
+@async_login_required
+async def OnfleetTruckAsyncView(request):
+    try:
+        trucks = await get_onfleet_trucks_async()
+    except Exception as exc:
+        traceback.print_exc()
+        return HttpResponse(str(exc), status=500)
+    return await sync_to_async(_render_trucks)(request, *trucks)
+
+
+@login_required
+def TruckBoardView(request):
+    return render(request, "delivery/truck_board.html")
+
+
+def _render_trucks(request, teams, workers, tasks):
     if tasks is None or not tasks:
         return HttpResponse("No deliveries found.")
     return render(
@@ -103,10 +357,54 @@ def OnfleetTruckView(request):
     )
 
 
+def RequestProfilesView(request):
+    rows = [
+        {"view": view, "samples": len(samples), **summarize(samples)}
+        for view, samples in get_samples().items()
+    ]
+    context = {
+        **admin_site.each_context(request),
+        "title": "Request Profiles",
+        "enabled": settings.PROFILING_ENABLED,
+        "components": PROFILED_COMPONENTS,
+        "rows": sorted(rows, key=lambda r: r["total"]["p95"] or 0, reverse=True),
+    }
+    return TemplateResponse(request, "admin/request_profiles.html", context)
+
+
+RECONCILIATION_START_DATE = datetime.date(2021, 11, 17)
+RECONCILIATION_END_DATE = datetime.date(2021, 12, 17)
+
+
 @login_required
 def ShopifyReconciliationView(request):
-    START_DATE = datetime.date(2021, 11, 17)
+    # get from Shopify
+    orders = get_shopify_data_by_time_range(
+        RECONCILIATION_START_DATE, delivery_only=True
+    )
+    clover_orders = search_clover_by_dates(
+        RECONCILIATION_START_DATE, end_date=RECONCILIATION_END_DATE
+    )
+    return _render_reconciliation(request, orders, clover_orders)
+
+
+@async_login_required
+async def ShopifyReconciliationAsyncView(request):
+    shopify_data, clover_orders = await asyncio.gather(
+        ShopifyClient().search_orders(time_range_search(RECONCILIATION_START_DATE)),
+        CloverClient().search_by_dates(
+            RECONCILIATION_START_DATE, end_date=RECONCILIATION_END_DATE
+        ),
+    )
+
+    def render_sync():
+        orders = parse_shopify_orders(shopify_data, delivery_only=True)
+        return _render_reconciliation(request, orders, clover_orders)
+
+    return await sync_to_async(render_sync)()
+
 
+def _render_reconciliation(request, orders, clover_orders):
     def _is_existing(o: ShopifyOrderInfo) -> bool:
         try:
             Delivery.objects.get(online_id=o.online_id)
@@ -124,14 +422,9 @@ def ShopifyReconciliationView(request):
             pass
         return False
 
-    # get from Shopify
-    orders = get_shopify_data_by_time_range(START_DATE, delivery_only=True)
     missing_orders = [dataclasses.asdict(o) for o in orders if not _is_existing(o)]
 
     # match to Clover
-    clover_orders = search_clover_by_dates(
-        START_DATE, end_date=datetime.date(2021, 12, 17)
-    )
     map_by_name = {}
     for o in clover_orders:
         shopify_name = parse_shopify_order_number(o)
@@ -165,27 +458,62 @@ def ShopifyReconciliationView(request):
     )
 
 
+# (form field, Delivery attribute) pairs for the editable New Order columns
+NEW_ORDER_FORM_FIELDS = (
+    ("id", "id"),
+    ("order_number", "order_number"),
+    ("delivery_shift", "delivery_shift_id"),
+    ("recipient_phone_number", "recipient_phone_number"),
+    ("online_id", "online_id"),
+)
+
+
+def get_new_order_search_params(params) -> Tuple[datetime.date, bool]:
+    include_processed = strtobool(params.get("include_processed", "False"))
+    try:
+        start_date = parse(params.get("date", "")).date()
+    except ValueError:
+        start_date = datetime.date.today()
+    return start_date, include_processed
+
+
 class NewOrderChangeList(ChangeList):
+    def __init__(self, *args, rows: Optional[Sequence[CandidateOrder]] = None):
+        # rows searched ahead of time, e.g. by the async view
+        self.rows = rows
+        super().__init__(*args)
+
     def get_results(self, request):
-        params = self.get_filters_params()
-        include_processed = strtobool(params.get("include_processed", "False"))
-        try:
-            start_date = parse(params.get("date", "")).date()
-        except ValueError:
-            start_date = datetime.date.today()
-        result_list = search_clover_orders(
-            start_date, include_processed=include_processed
-        )
-        result_count = len(result_list)
+        rows = self.rows
+        if rows is None:
+            start_date, include_processed = get_new_order_search_params(
+                self.get_filters_params()
+            )
+            rows = search_clover_orders(start_date, include_processed=include_processed)
+        paginator = Paginator(rows, self.list_per_page)
+        # only the visible page is built into Delivery instances
+        page = paginator.get_page(self.page_num)
 
-        self.result_count = result_count
+        self.result_count = paginator.count
         self.show_full_result_count = False
         self.show_admin_actions = False
         self.full_result_count = True
-        self.result_list = result_list
+        self.result_list = [row.to_delivery() for row in page.object_list]
         self.can_show_all = False
-        self.multi_page = None
-        self.paginator = Paginator(result_list, 100)
+        self.multi_page = paginator.num_pages > 1
+        self.paginator = paginator
+        self.page_num = page.number
+
+
+def get_new_order_formset_data(deliveries: Sequence[Delivery]) -> Dict:
+    data: Dict = {
+        "form-TOTAL_FORMS": len(deliveries),
+        "form-INITIAL_FORMS": len(deliveries),
+    }
+    for n, delivery in enumerate(deliveries):
+        for field, attr in NEW_ORDER_FORM_FIELDS:
+            data[f"form-{n}-{field}"] = getattr(delivery, attr, None)
+    return data
 
 
 class NewOrderProcessedFilter(SimpleListFilter):
@@ -272,11 +600,18 @@ class NewOrderAdmin(DeliveryAdmin):
             "admin/js/calendar.js",
             "admin/js/SelectBox.js",
             "js/FilterDateTimeShortcuts.js",
+            "js/live_orders.js",
         ]
         css = {
             "all": ["css/new_order_admin_hide_columns.css"],
         }
 
+    def get_changelist_formset(self, request, **kwargs):
+        # the formset only renders the candidate rows, so it must not lock
+        # shifts; _save_new_orders reserves slots for what it saves
+        kwargs.setdefault("formset", BaseModelFormSet)
+        return super().get_changelist_formset(request, **kwargs)
+
     def action(self, obj):
         classes = ["button"]
         target = "_blank"
@@ -317,63 +652,99 @@ class NewOrderAdmin(DeliveryAdmin):
 @login_required
 def NewOrderView(request):
     model_admin = NewOrderAdmin(Delivery, admin_site)
+    if request.method == "POST" and "_save" in request.POST:
+        _save_new_orders(request, model_admin)
+    _set_new_order_defaults(request)
+    return _new_order_response(request, model_admin)
 
-    FormSet = model_admin.get_changelist_formset(request)
 
+@async_login_required(staff=True)
+async def NewOrderAsyncView(request):
+    model_admin = NewOrderAdmin(Delivery, admin_site)
     if request.method == "POST" and "_save" in request.POST:
-        prefix = FormSet.get_default_prefix()
-        num_forms = int(request.POST.get(f"{prefix}-TOTAL_FORMS", 0))
-        objects: Dict[int, Dict[str, str]] = {i: {} for i in range(num_forms)}
-        pk_pattern = re.compile(
-            r"{}-(?P<num>\d+)-(?P<field>\w+)$".format(
-                re.escape(FormSet.get_default_prefix())
-            )
-        )
-        for key, value in request.POST.items():
-            match = pk_pattern.match(key)
-            if match:
-                num = int(match["num"])
-                field = match["field"]
-                objects[num][field] = value
-
-        existing_deliveries = Delivery.objects.in_bulk(
-            list(filter(None, [o["id"] for o in objects.values()]))
+        await sync_to_async(_save_new_orders)(request, model_admin)
+    _set_new_order_defaults(request)
+    start_date, include_processed = get_new_order_search_params(request.GET)
+    rows = await search_clover_orders_async(
+        start_date, include_processed=include_processed
+    )
+    return await sync_to_async(_new_order_response)(request, model_admin, rows)
+
+
+def _save_new_orders(request, model_admin):
+    FormSet = model_admin.get_changelist_formset(request)
+    prefix = FormSet.get_default_prefix()
+    num_forms = int(request.POST.get(f"{prefix}-TOTAL_FORMS", 0))
+    objects: Dict[int, Dict[str, str]] = {i: {} for i in range(num_forms)}
+    pk_pattern = re.compile(
+        r"{}-(?P<num>\d+)-(?P<field>\w+)$".format(
+            re.escape(FormSet.get_default_prefix())
         )
+    )
+    for key, value in request.POST.items():
+        match = pk_pattern.match(key)
+        if match:
+            num = int(match["num"])
+            field = match["field"]
+            objects[num][field] = value
+
+    existing_deliveries = Delivery.objects.in_bulk(
+        list(filter(None, [o["id"] for o in objects.values()]))
+    )
 
-        for obj in objects.values():
-            pk = obj["id"]
-            order_number = obj["order_number"]
-            if not obj["delivery_shift"] or not order_number:
+    changed_deliveries = []
+    moved_deliveries = []
+    shift_deltas: Counter[Optional[int]] = Counter()
+    new_deliveries = []
+    for obj in objects.values():
+        pk = obj["id"]
+        order_number = obj["order_number"]
+        if not obj["delivery_shift"] or not order_number:
+            continue
+        delivery_shift_id = int(obj["delivery_shift"])
+        if pk:
+            delivery = existing_deliveries[int(pk)]
+            if (
+                delivery.order_number == order_number
+                and delivery.delivery_shift_id == delivery_shift_id
+            ):
                 continue
-            delivery_shift_id = obj["delivery_shift"]
-            if pk:
-                delivery = existing_deliveries[int(pk)]
-                if (
-                    delivery.order_number == order_number
-                    and delivery.delivery_shift_id == delivery_shift_id
-                ):
-                    continue
-                delivery.order_number = order_number
-                delivery.delivery_shift_id = delivery_shift_id
-            else:
-                try:
-                    # check to see if processed by the time the button was hit
-                    Delivery.objects.get(order_number=order_number)
-                    continue
-                except Delivery.DoesNotExist:
-                    pass
-                recipient_phone_number = obj["recipient_phone_number"] or None
-                online_id = obj["online_id"] or None
-                delivery = Delivery(
+            # cancelled orders hold no slot, so moving one takes none either
+            counted_shift_id = delivery.counted_shift_id
+            delivery.order_number = order_number
+            delivery.delivery_shift_id = delivery_shift_id
+            if delivery.counted_shift_id != counted_shift_id:
+                shift_deltas[counted_shift_id] -= 1
+                shift_deltas[delivery.counted_shift_id] += 1
+                moved_deliveries.append(delivery)
+            changed_deliveries.append(delivery)
+        else:
+            new_deliveries.append(
+                Delivery(
                     order_number=order_number,
                     delivery_shift_id=delivery_shift_id,
-                    recipient_phone_number=recipient_phone_number,
-                    online_id=online_id,
+                    recipient_phone_number=obj["recipient_phone_number"] or None,
+                    online_id=obj["online_id"] or None,
                 )
-                delivery.save()
-                delivery.sync()
-            delivery.save()
+            )
 
+    try:
+        with transaction.atomic():
+            Shift.objects.lock(
+                [*shift_deltas, *(d.delivery_shift_id for d in new_deliveries)]
+            )
+            if changed_deliveries:
+                reserve_shift_slots(moved_deliveries)
+                Delivery.objects.bulk_update(
+                    changed_deliveries, ["order_number", "delivery_shift"]
+                )
+                Shift.objects.adjust_filled_counts(shift_deltas)
+            create_and_sync_deliveries(new_deliveries)
+    except ShiftFullError as exc:
+        messages.error(request, f"Orders not saved: {exc}")
+
+
+def _set_new_order_defaults(request):
     if "include_processed" not in request.GET:
         q = request.GET.copy()
         q["include_processed"] = "False"
@@ -385,6 +756,9 @@ def NewOrderView(request):
         request.GET = q
         request.META["QUERY_STRING"] = request.GET.urlencode()
 
+
+def _new_order_response(request, model_admin, rows=None):
+    FormSet = model_admin.get_changelist_formset(request)
     cl = NewOrderChangeList(
         request,
         Delivery,
@@ -400,35 +774,11 @@ def NewOrderView(request):
         model_admin,
         model_admin.sortable_by,
         "Search for new orders",  # search help text
+        rows=rows,
     )
 
     cl.formset = FormSet(  # pylint: disable=attribute-defined-outside-init
-        data={
-            "form-TOTAL_FORMS": len(cl.result_list),
-            "form-INITIAL_FORMS": len(cl.result_list),
-            **{
-                f"form-{n}-id": getattr(o, "id", None)
-                for n, o in enumerate(cl.result_list)
-            },
-            **{
-                f"form-{n}-order_number": getattr(o, "order_number", None)
-                for n, o in enumerate(cl.result_list)
-            },
-            **{
-                f"form-{n}-delivery_shift": getattr(o, "delivery_shift_id", None)
-                for n, o in enumerate(cl.result_list)
-            },
-            **{
-                f"form-{n}-recipient_phone_number": getattr(
-                    o, "recipient_phone_number", None
-                )
-                for n, o in enumerate(cl.result_list)
-            },
-            **{
-                f"form-{n}-online_id": getattr(o, "online_id", None)
-                for n, o in enumerate(cl.result_list)
-            },
-        },
+        data=get_new_order_formset_data(cl.result_list),
         auto_id="order_number",
     )
 
@@ -448,4 +798,7 @@ def NewOrderView(request):
 
     request.current_app = "Orders"
 
-    return TemplateResponse(request, "admin/change_list.html", context)
+    response = TemplateResponse(request, "admin/change_list.html", context)
+    # admin_view adds this for the sync view
+    add_never_cache_headers(response)
+    return response
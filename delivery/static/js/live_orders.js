@@ -0,0 +1,70 @@
+/* Live updates for the New Order page, pushed over the websocket feed. */
+(function () {
+  const scheme = window.location.protocol === "https:" ? "wss" : "ws";
+  const feedUrl = `${scheme}://${window.location.host}/ws/delivery/live/orders`;
+  const newOrders = new Map();
+  let shownOrders;
+  let banner;
+
+  function showNewOrders(orders) {
+    orders.forEach((order) => {
+      if (!shownOrders.has(order.order_number)) {
+        newOrders.set(order.order_number, order);
+      }
+    });
+    if (!newOrders.size) {
+      return;
+    }
+    if (!banner) {
+      banner = document.createElement("ul");
+      banner.className = "messagelist";
+      document.getElementById("content").prepend(banner);
+    }
+    const names = Array.from(newOrders.values())
+      .map((order) => order.recipient_name || order.order_number)
+      .join(", ");
+    const plural = newOrders.size === 1 ? "" : "s";
+    banner.innerHTML = `<li class="info">${newOrders.size} new order${plural}: <span></span>. <a href="">Reload</a></li>`;
+    banner.querySelector("span").textContent = names;
+  }
+
+  function updateShifts(shifts) {
+    shifts.forEach((shift) => {
+      document
+        .querySelectorAll(`select[name$="-delivery_shift"] option[value="${shift.id}"]`)
+        .forEach((option) => {
+          option.textContent = shift.label;
+        });
+    });
+  }
+
+  function connect(delay) {
+    const socket = new WebSocket(feedUrl);
+    socket.onopen = () => {
+      delay = 1000;
+    };
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.type === "orders" || message.type === "new_orders") {
+        showNewOrders(message.orders);
+      } else if (message.type === "shifts") {
+        updateShifts(message.shifts);
+      }
+    };
+    socket.onclose = (event) => {
+      // 4403: not allowed, don't keep retrying
+      if (event.code !== 4403) {
+        setTimeout(() => connect(Math.min(delay * 2, 60000)), delay);
+      }
+    };
+  }
+
+  document.addEventListener("DOMContentLoaded", () => {
+    shownOrders = new Set(
+      Array.from(document.querySelectorAll('input[name$="-order_number"]')).map(
+        (input) => input.value
+      )
+    );
+    connect(1000);
+  });
+})();
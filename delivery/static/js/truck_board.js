@@ -0,0 +1,79 @@
+/* Live truck board, kept current by route changes pushed over the websocket feed. */
+(function () {
+  const scheme = window.location.protocol === "https:" ? "wss" : "ws";
+  const feedUrl = `${scheme}://${window.location.host}/ws/delivery/live/trucks`;
+  const STATES = ["Unassigned", "Assigned", "On the way", "Done"];
+  const COMPLETED = 3;
+  const workers = new Map();
+  const tasks = new Map();
+  const board = document.getElementById("board");
+  const status = document.getElementById("board-status");
+
+  function applyRoute(message) {
+    Object.entries(message.workers).forEach(([id, worker]) => workers.set(id, worker));
+    Object.entries(message.tasks).forEach(([id, task]) => tasks.set(id, task));
+    message.removed_workers.forEach((id) => workers.delete(id));
+    message.removed_tasks.forEach((id) => tasks.delete(id));
+    render();
+  }
+
+  function workerTasks(worker) {
+    // the worker's queue in order, then what they've finished
+    const queued = worker.tasks.map((id) => tasks.get(id)).filter(Boolean);
+    const done = Array.from(tasks.values()).filter(
+      (task) => task.worker === worker.id && task.state === COMPLETED
+    );
+    return queued.concat(done);
+  }
+
+  function render() {
+    const sections = Array.from(workers.values())
+      .sort((a, b) => a.name.localeCompare(b.name))
+      .map((worker) => {
+        const section = document.createElement("div");
+        section.className = "truck";
+        const rows = workerTasks(worker);
+        const done = rows.filter((task) => task.state === COMPLETED).length;
+        const heading = document.createElement("h2");
+        heading.textContent = `${worker.name} (${done}/${rows.length})`;
+        const list = document.createElement("ol");
+        rows.forEach((task) => {
+          const item = document.createElement("li");
+          item.className = `task-state-${task.state}`;
+          const name = task.recipient_name || "Unknown";
+          const order = task.order_number ? ` (${task.order_number})` : "";
+          item.textContent = `${name}${order} - ${STATES[task.state]}`;
+          list.appendChild(item);
+        });
+        section.append(heading, list);
+        return section;
+      });
+    board.replaceChildren(...sections);
+  }
+
+  function connect(delay) {
+    const socket = new WebSocket(feedUrl);
+    socket.onopen = () => {
+      delay = 1000;
+      status.textContent = "Live";
+      // the feed starts with the whole board
+      workers.clear();
+      tasks.clear();
+    };
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.type === "route") {
+        applyRoute(message);
+      }
+    };
+    socket.onclose = (event) => {
+      status.textContent = "Disconnected";
+      // 4403: not allowed, don't keep retrying
+      if (event.code !== 4403) {
+        setTimeout(() => connect(Math.min(delay * 2, 60000)), delay);
+      }
+    };
+  }
+
+  connect(1000);
+})();